@@ -133,7 +133,7 @@ from cephadmlib.logging import (
     Highlight,
     LogDestination,
 )
-from cephadmlib.systemd import check_unit, check_units, terminate_service
+from cephadmlib.systemd import check_unit, check_unit_states, check_units, terminate_service
 from cephadmlib import systemd_unit
 from cephadmlib import runscripts
 from cephadmlib.container_types import (
@@ -182,7 +182,8 @@ from cephadmlib.daemons import (
     Tracing,
     NodeProxy,
 )
-from cephadmlib.agent import http_query
+from cephadmlib.agent import http_query, metadata_payload
+from cephadmlib.image_cache import ImageCache
 
 
 FuncT = TypeVar('FuncT', bound=Callable)
@@ -1449,6 +1450,8 @@ class CephadmAgent(DaemonForm):
         self.recent_iteration_run_times: List[float] = [0.0, 0.0, 0.0]
         self.recent_iteration_index: int = 0
         self.cached_ls_values: Dict[str, Dict[str, str]] = {}
+        # digests of the metadata sections the mgr has for this host
+        self.mgr_digests: Dict[str, str] = {}
         self.ssl_ctx = ssl.create_default_context()
         self.ssl_ctx.check_hostname = True
         self.ssl_ctx.verify_mode = ssl.CERT_REQUIRED
@@ -1582,13 +1585,18 @@ class CephadmAgent(DaemonForm):
                 for k, v in networks[key].items():
                     networks_list[key][k] = list(v)
 
+            # only the sections that changed since the mgr last had them are sent
+            metadata, digests = metadata_payload({
+                'ls': (self.ls_gatherer.data if self.ack == self.ls_gatherer.ack
+                       and self.ls_gatherer.data is not None else []),
+                'networks': networks_list,
+                'facts': HostFacts(self.ctx).dump(),
+                'volume': (self.volume_gatherer.data if self.ack == self.volume_gatherer.ack
+                           and self.volume_gatherer.data is not None else ''),
+            }, self.mgr_digests)
             data = json.dumps({'host': self.host,
-                               'ls': (self.ls_gatherer.data if self.ack == self.ls_gatherer.ack
-                                      and self.ls_gatherer.data is not None else []),
-                               'networks': networks_list,
-                               'facts': HostFacts(self.ctx).dump(),
-                               'volume': (self.volume_gatherer.data if self.ack == self.volume_gatherer.ack
-                                          and self.volume_gatherer.data is not None else ''),
+                               **metadata,
+                               'digests': digests,
                                'ack': str(ack),
                                'keyring': self.keyring,
                                'port': self.listener_port})
@@ -1605,10 +1613,13 @@ class CephadmAgent(DaemonForm):
                     logger.error(f'HTTP error {status} while querying agent endpoint: {response}')
                     raise RuntimeError(f'non-200 response <{status}> from agent endpoint: {response}')
                 response_json = json.loads(response)
+                self.mgr_digests = response_json.get('digests', {})
                 total_request_time = datetime.timedelta(seconds=(time.monotonic() - send_time)).total_seconds()
                 logger.info(f'Received mgr response: "{response_json["result"]}" {total_request_time} seconds after sending request.')
             except Exception as e:
                 logger.error(f'Failed to send metadata to mgr: {e}')
+                # the next report is a full one
+                self.mgr_digests = {}
 
             end_time = time.monotonic()
             run_time = datetime.timedelta(seconds=(end_time - start_time))
@@ -1961,6 +1972,12 @@ def command_inspect_image(ctx):
         return errno.ENOENT
     info_from = get_image_info_from_inspect(out.strip(), ctx.image)
 
+    # a pull may have added repo digests to the image
+    if info_from.get('image_id'):
+        image_cache = ImageCache.for_ctx(ctx)
+        image_cache.forget_digests(cast(str, info_from['image_id']))
+        image_cache.save()
+
     ver = CephContainer(ctx, ctx.image, 'ceph', ['--version']).run().strip()
     info_from['ceph_version'] = ver
 
@@ -3436,37 +3453,12 @@ def list_daemons(
     legacy_dir: Optional[str] = None,
     daemon_name: Optional[str] = None,
 ) -> List[Dict[str, str]]:
-    host_version: Optional[str] = None
-    ls = []
-    container_path = ctx.container_engine.path
+    ls = []  # type: List[Dict[str, Any]]
 
     data_dir = ctx.data_dir
     if legacy_dir is not None:
         data_dir = os.path.abspath(legacy_dir + data_dir)
 
-    # keep track of ceph versions we see
-    seen_versions = {}  # type: Dict[str, Optional[str]]
-
-    # keep track of image digests
-    seen_digests = {}   # type: Dict[str, List[str]]
-
-    # keep track of memory and cpu usage we've seen
-    seen_memusage = {}  # type: Dict[str, int]
-    seen_cpuperc = {}  # type: Dict[str, str]
-    out, err, code = call(
-        ctx,
-        [container_path, 'stats', '--format', '{{.ID}},{{.MemUsage}}', '--no-stream'],
-        verbosity=CallVerbosity.QUIET
-    )
-    seen_memusage_cid_len, seen_memusage = _parse_mem_usage(code, out)
-
-    out, err, code = call(
-        ctx,
-        [container_path, 'stats', '--format', '{{.ID}},{{.CPUPerc}}', '--no-stream'],
-        verbosity=CallVerbosity.QUIET
-    )
-    seen_cpuperc_cid_len, seen_cpuperc = _parse_cpu_perc(code, out)
-
     # /var/lib/ceph
     if os.path.exists(data_dir):
         for i in os.listdir(data_dir):
@@ -3480,25 +3472,12 @@ def list_daemons(
                                                   cluster, daemon_type, daemon_id,
                                                   legacy_dir=legacy_dir)
                     legacy_unit_name = 'ceph-%s@%s' % (daemon_type, daemon_id)
-                    val: Dict[str, Any] = {
+                    ls.append({
                         'style': 'legacy',
                         'name': '%s.%s' % (daemon_type, daemon_id),
                         'fsid': fsid if fsid is not None else 'unknown',
                         'systemd_unit': legacy_unit_name,
-                    }
-                    if detail:
-                        (val['enabled'], val['state'], _) = check_unit(ctx, legacy_unit_name)
-                        if not host_version:
-                            try:
-                                out, err, code = call(ctx,
-                                                      ['ceph', '-v'],
-                                                      verbosity=CallVerbosity.QUIET)
-                                if not code and out.startswith('ceph version '):
-                                    host_version = out.split(' ')[2]
-                            except Exception:
-                                pass
-                        val['host_version'] = host_version
-                    ls.append(val)
+                    })
             elif is_fsid(i):
                 fsid = str(i)  # convince mypy that fsid is a str here
                 for j in os.listdir(os.path.join(data_dir, i)):
@@ -3512,158 +3491,253 @@ def list_daemons(
                                                   daemon_id)
                     else:
                         continue
-                    val = {
+                    ls.append({
                         'style': 'cephadm:v1',
                         'name': name,
                         'fsid': fsid,
                         'systemd_unit': unit_name,
-                    }
-                    if detail:
-                        # get container id
-                        (val['enabled'], val['state'], _) = check_unit(ctx, unit_name)
-                        container_id = None
-                        image_name = None
-                        image_id = None
-                        image_digests = None
-                        version = None
-                        start_stamp = None
-
-                        out, err, code = get_container_stats(ctx, container_path, fsid, daemon_type, daemon_id)
-                        if not code:
-                            (container_id, image_name, image_id, start,
-                             version) = out.strip().split(',')
-                            image_id = normalize_container_id(image_id)
-                            daemon_type = name.split('.', 1)[0]
-                            start_stamp = try_convert_datetime(start)
-
-                            # collect digests for this image id
-                            image_digests = seen_digests.get(image_id)
-                            if not image_digests:
-                                out, err, code = call(
-                                    ctx,
-                                    [
-                                        container_path, 'image', 'inspect', image_id,
-                                        '--format', '{{.RepoDigests}}',
-                                    ],
-                                    verbosity=CallVerbosity.QUIET)
-                                if not code:
-                                    image_digests = list(set(map(
-                                        normalize_image_digest,
-                                        out.strip()[1:-1].split(' '))))
-                                    seen_digests[image_id] = image_digests
-
-                            # identify software version inside the container (if we can)
-                            if not version or '.' not in version:
-                                version = seen_versions.get(image_id, None)
-                            if daemon_type == NFSGanesha.daemon_type:
-                                version = NFSGanesha.get_version(ctx, container_id)
-                            if daemon_type == CephIscsi.daemon_type:
-                                version = CephIscsi.get_version(ctx, container_id)
-                            if daemon_type == CephNvmeof.daemon_type:
-                                version = CephNvmeof.get_version(ctx, container_id)
-                            if daemon_type == SMB.daemon_type:
-                                version = SMB.get_version(ctx, container_id)
-                            elif not version:
-                                if daemon_type in ceph_daemons():
-                                    out, err, code = call(ctx,
-                                                          [container_path, 'exec', container_id,
-                                                           'ceph', '-v'],
-                                                          verbosity=CallVerbosity.QUIET)
-                                    if not code and \
-                                       out.startswith('ceph version '):
-                                        version = out.split(' ')[2]
-                                        seen_versions[image_id] = version
-                                elif daemon_type == 'grafana':
-                                    out, err, code = call(ctx,
-                                                          [container_path, 'exec', container_id,
-                                                           'grafana', 'server', '-v'],
-                                                          verbosity=CallVerbosity.QUIET)
-                                    if not code and \
-                                       out.startswith('Version '):
-                                        version = out.split(' ')[1]
-                                        seen_versions[image_id] = version
-                                elif daemon_type in ['prometheus',
-                                                     'alertmanager',
-                                                     'node-exporter',
-                                                     'loki',
-                                                     'promtail']:
-                                    version = Monitoring.get_version(ctx, container_id, daemon_type)
-                                    seen_versions[image_id] = version
-                                elif daemon_type == 'haproxy':
-                                    out, err, code = call(ctx,
-                                                          [container_path, 'exec', container_id,
-                                                           'haproxy', '-v'],
-                                                          verbosity=CallVerbosity.QUIET)
-                                    if not code and \
-                                       out.startswith('HA-Proxy version ') or \
-                                       out.startswith('HAProxy version '):
-                                        version = out.split(' ')[2]
-                                        seen_versions[image_id] = version
-                                elif daemon_type == 'keepalived':
-                                    out, err, code = call(ctx,
-                                                          [container_path, 'exec', container_id,
-                                                           'keepalived', '--version'],
-                                                          verbosity=CallVerbosity.QUIET)
-                                    if not code and \
-                                       err.startswith('Keepalived '):
-                                        version = err.split(' ')[1]
-                                        if version[0] == 'v':
-                                            version = version[1:]
-                                        seen_versions[image_id] = version
-                                elif daemon_type == CustomContainer.daemon_type:
-                                    # Because a custom container can contain
-                                    # everything, we do not know which command
-                                    # to execute to get the version.
-                                    pass
-                                elif daemon_type == SNMPGateway.daemon_type:
-                                    version = SNMPGateway.get_version(ctx, fsid, daemon_id)
-                                    seen_versions[image_id] = version
-                                elif daemon_type == MgmtGateway.daemon_type:
-                                    version = MgmtGateway.get_version(ctx, container_id)
-                                    seen_versions[image_id] = version
-                                elif daemon_type == OAuth2Proxy.daemon_type:
-                                    version = OAuth2Proxy.get_version(ctx, container_id)
-                                    seen_versions[image_id] = version
-                                else:
-                                    logger.warning('version for unknown daemon type %s' % daemon_type)
-                        else:
-                            vfile = os.path.join(data_dir, fsid, j, 'unit.image')  # type: ignore
-                            try:
-                                with open(vfile, 'r') as f:
-                                    image_name = f.read().strip() or None
-                            except IOError:
-                                pass
-
-                        # unit.meta?
-                        mfile = os.path.join(data_dir, fsid, j, 'unit.meta')  # type: ignore
-                        try:
-                            with open(mfile, 'r') as f:
-                                meta = json.loads(f.read())
-                                val.update(meta)
-                        except IOError:
-                            pass
-
-                        val['container_id'] = container_id
-                        val['container_image_name'] = image_name
-                        val['container_image_id'] = image_id
-                        val['container_image_digests'] = image_digests
-                        if container_id:
-                            val['memory_usage'] = seen_memusage.get(container_id[0:seen_memusage_cid_len])
-                            val['cpu_percentage'] = seen_cpuperc.get(container_id[0:seen_cpuperc_cid_len])
-                        val['version'] = version
-                        val['started'] = start_stamp
-                        val['created'] = get_file_timestamp(
-                            os.path.join(data_dir, fsid, j, 'unit.created')
-                        )
-                        val['deployed'] = get_file_timestamp(
-                            os.path.join(data_dir, fsid, j, 'unit.image'))
-                        val['configured'] = get_file_timestamp(
-                            os.path.join(data_dir, fsid, j, 'unit.configured'))
-                    ls.append(val)
+                    })
 
+    if detail:
+        _add_daemon_details(ctx, ls, data_dir)
     return ls
 
 
+def _add_daemon_details(ctx: CephadmContext, ls: List[Dict[str, Any]], data_dir: str) -> None:
+    """Add the state of their units, containers and images to the daemons in
+    ls. The unit states, the containers and the image digests of all the
+    daemons are each looked up with a single call."""
+    host_version: Optional[str] = None
+    container_path = ctx.container_engine.path
+
+    # keep track of ceph versions we see
+    seen_versions = {}  # type: Dict[str, Optional[str]]
+
+    # digests and versions seen by earlier invocations, by image id
+    image_cache = ImageCache.for_ctx(ctx)
+
+    # keep track of memory and cpu usage we've seen
+    seen_memusage = {}  # type: Dict[str, int]
+    seen_cpuperc = {}  # type: Dict[str, str]
+    out, err, code = call(
+        ctx,
+        [container_path, 'stats', '--format', '{{.ID}},{{.MemUsage}}', '--no-stream'],
+        verbosity=CallVerbosity.QUIET
+    )
+    seen_memusage_cid_len, seen_memusage = _parse_mem_usage(code, out)
+
+    out, err, code = call(
+        ctx,
+        [container_path, 'stats', '--format', '{{.ID}},{{.CPUPerc}}', '--no-stream'],
+        verbosity=CallVerbosity.QUIET
+    )
+    seen_cpuperc_cid_len, seen_cpuperc = _parse_cpu_perc(code, out)
+
+    unit_states = check_unit_states(ctx, [val['systemd_unit'] for val in ls])
+
+    idents = [
+        DaemonIdentity(val['fsid'], *val['name'].split('.', 1))
+        for val in ls if val['style'] != 'legacy'
+    ]
+    container_stats = get_container_stats_bulk(
+        ctx, container_path,
+        [n for ident in idents for n in (ident.container_name, ident.legacy_container_name)])
+
+    # keep track of image digests
+    seen_digests = {}  # type: Dict[str, List[str]]
+    image_ids = {normalize_container_id(stats.split(',')[2])
+                 for stats in (container_stats or {}).values()}
+    for image_id in image_ids:
+        cached_digests = image_cache.get_digests(image_id)
+        if cached_digests:
+            seen_digests[image_id] = cached_digests
+    seen_digests.update(get_image_digests(
+        ctx, container_path, sorted(image_ids - set(seen_digests))))
+
+    for val in ls:
+        (val['enabled'], val['state'], _) = unit_states[val['systemd_unit']]
+        if val['style'] == 'legacy':
+            if not host_version:
+                try:
+                    out, err, code = call(ctx,
+                                          ['ceph', '-v'],
+                                          verbosity=CallVerbosity.QUIET)
+                    if not code and out.startswith('ceph version '):
+                        host_version = out.split(' ')[2]
+                except Exception:
+                    pass
+            val['host_version'] = host_version
+            continue
+
+        fsid = val['fsid']
+        j = val['name']
+        (daemon_type, daemon_id) = j.split('.', 1)
+
+        # get container id
+        container_id = None
+        image_name = None
+        image_id = None
+        image_digests = None
+        version = None
+        start_stamp = None
+
+        if container_stats is None:
+            out, err, code = get_container_stats(ctx, container_path, fsid, daemon_type, daemon_id)
+        else:
+            ident = DaemonIdentity(fsid, daemon_type, daemon_id)
+            out = container_stats.get(ident.container_name) \
+                or container_stats.get(ident.legacy_container_name, '')
+            code = 0 if out else 1
+        if not code:
+            (container_id, image_name, image_id, start,
+             version) = out.strip().split(',')
+            image_id = normalize_container_id(image_id)
+            start_stamp = try_convert_datetime(start)
+
+            # collect digests for this image id
+            image_digests = seen_digests.get(image_id)
+            if not image_digests:
+                out, err, code = call(
+                    ctx,
+                    [
+                        container_path, 'image', 'inspect', image_id,
+                        '--format', '{{.RepoDigests}}',
+                    ],
+                    verbosity=CallVerbosity.QUIET)
+                if not code:
+                    image_digests = list(set(map(
+                        normalize_image_digest,
+                        out.strip()[1:-1].split(' '))))
+                    seen_digests[image_id] = image_digests
+            if image_digests:
+                image_cache.set_digests(image_id, image_digests)
+
+            # identify software version inside the container (if we can)
+            if not version or '.' not in version:
+                version = seen_versions.get(image_id, None)
+            cached_version = image_cache.get_version(image_id, daemon_type)
+            if cached_version:
+                version = cached_version
+            else:
+                if daemon_type == NFSGanesha.daemon_type:
+                    version = NFSGanesha.get_version(ctx, container_id)
+                if daemon_type == CephIscsi.daemon_type:
+                    version = CephIscsi.get_version(ctx, container_id)
+                if daemon_type == CephNvmeof.daemon_type:
+                    version = CephNvmeof.get_version(ctx, container_id)
+                if daemon_type == SMB.daemon_type:
+                    version = SMB.get_version(ctx, container_id)
+                elif not version:
+                    if daemon_type in ceph_daemons():
+                        out, err, code = call(ctx,
+                                              [container_path, 'exec', container_id,
+                                               'ceph', '-v'],
+                                              verbosity=CallVerbosity.QUIET)
+                        if not code and \
+                           out.startswith('ceph version '):
+                            version = out.split(' ')[2]
+                            seen_versions[image_id] = version
+                    elif daemon_type == 'grafana':
+                        out, err, code = call(ctx,
+                                              [container_path, 'exec', container_id,
+                                               'grafana', 'server', '-v'],
+                                              verbosity=CallVerbosity.QUIET)
+                        if not code and \
+                           out.startswith('Version '):
+                            version = out.split(' ')[1]
+                            seen_versions[image_id] = version
+                    elif daemon_type in ['prometheus',
+                                         'alertmanager',
+                                         'node-exporter',
+                                         'loki',
+                                         'promtail']:
+                        version = Monitoring.get_version(ctx, container_id, daemon_type)
+                        seen_versions[image_id] = version
+                    elif daemon_type == 'haproxy':
+                        out, err, code = call(ctx,
+                                              [container_path, 'exec', container_id,
+                                               'haproxy', '-v'],
+                                              verbosity=CallVerbosity.QUIET)
+                        if not code and \
+                           out.startswith('HA-Proxy version ') or \
+                           out.startswith('HAProxy version '):
+                            version = out.split(' ')[2]
+                            seen_versions[image_id] = version
+                    elif daemon_type == 'keepalived':
+                        out, err, code = call(ctx,
+                                              [container_path, 'exec', container_id,
+                                               'keepalived', '--version'],
+                                              verbosity=CallVerbosity.QUIET)
+                        if not code and \
+                           err.startswith('Keepalived '):
+                            version = err.split(' ')[1]
+                            if version[0] == 'v':
+                                version = version[1:]
+                            seen_versions[image_id] = version
+                    elif daemon_type == CustomContainer.daemon_type:
+                        # Because a custom container can contain
+                        # everything, we do not know which command
+                        # to execute to get the version.
+                        pass
+                    elif daemon_type == SNMPGateway.daemon_type:
+                        version = SNMPGateway.get_version(ctx, fsid, daemon_id)
+                        seen_versions[image_id] = version
+                    elif daemon_type == MgmtGateway.daemon_type:
+                        version = MgmtGateway.get_version(ctx, container_id)
+                        seen_versions[image_id] = version
+                    elif daemon_type == OAuth2Proxy.daemon_type:
+                        version = OAuth2Proxy.get_version(ctx, container_id)
+                        seen_versions[image_id] = version
+                    else:
+                        logger.warning('version for unknown daemon type %s' % daemon_type)
+                if version:
+                    image_cache.set_version(image_id, daemon_type, version)
+        else:
+            vfile = os.path.join(data_dir, fsid, j, 'unit.image')  # type: ignore
+            try:
+                with open(vfile, 'r') as f:
+                    image_name = f.read().strip() or None
+            except IOError:
+                pass
+
+        # unit.meta?
+        mfile = os.path.join(data_dir, fsid, j, 'unit.meta')  # type: ignore
+        try:
+            with open(mfile, 'r') as f:
+                meta = json.loads(f.read())
+                val.update(meta)
+        except IOError:
+            pass
+
+        val['container_id'] = container_id
+        val['container_image_name'] = image_name
+        val['container_image_id'] = image_id
+        val['container_image_digests'] = image_digests
+        if container_id:
+            val['memory_usage'] = seen_memusage.get(container_id[0:seen_memusage_cid_len])
+            val['cpu_percentage'] = seen_cpuperc.get(container_id[0:seen_cpuperc_cid_len])
+        val['version'] = version
+        val['started'] = start_stamp
+        val['created'] = get_file_timestamp(
+            os.path.join(data_dir, fsid, j, 'unit.created')
+        )
+        val['deployed'] = get_file_timestamp(
+            os.path.join(data_dir, fsid, j, 'unit.image'))
+        val['configured'] = get_file_timestamp(
+            os.path.join(data_dir, fsid, j, 'unit.configured'))
+
+    if image_cache.changed:
+        # forget about the images that were removed
+        out, err, code = call(
+            ctx,
+            [container_path, 'images', '-q', '--no-trunc'],
+            verbosity=CallVerbosity.QUIET
+        )
+        if not code:
+            image_cache.prune(normalize_container_id(i) for i in out.split())
+    image_cache.save()
+
+
 def _parse_mem_usage(code: int, out: str) -> Tuple[int, Dict[str, int]]:
     # keep track of memory usage we've seen
     seen_memusage = {}  # type: Dict[str, int]
@@ -3710,6 +3784,9 @@ def get_daemon_description(ctx, fsid, name, detail=False, legacy_dir=None):
     raise Error('Daemon not found: {}. See `cephadm ls`'.format(name))
 
 
+CONTAINER_STATS_FORMAT = '{{.Id}},{{.Config.Image}},{{.Image}},{{.Created}},{{index .Config.Labels "io.ceph.version"}}'
+
+
 def get_container_stats(ctx: CephadmContext, container_path: str, fsid: str, daemon_type: str, daemon_id: str) -> Tuple[str, str, int]:
     """returns container id, image name, image id, created time, and ceph version if available"""
     c = CephContainer.for_daemon(
@@ -3719,7 +3796,7 @@ def get_container_stats(ctx: CephadmContext, container_path: str, fsid: str, dae
     for name in (c.cname, c.old_cname):
         cmd = [
             container_path, 'inspect',
-            '--format', '{{.Id}},{{.Config.Image}},{{.Image}},{{.Created}},{{index .Config.Labels "io.ceph.version"}}',
+            '--format', CONTAINER_STATS_FORMAT,
             name
         ]
         out, err, code = call(ctx, cmd, verbosity=CallVerbosity.QUIET)
@@ -3728,6 +3805,58 @@ def get_container_stats(ctx: CephadmContext, container_path: str, fsid: str, dae
     return out, err, code
 
 
+def get_container_stats_bulk(ctx: CephadmContext, container_path: str, names: List[str]) -> Optional[Dict[str, str]]:
+    """returns what get_container_stats returns for each of the containers
+    named in names that exists, by container name, using a single inspect
+    call. Returns None if the containers could not be inspected."""
+    out, err, code = call(
+        ctx,
+        [container_path, 'ps', '-a', '--no-trunc', '--format', '{{.Names}}'],
+        verbosity=CallVerbosity.QUIET
+    )
+    if code:
+        return None
+    wanted = set(names)
+    existing = [name for name in out.split() if name in wanted]
+    stats: Dict[str, str] = {}
+    if not existing:
+        return stats
+    out, err, code = call(
+        ctx,
+        [container_path, 'inspect', '--format', '{{.Name}},' + CONTAINER_STATS_FORMAT] + existing,
+        verbosity=CallVerbosity.QUIET
+    )
+    if code:
+        # e.g. a container went away since we listed them
+        return None
+    for line in out.splitlines():
+        name, _, container_stats = line.partition(',')
+        # docker prefixes container names with a '/'
+        stats[name.lstrip('/')] = container_stats
+    return stats
+
+
+def get_image_digests(ctx: CephadmContext, container_path: str, image_ids: List[str]) -> Dict[str, List[str]]:
+    """returns the repo digests of the images, by image id, using a single
+    image inspect call"""
+    digests: Dict[str, List[str]] = {}
+    if not image_ids:
+        return digests
+    out, err, code = call(
+        ctx,
+        [container_path, 'image', 'inspect', '--format', '{{.Id}},{{.RepoDigests}}'] + image_ids,
+        verbosity=CallVerbosity.QUIET
+    )
+    if code:
+        return digests
+    for line in out.splitlines():
+        image_id, _, repo_digests = line.partition(',')
+        digests[normalize_container_id(image_id)] = list(set(map(
+            normalize_image_digest,
+            repo_digests.strip()[1:-1].split(' '))))
+    return digests
+
+
 def get_container_stats_by_image_name(ctx: CephadmContext, container_path: str, image_name: str) -> Tuple[str, str, int]:
     """returns image id, created time, and ceph version if available"""
     out, err, code = '', '', -1
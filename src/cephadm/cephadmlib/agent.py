@@ -1,11 +1,40 @@
 from urllib.error import HTTPError, URLError
 from urllib.request import urlopen, Request
-from typing import Optional, Any, Tuple
+from typing import Dict, Optional, Any, Tuple
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger()
 
 
+def metadata_digest(value: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def metadata_payload(
+    metadata: Dict[str, Any], mgr_digests: Dict[str, str]
+) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Return the sections of ``metadata`` that differ from what the mgr
+    has, according to the digests it sent back for the previous report,
+    and the digests of all sections. Empty sections carry no data yet and
+    are always sent, without a digest.
+    """
+    payload: Dict[str, Any] = {}
+    digests: Dict[str, str] = {}
+    for section, value in metadata.items():
+        if not value:
+            payload[section] = value
+            continue
+        digests[section] = metadata_digest(value)
+        if mgr_digests.get(section) != digests[section]:
+            payload[section] = value
+    return payload, digests
+
+
 def http_query(
     addr: str = '',
     port: str = '',
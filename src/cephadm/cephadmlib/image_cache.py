@@ -0,0 +1,109 @@
+# image_cache.py - on-disk cache of what cephadm learned about container images
+
+import json
+import logging
+import os
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from .constants import DATA_DIR_MODE
+from .context import CephadmContext
+from .file_utils import write_new
+
+logger = logging.getLogger()
+
+IMAGE_CACHE_DIR = 'cephadm'
+IMAGE_CACHE_FILE = 'images.json'
+
+
+class ImageCache:
+    """What cephadm learned about container images, by image id: their repo
+    digests and the versions of the daemons running them.
+
+    Most daemons only tell their version when cephadm exec's a command in
+    their container. The cache is kept in the cephadm data dir, so that
+    happens once per image rather than on every `cephadm ls`. The same
+    image can run daemons that report different versions (e.g. ceph and
+    nfs), so versions are kept by daemon type. An image id identifies the
+    content of an image, so versions never go stale; the entries of removed
+    images are dropped with prune().
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._images: Optional[Dict[str, Dict[str, Any]]] = None
+        self.changed = False
+
+    @classmethod
+    def for_ctx(cls, ctx: CephadmContext) -> 'ImageCache':
+        return cls(
+            os.path.join(ctx.data_dir, IMAGE_CACHE_DIR, IMAGE_CACHE_FILE)
+        )
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._images is None:
+            self._images = {}
+            try:
+                with open(self.path, 'r') as f:
+                    images = json.load(f).get('images', {})
+                self._images = {
+                    k: v for k, v in images.items() if isinstance(v, dict)
+                }
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, AttributeError) as e:
+                logger.debug('ignoring image cache %s: %s', self.path, e)
+        return self._images
+
+    def _entry(self, image_id: str) -> Dict[str, Any]:
+        return self._load().setdefault(image_id, {})
+
+    def get_digests(self, image_id: str) -> Optional[List[str]]:
+        return self._load().get(image_id, {}).get('digests')
+
+    def set_digests(self, image_id: str, digests: List[str]) -> None:
+        entry = self._entry(image_id)
+        if entry.get('digests') != digests:
+            entry['digests'] = digests
+            self.changed = True
+
+    def get_version(self, image_id: str, daemon_type: str) -> Optional[str]:
+        return (
+            self._load()
+            .get(image_id, {})
+            .get('versions', {})
+            .get(daemon_type)
+        )
+
+    def set_version(
+        self, image_id: str, daemon_type: str, version: str
+    ) -> None:
+        versions = self._entry(image_id).setdefault('versions', {})
+        if versions.get(daemon_type) != version:
+            versions[daemon_type] = version
+            self.changed = True
+
+    def forget_digests(self, image_id: str) -> None:
+        if self._load().get(image_id, {}).pop('digests', None) is not None:
+            self.changed = True
+
+    def prune(self, image_ids: Iterable[str]) -> None:
+        """Drop the entries of all images but image_ids."""
+        images = self._load()
+        for image_id in set(images) - set(image_ids):
+            del images[image_id]
+            self.changed = True
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        try:
+            os.makedirs(
+                os.path.dirname(self.path), mode=DATA_DIR_MODE, exist_ok=True
+            )
+            with write_new(self.path) as f:
+                json.dump({'images': self._images}, f)
+            self.changed = False
+        except OSError as e:
+            # e.g. not running as root; the cache is only an optimization
+            logger.debug('unable to write image cache %s: %s', self.path, e)
@@ -2,7 +2,7 @@
 
 import logging
 
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
 
 from .context import CephadmContext
 from .call_wrappers import call, CallVerbosity
@@ -41,21 +41,74 @@ def check_unit(ctx, unit_name):
             ['systemctl', 'is-active', unit_name],
             verbosity=CallVerbosity.QUIET,
         )
-        out = out.strip()
-        if out in ['active']:
-            state = 'running'
-        elif out in ['inactive']:
-            state = 'stopped'
-        elif out in ['failed', 'auto-restart']:
-            state = 'error'
-        else:
-            state = 'unknown'
+        state = _unit_state(out.strip())
     except Exception as e:
         logger.warning('unable to run systemctl: %s' % e)
         state = 'unknown'
     return (enabled, state, installed)
 
 
+def _unit_state(active_state):
+    # type: (str) -> str
+    if active_state in ['active']:
+        return 'running'
+    elif active_state in ['inactive']:
+        return 'stopped'
+    elif active_state in ['failed', 'auto-restart']:
+        return 'error'
+    return 'unknown'
+
+
+# the unit file states `systemctl is-enabled` exits 0 for
+_ENABLED_UNIT_FILE_STATES = [
+    'enabled',
+    'enabled-runtime',
+    'alias',
+    'static',
+    'indirect',
+    'generated',
+    'transient',
+]
+
+
+def check_unit_states(ctx, unit_names):
+    # type: (CephadmContext, List[str]) -> Dict[str, Tuple[bool, str, bool]]
+    """Like check_unit, for all of unit_names with a single `systemctl show`
+    call. Falls back to check_unit for every unit if that fails.
+    """
+    states = {}  # type: Dict[str, Tuple[bool, str, bool]]
+    if not unit_names:
+        return states
+    blocks = []  # type: List[str]
+    try:
+        out, err, code = call(
+            ctx,
+            ['systemctl', 'show', '--property=Id,UnitFileState,ActiveState']
+            + unit_names,
+            verbosity=CallVerbosity.QUIET,
+        )
+        if code == 0:
+            # one block of properties per unit, in the order of unit_names
+            blocks = out.strip().split('\n\n')
+    except Exception as e:
+        logger.warning('unable to run systemctl: %s' % e)
+    if len(blocks) != len(unit_names):
+        return {u: check_unit(ctx, u) for u in unit_names}
+    for unit_name, block in zip(unit_names, blocks):
+        props = dict(
+            line.split('=', 1) for line in block.splitlines() if '=' in line
+        )
+        unit_file_state = props.get('UnitFileState', '')
+        enabled = unit_file_state in _ENABLED_UNIT_FILE_STATES
+        installed = enabled or unit_file_state == 'disabled'
+        states[unit_name] = (
+            enabled,
+            _unit_state(props.get('ActiveState', '')),
+            installed,
+        )
+    return states
+
+
 def check_units(ctx, units, enabler=None):
     # type: (CephadmContext, List[str], Optional[Packager]) -> bool
     for u in units:
@@ -4,6 +4,7 @@ import copy, datetime, json, os, socket, threading
 import pytest
 
 from tests.fixtures import with_cephadm_ctx, cephadm_fs, import_cephadm
+from cephadmlib import agent as agent_lib
 
 from typing import Optional
 
@@ -470,7 +471,11 @@ def test_agent_run(_pull_conf_settings, _port_in_use, _gatherer_start,
         }
     }
 
+    mgr_response = {'valid': 'output', 'result': '400'}
+
     class FakeHTTPResponse():
+        status = 200
+
         def __init__(self):
             pass
 
@@ -481,7 +486,7 @@ def test_agent_run(_pull_conf_settings, _port_in_use, _gatherer_start,
             pass
 
         def read(self):
-            return json.dumps({'valid': 'output', 'result': '400'})
+            return json.dumps(mgr_response)
 
     _port_in_use.side_effect = _fake_port_in_use
     _is_alive.return_value = False
@@ -520,12 +525,19 @@ def test_agent_run(_pull_conf_settings, _port_in_use, _gatherer_start,
         with pytest.raises(EventCleared, match='SUCCESS'):
             agent.run()
 
+        digests = {
+           'ls': agent_lib.metadata_digest([{'valid_daemon': 'valid_metadata'}]),
+           'networks': agent_lib.metadata_digest(network_data_no_sets),
+           'facts': agent_lib.metadata_digest('Host Facts'),
+           'volume': agent_lib.metadata_digest('ceph-volume inventory data'),
+        }
         expected_data = {
            'host': host,
            'ls': [{'valid_daemon': 'valid_metadata'}],
            'networks': network_data_no_sets,
            'facts': 'Host Facts',
            'volume': 'ceph-volume inventory data',
+           'digests': digests,
            'ack': str(7),
            'keyring': 'agent keyring',
            'port': str(open_listener_port)
@@ -539,10 +551,27 @@ def test_agent_run(_pull_conf_settings, _port_in_use, _gatherer_start,
         _gatherer_start.assert_called()
         _urlopen.assert_called()
 
+        # sections the mgr already has are left out
+        mgr_response['digests'] = {k: digests[k] for k in ('ls', 'facts')}
+        with pytest.raises(EventCleared, match='SUCCESS'):
+            agent.run()
+        assert agent.mgr_digests == mgr_response['digests']
+        with pytest.raises(EventCleared, match='SUCCESS'):
+            agent.run()
+        expected_data.pop('ls')
+        expected_data.pop('facts')
+        _RQ_init.assert_called_with(
+            f'https://{target_ip}:{target_port}/data',
+            json.dumps(expected_data).encode('ascii'),
+            {'Content-Type': 'application/json'}
+        )
+
         # agent should not go down if connections fail
         _urlopen.side_effect = Exception()
         with pytest.raises(EventCleared, match='SUCCESS'):
             agent.run()
+        # and sends everything once it is back
+        assert agent.mgr_digests == {}
 
         # should fail if no ports are open for listener
         _port_in_use.side_effect = lambda _, __: True
@@ -890,6 +890,74 @@ class TestCephAdm(object):
         s = 'ceph/ceph:latest'
         assert _cephadm.normalize_image_digest(s) == f'{DEFAULT_REGISTRY}/{s}'
 
+    def test_list_daemons_batched(self, cephadm_fs):
+        fsid = '00000000-0000-0000-0000-0000deadbeef'
+        names = ['mon.a', 'osd.1', 'grafana.host1']
+        for name in names:
+            cephadm_fs.create_dir(os.path.join('/var/lib/ceph', fsid, name))
+        containers = {
+            f'ceph-{fsid}-mon-a': 'c1,quay.io/ceph/ceph:v19,sha256:aaa,2024-01-01T00:00:00Z,19.2.0',
+            f'ceph-{fsid}-osd-1': 'c2,quay.io/ceph/ceph:v19,sha256:aaa,2024-01-01T00:00:00Z,19.2.0',
+            f'ceph-{fsid}-grafana-host1': 'c3,quay.io/ceph/grafana:10,sha256:bbb,2024-01-01T00:00:00Z,',
+        }
+        images = ['sha256:aaa', 'sha256:bbb']
+        calls = []
+
+        def _call(ctx, cmd, **kwargs):
+            calls.append(cmd)
+            if cmd[:2] == ['systemctl', 'show']:
+                return '\n\n'.join(
+                    f'Id={u}.service\nActiveState=active\nUnitFileState=enabled'
+                    for u in cmd[3:]), '', 0
+            if cmd[1:3] == ['ps', '-a']:
+                return '\n'.join(list(containers) + ['unrelated']), '', 0
+            if cmd[1] == 'inspect':
+                return ''.join(f'{n},{containers[n]}\n' for n in cmd[4:]), '', 0
+            if cmd[1:3] == ['image', 'inspect']:
+                return ('sha256:aaa,[quay.io/ceph/ceph@sha256:d1]\n'
+                        'sha256:bbb,[quay.io/ceph/grafana@sha256:d2]\n'), '', 0
+            if cmd[1] == 'images':
+                return '\n'.join(images), '', 0
+            if cmd[1] == 'exec':
+                return 'Version 10.4.8 (commit: abc)', '', 0
+            return '', '', 0
+
+        with with_cephadm_ctx(['ls']) as ctx:
+            with mock.patch('cephadm.call', side_effect=_call), \
+                 mock.patch('cephadmlib.systemd.call', side_effect=_call):
+                ls = _cephadm.list_daemons(ctx)
+                assert sorted(d['name'] for d in ls) == sorted(names)
+                by_name = {d['name']: d for d in ls}
+                assert by_name['osd.1']['state'] == 'running'
+                assert by_name['osd.1']['container_id'] == 'c2'
+                assert by_name['osd.1']['version'] == '19.2.0'
+                assert by_name['osd.1']['container_image_digests'] == ['quay.io/ceph/ceph@sha256:d1']
+                assert by_name['grafana.host1']['version'] == '10.4.8'
+                # one call each for units, containers and images
+                assert len([c for c in calls if 'show' in c]) == 1
+                assert len([c for c in calls if 'inspect' in c]) == 2
+                assert len([c for c in calls if 'exec' in c]) == 1
+
+                # digests and the grafana version are cached for the next run
+                calls.clear()
+                ls = _cephadm.list_daemons(ctx)
+                by_name = {d['name']: d for d in ls}
+                assert by_name['grafana.host1']['version'] == '10.4.8'
+                assert by_name['osd.1']['container_image_digests'] == ['quay.io/ceph/ceph@sha256:d1']
+                assert not [c for c in calls if 'exec' in c or 'image' in c]
+
+                # the entries of removed images are dropped when the cache
+                # is written next
+                cache = _cephadm.ImageCache.for_ctx(ctx)
+                assert cache.get_version('bbb', 'grafana') == '10.4.8'
+                images[1] = 'sha256:ccc'
+                containers[f'ceph-{fsid}-grafana-host1'] = 'c4,quay.io/ceph/grafana:11,sha256:ccc,2024-01-01T00:00:00Z,'
+                _cephadm.list_daemons(ctx)
+                cache = _cephadm.ImageCache.for_ctx(ctx)
+                assert cache.get_digests('aaa') == ['quay.io/ceph/ceph@sha256:d1']
+                assert cache.get_version('bbb', 'grafana') is None
+                assert cache.get_version('ccc', 'grafana') == '10.4.8'
+
     @pytest.mark.parametrize('fsid, ceph_conf, list_daemons, result, err, ',
         [
             (
@@ -420,6 +420,55 @@ def test_check_unit(enabled_out, active_out, expected):
     assert (enabled, state, installed) == expected
 
 
+def test_check_unit_states():
+    show_out = "\n".join(
+        [
+            "Id=ceph-x@mon.a.service",
+            "ActiveState=active",
+            "UnitFileState=enabled",
+            "",
+            "Id=ceph-x@osd.1.service",
+            "ActiveState=failed",
+            "UnitFileState=disabled",
+            "",
+            "Id=ceph-x@osd.2.service",
+            "ActiveState=inactive",
+            "UnitFileState=",
+        ]
+    )
+    units = ["ceph-x@mon.a", "ceph-x@osd.1", "ceph-x@osd.2"]
+    with with_cephadm_ctx([]) as ctx:
+        with mock.patch('cephadmlib.systemd.call') as _call:
+            _call.return_value = (show_out, "", 0)
+            states = _cephadm.check_unit_states(ctx, units)
+            assert _call.call_count == 1
+    assert states == {
+        "ceph-x@mon.a": (True, "running", True),
+        "ceph-x@osd.1": (False, "error", True),
+        "ceph-x@osd.2": (False, "stopped", False),
+    }
+
+
+def test_check_unit_states_fallback():
+    with with_cephadm_ctx([]) as ctx:
+        with mock.patch('cephadmlib.systemd.call') as _call:
+            fake_call = _mk_fake_call(
+                enabled=("", "", 0), active=("active", "", 0)
+            )
+
+            def _fake_call(ctx, cmd, **kwargs):
+                if "show" in cmd:
+                    return ("", "unknown option", 1)
+                return fake_call(ctx, cmd, **kwargs)
+
+            _call.side_effect = _fake_call
+            states = _cephadm.check_unit_states(ctx, ["foo", "bar"])
+    assert states == {
+        "foo": (True, "running", True),
+        "bar": (True, "running", True),
+    }
+
+
 class FakeEnabler:
     def __init__(self, should_be_called):
         self._should_be_called = should_be_called
@@ -67,7 +67,7 @@ void ActivePyModule::notify(const std::string &notify_type, const std::string &n
 
   // Execute
   auto pValue = PyObject_CallMethod(pClassInstance,
-       const_cast<char*>("notify"), const_cast<char*>("(ss)"),
+       const_cast<char*>("_dispatch_notify"), const_cast<char*>("(ss)"),
        notify_type.c_str(), notify_id.c_str());
 
   if (pValue != NULL) {
@@ -100,7 +100,7 @@ void ActivePyModule::notify_clog(const LogEntry &log_entry)
 
   // Execute
   auto pValue = PyObject_CallMethod(pClassInstance,
-       const_cast<char*>("notify"), const_cast<char*>("(sN)"),
+       const_cast<char*>("_dispatch_notify"), const_cast<char*>("(sN)"),
        "clog", py_log_entry);
 
   if (pValue != NULL) {
@@ -27,6 +27,7 @@
 #include "mgr/MgrContext.h"
 #include "mgr/TTLCache.h"
 #include "mgr/mgr_perf_counters.h"
+#include "mgr/PerfCounterDelta.h"
 
 #include "DaemonKey.h"
 #include "DaemonServer.h"
@@ -139,6 +140,32 @@ PyObject *ActivePyModules::list_servers_python()
   });
 }
 
+PyObject *ActivePyModules::get_pg_progress_python(version_t since)
+{
+  without_gil_t no_gil;
+  return cluster_state.with_pgmap_changes(since,
+      [&](const PGMap &pg_map,
+	  const std::set<pg_t> *updated,
+	  const std::set<pg_t> &removed) {
+    no_gil.acquire_gil();
+    PyFormatter f;
+    f.dump_unsigned("version", pg_map.version);
+    f.dump_bool("full", updated == nullptr);
+    if (updated) {
+      pg_map.dump_pg_progress(&f, *updated);
+    } else {
+      pg_map.dump_pg_progress(&f);
+    }
+    f.open_array_section("removed");
+    for (auto& pgid : removed) {
+      f.dump_stream("pgid") << pgid;
+    }
+    f.close_section();
+    server.dump_pg_ready(&f);
+    return f.get();
+  });
+}
+
 PyObject *ActivePyModules::get_metadata_python(
   const std::string &svc_type,
   const std::string &svc_id)
@@ -491,6 +518,31 @@ PyObject *ActivePyModules::get_python(const std::string &what)
     f.close_section();
   } else if (what == "have_local_config_map") {
     f.dump_bool("have_local_config_map", have_local_config_map);
+  } else if (what == "map_epochs") {
+    without_gil_t no_gil;
+    epoch_t osd_map = 0, fs_map = 0, mgr_map = 0, mon_map = 0;
+    version_t pg_map = 0;
+    cluster_state.with_osdmap([&](const OSDMap &osdmap) {
+      osd_map = osdmap.get_epoch();
+    });
+    cluster_state.with_fsmap([&](const FSMap &fsmap) {
+      fs_map = fsmap.get_epoch();
+    });
+    cluster_state.with_mgrmap([&](const MgrMap &mgrmap) {
+      mgr_map = mgrmap.get_epoch();
+    });
+    cluster_state.with_monmap([&](const MonMap &monmap) {
+      mon_map = monmap.get_epoch();
+    });
+    cluster_state.with_pgmap([&](const PGMap &pgmap) {
+      pg_map = pgmap.get_version();
+    });
+    no_gil.acquire_gil();
+    f.dump_unsigned("osd_map", osd_map);
+    f.dump_unsigned("fs_map", fs_map);
+    f.dump_unsigned("mgr_map", mgr_map);
+    f.dump_unsigned("mon_map", mon_map);
+    f.dump_unsigned("pg_map", pg_map);
   } else if (what == "active_clean_pgs"){
     without_gil_t no_gil;
     cluster_state.with_pgmap(
@@ -984,6 +1036,81 @@ PyObject* ActivePyModules::get_perf_schema_python(
   return f.get();
 }
 
+PyObject* ActivePyModules::get_unlabeled_perf_counters_python(
+    const std::vector<std::string> &svc_types,
+    const std::vector<std::string> &path_prefixes,
+    int prio_limit,
+    double since)
+{
+  without_gil_t no_gil;
+  std::lock_guard l(lock);
+
+  auto selected = [&path_prefixes](const std::string &path) {
+    if (path_prefixes.empty()) {
+      return true;
+    }
+    for (const auto &prefix : path_prefixes) {
+      if (path.compare(0, prefix.size(), prefix) == 0) {
+        return true;
+      }
+    }
+    return false;
+  };
+
+  utime_t since_t;
+  since_t.set_from_double(since);
+  PerfCounterDelta delta(since_t, ceph_clock_now());
+  auto f = with_gil(no_gil, [&] {
+    return PyFormatter();
+  });
+  with_gil(no_gil, [&] {
+    f.open_object_section("counters");
+  });
+  for (const auto &svc_type : svc_types) {
+    for (auto& [key, state] : daemon_state.get_by_service(svc_type)) {
+      std::lock_guard l(state->lock);
+      with_gil(no_gil, [&, key=ceph::to_string(key), state=state] {
+        // every daemon has a section, even if none of its counters
+        // changed, so that callers can tell the daemons which are gone
+        f.open_object_section(key.c_str());
+        for (const auto& [path, instance] : state->perf_counters.instances) {
+          auto type = state->perf_counters.types.find(path);
+          if (type == state->perf_counters.types.end() ||
+              type->second.priority < prio_limit ||
+              !selected(path)) {
+            continue;
+          }
+          if (!delta.changed(instance)) {
+            continue;
+          }
+          f.open_object_section(path.c_str());
+          f.dump_string("description", type->second.description);
+          if (!type->second.nick.empty()) {
+            f.dump_string("nick", type->second.nick);
+          }
+          f.dump_unsigned("type", type->second.type);
+          f.dump_unsigned("priority", type->second.priority);
+          f.dump_unsigned("units", type->second.unit);
+          if (type->second.type & PERFCOUNTER_LONGRUNAVG) {
+            const auto &datapoint = instance.get_latest_data_avg();
+            f.dump_unsigned("value", datapoint.s);
+            f.dump_unsigned("count", datapoint.c);
+          } else {
+            f.dump_unsigned("value", instance.get_latest_data().v);
+          }
+          f.close_section();
+        }
+        f.close_section();
+      });
+    }
+  }
+  with_gil(no_gil, [&] {
+    f.close_section();
+    f.dump_float("cursor", delta.next_cursor());
+  });
+  return f.get();
+}
+
 PyObject* ActivePyModules::get_rocksdb_version()
 {
   std::string version = std::to_string(ROCKSDB_MAJOR) + "." +
@@ -86,6 +86,7 @@ public:
   PyObject *get_python(const std::string &what);
   PyObject *get_server_python(const std::string &hostname);
   PyObject *list_servers_python();
+  PyObject *get_pg_progress_python(version_t since);
   PyObject *get_metadata_python(
     const std::string &svc_type, const std::string &svc_id);
   PyObject *get_daemon_status_python(
@@ -101,6 +102,11 @@ public:
   PyObject *get_perf_schema_python(
      const std::string &svc_type,
      const std::string &svc_id);
+  PyObject *get_unlabeled_perf_counters_python(
+    const std::vector<std::string> &svc_types,
+    const std::vector<std::string> &path_prefixes,
+    int prio_limit,
+    double since);
   PyObject *get_rocksdb_version();
   PyObject *get_context();
   PyObject *get_osdmap();
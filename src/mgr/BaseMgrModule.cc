@@ -400,6 +400,16 @@ ceph_get_server(BaseMgrModule *self, PyObject *args)
   }
 }
 
+static PyObject*
+ceph_get_pg_progress(BaseMgrModule *self, PyObject *args)
+{
+  unsigned long long since = 0;
+  if (!PyArg_ParseTuple(args, "K:ceph_get_pg_progress", &since)) {
+    return NULL;
+  }
+  return self->py_modules->get_pg_progress_python(since);
+}
+
 static PyObject*
 ceph_get_mgr_id(BaseMgrModule *self, PyObject *args)
 {
@@ -676,6 +686,46 @@ get_perf_schema(BaseMgrModule *self, PyObject *args)
   return self->py_modules->get_perf_schema_python(type_str, svc_id);
 }
 
+static bool
+get_string_list(PyObject *list, const char *name, std::vector<std::string> *out)
+{
+  if (!PyList_Check(list)) {
+    PyErr_Format(PyExc_TypeError, "%s must be a list", name);
+    return false;
+  }
+  for (int i = 0; i < PyList_Size(list); ++i) {
+    PyObject *item = PyList_GET_ITEM(list, i);
+    if (!PyUnicode_Check(item)) {
+      PyErr_Format(PyExc_TypeError, "%s must be a list of strings", name);
+      return false;
+    }
+    out->push_back(PyUnicode_AsUTF8(item));
+  }
+  return true;
+}
+
+static PyObject*
+get_unlabeled_perf_counters(BaseMgrModule *self, PyObject *args)
+{
+  PyObject *py_svc_types = nullptr;
+  PyObject *py_path_prefixes = nullptr;
+  int prio_limit = 0;
+  double since = 0;
+  if (!PyArg_ParseTuple(args, "OOid:get_unlabeled_perf_counters",
+                        &py_svc_types, &py_path_prefixes,
+                        &prio_limit, &since)) {
+    return nullptr;
+  }
+  std::vector<std::string> svc_types;
+  std::vector<std::string> path_prefixes;
+  if (!get_string_list(py_svc_types, "services", &svc_types) ||
+      !get_string_list(py_path_prefixes, "counters", &path_prefixes)) {
+    return nullptr;
+  }
+  return self->py_modules->get_unlabeled_perf_counters_python(
+      svc_types, path_prefixes, prio_limit, since);
+}
+
 static PyObject*
 ceph_get_rocksdb_version(BaseMgrModule *self)
 {
@@ -1435,6 +1485,9 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_get_server", (PyCFunction)ceph_get_server, METH_VARARGS,
    "Get a server object"},
 
+  {"_ceph_get_pg_progress", (PyCFunction)ceph_get_pg_progress, METH_VARARGS,
+   "Get the progress stats of PGs changed since a PGMap version"},
+
   {"_ceph_get_metadata", (PyCFunction)get_metadata, METH_VARARGS,
    "Get a service's metadata"},
 
@@ -1483,6 +1536,9 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_get_perf_schema", (PyCFunction)get_perf_schema, METH_VARARGS,
     "Get the performance counter schema"},
 
+  {"_ceph_get_unlabeled_perf_counters", (PyCFunction)get_unlabeled_perf_counters,
+    METH_VARARGS, "Get the latest values of selected performance counters"},
+
   {"_ceph_get_rocksdb_version", (PyCFunction)ceph_get_rocksdb_version, METH_NOARGS,
     "Get the current RocksDB version number"},
 
@@ -148,10 +148,53 @@ void ClusterState::update_delta_stats()
   jf.dump_object("pending_inc", pending_inc);
   jf.flush(*_dout);
   *_dout << dendl;
+  record_pg_changes();
   pg_map.apply_incremental(g_ceph_context, pending_inc);
   pending_inc = PGMap::Incremental();
 }
 
+void ClusterState::record_pg_changes()
+{
+  if (pending_inc.pg_stat_updates.empty() && pending_inc.pg_remove.empty()) {
+    return;
+  }
+  auto& [updated, removed] = pg_changes[pending_inc.version];
+  for (auto& [pgid, stat] : pending_inc.pg_stat_updates) {
+    updated.push_back(pgid);
+  }
+  removed.assign(pending_inc.pg_remove.begin(), pending_inc.pg_remove.end());
+  while (pg_changes.size() > max_pg_changes) {
+    pg_changes_trimmed = pg_changes.begin()->first;
+    pg_changes.erase(pg_changes.begin());
+  }
+}
+
+bool ClusterState::collect_pg_changes(version_t since,
+				      std::set<pg_t> *updated,
+				      std::set<pg_t> *removed) const
+{
+  ceph_assert(ceph_mutex_is_locked(lock));
+  if (since >= pg_map.version) {
+    return true;
+  }
+  // versions without PG changes are not recorded, so only the versions
+  // trimmed from the history are unknown
+  if (since == 0 || since < pg_changes_trimmed) {
+    return false;
+  }
+  for (auto p = pg_changes.upper_bound(since); p != pg_changes.end(); ++p) {
+    for (auto& pgid : p->second.first) {
+      updated->insert(pgid);
+      removed->erase(pgid);
+    }
+    for (auto& pgid : p->second.second) {
+      removed->insert(pgid);
+      updated->erase(pgid);
+    }
+  }
+  return true;
+}
+
 void ClusterState::notify_osdmap(const OSDMap &osd_map)
 {
   assert(ceph_mutex_is_locked(lock));
@@ -186,6 +229,7 @@ void ClusterState::notify_osdmap(const OSDMap &osd_map)
   jf.flush(*_dout);
   *_dout << dendl;
 
+  record_pg_changes();
   pg_map.apply_incremental(g_ceph_context, pending_inc);
   pending_inc = PGMap::Incremental();
   // TODO: Complete the separation of PG state handling so
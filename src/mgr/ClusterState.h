@@ -47,6 +47,17 @@ protected:
   PGMap pg_map;
   PGMap::Incremental pending_inc;
 
+  /// PGs whose stats were updated and PGs that were removed, by the
+  /// PGMap version that did it; only the latest versions are kept
+  std::map<version_t, std::pair<std::vector<pg_t>, std::vector<pg_t>>> pg_changes;
+  static constexpr size_t max_pg_changes = 1000;
+  version_t pg_changes_trimmed = 0;  ///< latest version trimmed from pg_changes
+
+  void record_pg_changes();
+  bool collect_pg_changes(version_t since,
+			  std::set<pg_t> *updated,
+			  std::set<pg_t> *removed) const;
+
   bufferlist health_json;
   bufferlist mon_status_json;
 
@@ -102,6 +113,19 @@ public:
     return std::forward<Callback>(cb)(pg_map, std::forward<Args>(args)...);
   }
 
+  /// call cb(pg_map, updated, removed, ...args) with the PGs updated and
+  /// removed after PGMap version @c since. @c updated is null if those
+  /// versions are no longer all known, and any PG may have changed.
+  template<typename Callback, typename...Args>
+  auto with_pgmap_changes(version_t since, Callback&& cb, Args&&...args) const
+  {
+    std::lock_guard l(lock);
+    std::set<pg_t> updated, removed;
+    bool known = collect_pg_changes(since, &updated, &removed);
+    return std::forward<Callback>(cb)(pg_map, known ? &updated : nullptr, removed,
+				      std::forward<Args>(args)...);
+  }
+
   template<typename Callback, typename...Args>
   auto with_mutable_pgmap(Callback&& cb, Args&&...args) ->
     decltype(cb(pg_map, std::forward<Args>(args)...))
@@ -432,3 +432,30 @@ void PerfCounterInstance::push_avg(utime_t t, uint64_t const &s,
 {
   avg_buffer.push_back({t, s, c});
 }
+
+template <typename DataPoints, typename Equal>
+static bool changed_after(const DataPoints &data, utime_t since, Equal equal)
+{
+  if (data.empty() || data.back().t <= since) {
+    return false;
+  }
+  for (auto p = data.rbegin(); p != data.rend(); ++p) {
+    if (p->t <= since) {
+      return !equal(*p, data.back());
+    }
+  }
+  // all the samples we still have are newer
+  return true;
+}
+
+bool PerfCounterInstance::changed_since(utime_t since) const
+{
+  if (!avg_buffer.empty()) {
+    return changed_after(avg_buffer, since, [](const auto &a, const auto &b) {
+      return a.s == b.s && a.c == b.c;
+    });
+  }
+  return changed_after(buffer, since, [](const auto &a, const auto &b) {
+    return a.v == b.v;
+  });
+}
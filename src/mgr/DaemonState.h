@@ -82,6 +82,10 @@ class PerfCounterInstance
   void push(utime_t t, uint64_t const &v);
   void push_avg(utime_t t, uint64_t const &s, uint64_t const &c);
 
+  /// true if the latest sample is newer than @c since and its value
+  /// differs from the one of the last sample at or before @c since
+  bool changed_since(utime_t since) const;
+
   PerfCounterInstance(enum perfcounter_type_d type)
   {
     if (type & PERFCOUNTER_LONGRUNAVG)
@@ -0,0 +1,44 @@
+// -*- mode:C++; tab-width:8; c-basic-offset:2; indent-tabs-mode:t -*-
+// vim: ts=8 sw=2 smarttab
+
+#pragma once
+
+#include <algorithm>
+
+#include "include/utime.h"
+
+/**
+ * Picks the perf counters to return from a walk over the daemons that
+ * only returns the counters which changed since a cursor, and the cursor
+ * for the next walk.
+ *
+ * The daemons are visited one at a time, while reports keep arriving, so
+ * the newest sample seen during the walk is not a safe cursor: a report
+ * can land on a daemon that was already visited with an older timestamp
+ * than a sample of a daemon visited later. Instead, the next cursor is the
+ * time the walk started. A report timestamps its samples while holding
+ * the lock of its daemon, so a sample the walk did not see is not older
+ * than that.
+ */
+class PerfCounterDelta {
+ public:
+  /// @p started must be read before the first daemon is visited
+  PerfCounterDelta(utime_t since, utime_t started)
+    : since(since), started(started) {}
+
+  template <typename Instance>
+  bool changed(const Instance &instance) const {
+    return instance.changed_since(since);
+  }
+
+  /// the @c since of the next walk
+  utime_t next_cursor() const {
+    // changed_since() only returns samples newer than the cursor, step
+    // back so that a sample taken in the same tick as @c started is sent
+    return std::max(since, started - utime_t(0, 1000));
+  }
+
+ private:
+  const utime_t since;
+  const utime_t started;
+};
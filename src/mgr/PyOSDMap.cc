@@ -1,6 +1,8 @@
 // -*- mode:C++; tab-width:8; c-basic-offset:2; indent-tabs-mode:t -*-
 // vim: ts=8 sw=2 smarttab
 
+#include <optional>
+
 #include "Mgr.h"
 
 #include "osd/OSDMap.h"
@@ -340,6 +342,26 @@ static PyObject *osdmap_build_simple(PyObject *cls, PyObject *args, PyObject *kw
   return construct_with_capsule("mgr_module", "OSDMap", reinterpret_cast<void*>(osdmap));
 }
 
+static PyObject *osdmap_decode(PyObject *cls, PyObject *args)
+{
+  const char *data = nullptr;
+  Py_ssize_t len = 0;
+  if (!PyArg_ParseTuple(args, "y#:decode", &data, &len)) {
+    return nullptr;
+  }
+  bufferlist bl;
+  bl.append(data, len);
+  OSDMap* osdmap = new OSDMap();
+  try {
+    osdmap->decode(bl);
+  } catch (const ceph::buffer::error& e) {
+    delete osdmap;
+    PyErr_Format(PyExc_ValueError, "unable to decode osdmap: %s", e.what());
+    return nullptr;
+  }
+  return construct_with_capsule("mgr_module", "OSDMap", reinterpret_cast<void*>(osdmap));
+}
+
 PyMethodDef BasePyOSDMap_methods[] = {
   {"_get_epoch", (PyCFunction)osdmap_get_epoch, METH_NOARGS, "Get OSDMap epoch"},
   {"_get_crush_version", (PyCFunction)osdmap_get_crush_version, METH_NOARGS,
@@ -364,6 +386,8 @@ PyMethodDef BasePyOSDMap_methods[] = {
    "Get raw space to logical space ratio"},
   {"_build_simple", (PyCFunction)osdmap_build_simple, METH_VARARGS | METH_CLASS,
    "Create a simple OSDMap"},
+  {"_decode", (PyCFunction)osdmap_decode, METH_VARARGS | METH_CLASS,
+   "Create an OSDMap from its binary encoding"},
   {NULL, NULL, 0, NULL}
 };
 
@@ -523,6 +547,68 @@ static PyObject *osdmap_inc_set_compat_weight_set_weights(
   Py_RETURN_NONE;
 }
 
+template <typename M, typename S>
+static void merge_upmap_changes(const M& other_new, const S& other_old,
+                                const std::optional<set<pg_t>>& only,
+                                M* new_map, S* old_set)
+{
+  for (auto& [pg, v] : other_new) {
+    if (only && !only->count(pg)) {
+      continue;
+    }
+    (*new_map)[pg] = v;
+    old_set->erase(pg);
+  }
+  for (auto& pg : other_old) {
+    if (only && !only->count(pg)) {
+      continue;
+    }
+    old_set->insert(pg);
+    new_map->erase(pg);
+  }
+}
+
+static PyObject *osdmap_inc_merge_upmaps(BasePyOSDMapIncremental *self,
+    PyObject *args)
+{
+  PyObject *obj;
+  PyObject *pg_list = Py_None;
+  if (!PyArg_ParseTuple(args, "O|O:merge_upmaps", &obj, &pg_list)) {
+    return nullptr;
+  }
+  if (!PyObject_TypeCheck(obj, &BasePyOSDMapIncrementalType)) {
+    derr << "Wrong type in osdmap_inc_merge_upmaps!" << dendl;
+    return nullptr;
+  }
+  std::optional<set<pg_t>> only;
+  if (pg_list != Py_None) {
+    if (!PyList_CheckExact(pg_list)) {
+      PyErr_SetString(PyExc_TypeError, "pgids must be a list");
+      return nullptr;
+    }
+    only.emplace();
+    for (auto i = 0; i < PyList_Size(pg_list); ++i) {
+      PyObject *pgid = PyList_GET_ITEM(pg_list, i);
+      pg_t pg;
+      if (!PyUnicode_Check(pgid) || !pg.parse(PyUnicode_AsUTF8(pgid))) {
+        PyErr_Format(PyExc_ValueError, "bad pgid %R", pgid);
+        return nullptr;
+      }
+      only->insert(pg);
+    }
+  }
+  auto other = reinterpret_cast<BasePyOSDMapIncremental*>(obj)->inc;
+  merge_upmap_changes(other->new_pg_upmap, other->old_pg_upmap, only,
+                      &self->inc->new_pg_upmap, &self->inc->old_pg_upmap);
+  merge_upmap_changes(other->new_pg_upmap_items, other->old_pg_upmap_items, only,
+                      &self->inc->new_pg_upmap_items,
+                      &self->inc->old_pg_upmap_items);
+  merge_upmap_changes(other->new_pg_upmap_primary, other->old_pg_upmap_primary, only,
+                      &self->inc->new_pg_upmap_primary,
+                      &self->inc->old_pg_upmap_primary);
+  Py_RETURN_NONE;
+}
+
 PyMethodDef BasePyOSDMapIncremental_methods[] = {
   {"_get_epoch", (PyCFunction)osdmap_inc_get_epoch, METH_NOARGS,
     "Get OSDMap::Incremental epoch"},
@@ -533,6 +619,8 @@ PyMethodDef BasePyOSDMapIncremental_methods[] = {
   {"_set_crush_compat_weight_set_weights",
    (PyCFunction)osdmap_inc_set_compat_weight_set_weights, METH_O,
    "Set weight values in the pending CRUSH compat weight-set"},
+  {"_merge_upmaps", (PyCFunction)osdmap_inc_merge_upmaps, METH_VARARGS,
+   "Merge the pg_upmap changes of another OSDMap::Incremental"},
   {NULL, NULL, 0, NULL}
 };
 
@@ -696,6 +784,13 @@ static PyObject *crush_get_take_weight_osd_map(BasePyCRUSH *self, PyObject *args
   return f.get();
 }
 
+static PyObject *crush_get_checksum(BasePyCRUSH *self, PyObject *obj)
+{
+  bufferlist bl;
+  self->crush->encode(bl, CEPH_FEATURES_SUPPORTED_DEFAULT);
+  return PyLong_FromUnsignedLong(bl.crc32c(0));
+}
+
 PyMethodDef BasePyCRUSH_methods[] = {
   {"_dump", (PyCFunction)crush_dump, METH_NOARGS, "Dump map"},
   {"_get_item_name", (PyCFunction)crush_get_item_name, METH_VARARGS,
@@ -708,6 +803,8 @@ PyMethodDef BasePyCRUSH_methods[] = {
     "Find distinct TAKE roots"},
   {"_get_take_weight_osd_map", (PyCFunction)crush_get_take_weight_osd_map,
     METH_VARARGS, "Get OSD weight map for a given TAKE root node"},
+  {"_get_checksum", (PyCFunction)crush_get_checksum, METH_NOARGS,
+    "Get the checksum of the encoded map"},
   {NULL, NULL, 0, NULL}
 };
 
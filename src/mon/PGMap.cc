@@ -1562,17 +1562,37 @@ void PGMap::dump_pg_stats(ceph::Formatter *f, bool brief) const
   f->close_section();
 }
 
+static void dump_pg_progress_stat(ceph::Formatter *f,
+				  const pg_t& pgid,
+				  const pg_stat_t& stat)
+{
+  std::string n = stringify(pgid);
+  f->open_object_section(n.c_str());
+  f->dump_int("num_bytes_recovered", stat.stats.sum.num_bytes_recovered);
+  f->dump_int("num_bytes", stat.stats.sum.num_bytes);
+  f->dump_unsigned("reported_epoch", stat.reported_epoch);
+  f->dump_string("state", pg_state_string(stat.state));
+  f->close_section();
+}
+
 void PGMap::dump_pg_progress(ceph::Formatter *f) const
 {
   f->open_object_section("pgs");
   for (auto& i : pg_stat) {
-    std::string n = stringify(i.first);
-    f->open_object_section(n.c_str());
-    f->dump_int("num_bytes_recovered", i.second.stats.sum.num_bytes_recovered);
-    f->dump_int("num_bytes", i.second.stats.sum.num_bytes);
-    f->dump_unsigned("reported_epoch", i.second.reported_epoch);
-    f->dump_string("state", pg_state_string(i.second.state));
-    f->close_section();
+    dump_pg_progress_stat(f, i.first, i.second);
+  }
+  f->close_section();
+}
+
+void PGMap::dump_pg_progress(ceph::Formatter *f,
+			     const std::set<pg_t>& pgs) const
+{
+  f->open_object_section("pgs");
+  for (auto& pgid : pgs) {
+    auto i = pg_stat.find(pgid);
+    if (i != pg_stat.end()) {
+      dump_pg_progress_stat(f, i->first, i->second);
+    }
   }
   f->close_section();
 }
@@ -1143,6 +1143,15 @@ void OSDMap::Incremental::dump(Formatter *f) const
   }
   f->close_section();
 
+  f->open_array_section("new_primary_affinity");
+  for (const auto &[osd, affinity] : new_primary_affinity) {
+    f->open_object_section("osd");
+    f->dump_int("osd", osd);
+    f->dump_int("affinity", affinity);
+    f->close_section();
+  }
+  f->close_section();
+
   f->open_array_section("osd_state_xor");
   for (const auto &ns : new_state) {
     f->open_object_section("osd");
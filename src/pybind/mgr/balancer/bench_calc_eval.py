@@ -0,0 +1,182 @@
+"""
+Benchmark of Module.calc_eval on synthetic clusters.
+
+The cluster is laid out like OSDMap.build_simple() lays it out: every OSD
+in a single ``default`` root, with equal weights. PGs of replicated pools
+are mapped to random distinct OSDs. The per-PG-instance accumulation that
+calc_eval used before count_pool_pgs() is timed alongside, and checked to
+give the same counts::
+
+    cd src/pybind/mgr
+    UNITTEST=1 PYTHONPATH=.. python3 -m balancer.bench_calc_eval --osds 1000 --pgs 200000
+"""
+
+import argparse
+import logging
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from mgr_module import CRUSHMap
+
+from .module import Eval, Module
+
+ROOT_ID = -1
+ROOT_NAME = 'default'
+
+
+class SyntheticCRUSH:
+    def __init__(self, num_osd: int) -> None:
+        self.num_osd = num_osd
+
+    def find_takes(self) -> List[int]:
+        return [ROOT_ID]
+
+    def get_item_name(self, item: int) -> str:
+        return ROOT_NAME
+
+    def get_take_weight_osd_map(self, root: int) -> Dict[int, float]:
+        return {osd: 1.0 for osd in range(self.num_osd)}
+
+
+class SyntheticOSDMap:
+    def __init__(self, poolids: List[int]) -> None:
+        self.poolids = poolids
+
+    def get_pools_by_take(self, take: int) -> List[int]:
+        return self.poolids
+
+
+class SyntheticMappingState:
+    """
+    Has the members of MappingState calc_eval uses.
+    """
+
+    def __init__(self,
+                 num_osd: int,
+                 num_pgs: int,
+                 num_pools: int = 4,
+                 size: int = 3,
+                 seed: int = 0) -> None:
+        rng = random.Random(seed)
+        self.desc = 'synthetic'
+        poolids = list(range(1, num_pools + 1))
+        self.poolids = set(poolids)
+        self.osdmap = SyntheticOSDMap(poolids)
+        self.crush = SyntheticCRUSH(num_osd)
+        self.osdmap_dump: Dict[str, Any] = {
+            'pools': [{'pool': poolid, 'pool_name': 'pool%d' % poolid, 'crush_rule': 0}
+                      for poolid in poolids],
+            'osds': [{'osd': osd, 'weight': 1.0} for osd in range(num_osd)],
+        }
+        self.pg_up_by_poolid: Dict[int, Dict[str, List[int]]] = {}
+        self.pg_stat: Dict[str, Dict[str, int]] = {}
+        for poolid in poolids:
+            pg_up = {}
+            for ps in range(num_pgs // num_pools):
+                pgid = '%d.%x' % (poolid, ps)
+                up = rng.sample(range(num_osd), min(size, num_osd))
+                if rng.random() < 0.01:
+                    # degraded
+                    up[-1] = CRUSHMap.ITEM_NONE
+                pg_up[pgid] = up
+                num_objects = rng.randint(0, 10000)
+                self.pg_stat[pgid] = {
+                    'num_objects': num_objects,
+                    'num_bytes': num_objects * rng.randint(4096, 4 << 20),
+                }
+            self.pg_up_by_poolid[poolid] = pg_up
+
+
+class BenchModule:
+    calc_eval = Module.calc_eval
+
+    def __init__(self) -> None:
+        self.log = logging.getLogger(__name__)
+
+    def get_module_option(self, key: str) -> str:
+        assert key == 'crush_compat_metrics'
+        return 'pgs,objects,bytes'
+
+
+def legacy_count(ms: SyntheticMappingState) -> Tuple[Dict[str, Dict[str, Dict[int, int]]],
+                                                     Dict[str, Dict[str, int]]]:
+    """
+    Count by pool and total by root the way calc_eval did before it used
+    count_pool_pgs(): every PG instance looks up the PG's stats and is
+    attributed to a root on its own.
+    """
+    target = {osd: 1.0 for osd in range(ms.crush.num_osd)}
+    actual_by_root: Dict[str, Dict[str, Dict[int, int]]] = {
+        ROOT_NAME: {'pgs': {}, 'objects': {}, 'bytes': {}}}
+    total_by_root = {ROOT_NAME: {'pgs': 0, 'objects': 0, 'bytes': 0}}
+    count_by_pool = {}
+    for poolid in sorted(ms.poolids):
+        pm = ms.pg_up_by_poolid[poolid]
+        pgs_by_osd: Dict[int, int] = {}
+        objects_by_osd: Dict[int, int] = {}
+        bytes_by_osd: Dict[int, int] = {}
+        for pgid, up in pm.items():
+            for osd in [int(osd) for osd in up]:
+                if osd == CRUSHMap.ITEM_NONE:
+                    continue
+                if osd not in pgs_by_osd:
+                    pgs_by_osd[osd] = 0
+                    objects_by_osd[osd] = 0
+                    bytes_by_osd[osd] = 0
+                pgs_by_osd[osd] += 1
+                objects_by_osd[osd] += ms.pg_stat[pgid]['num_objects']
+                bytes_by_osd[osd] += ms.pg_stat[pgid]['num_bytes']
+                for root in [ROOT_NAME]:
+                    if osd in target:
+                        for t in ('pgs', 'objects', 'bytes'):
+                            actual_by_root[root][t].setdefault(osd, 0)
+                        actual_by_root[root]['pgs'][osd] += 1
+                        actual_by_root[root]['objects'][osd] += ms.pg_stat[pgid]['num_objects']
+                        actual_by_root[root]['bytes'][osd] += ms.pg_stat[pgid]['num_bytes']
+                        total_by_root[root]['pgs'] += 1
+                        total_by_root[root]['objects'] += ms.pg_stat[pgid]['num_objects']
+                        total_by_root[root]['bytes'] += ms.pg_stat[pgid]['num_bytes']
+                        break
+        count_by_pool['pool%d' % poolid] = {
+            'pgs': pgs_by_osd,
+            'objects': objects_by_osd,
+            'bytes': bytes_by_osd,
+        }
+    return count_by_pool, total_by_root
+
+
+def calc_eval(ms: SyntheticMappingState) -> Eval:
+    return BenchModule().calc_eval(ms, [])  # type: ignore
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='benchmark balancer calc_eval')
+    parser.add_argument('--osds', type=int, default=1000)
+    parser.add_argument('--pgs', type=int, default=200000)
+    parser.add_argument('--pools', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    ms = SyntheticMappingState(args.osds, args.pgs, args.pools)
+    print('built {} osds, {} pgs in {:.2f}s'.format(
+        args.osds, args.pgs, time.perf_counter() - t))
+
+    for name, f in (('legacy accumulation', legacy_count), ('calc_eval', calc_eval)):
+        times = []
+        for _ in range(args.runs):
+            t = time.perf_counter()
+            f(ms)
+            times.append(time.perf_counter() - t)
+        print('{:<20} best {:.3f}s of {}'.format(name, min(times), args.runs))
+
+    count_by_pool, total_by_root = legacy_count(ms)
+    pe = calc_eval(ms)
+    assert pe.count_by_pool == count_by_pool
+    assert pe.total_by_root == total_by_root
+    print('score {:f}'.format(pe.score))
+
+
+if __name__ == '__main__':
+    main()
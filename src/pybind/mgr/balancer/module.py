@@ -2,6 +2,7 @@
 Balance PG distribution across OSDs.
 """
 
+import base64
 import copy
 import enum
 import errno
@@ -9,43 +10,259 @@ import json
 import math
 import random
 import time
-from mgr_module import CLIReadCommand, CLICommand, CommandResult, MgrModule, Option, OSDMap, CephReleases
+from concurrent.futures import ThreadPoolExecutor
+from mgr_module import CLIReadCommand, CLICommand, CommandResult, MgrModule, Option, OSDMap, \
+    OSDMapIncremental, CephReleases
 from threading import Event
-from typing import cast, Any, Dict, List, Optional, Sequence, Tuple, Union
+from typing import cast, Any, Dict, List, Optional, Sequence, Set, Tuple, Union
 from mgr_module import CRUSHMap
 import datetime
 
 TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
 
 
+# OSD id -> amount
+OSDCounts = Dict[int, int]
+
+
+def count_pool_pgs(pg_up: Dict[str, List[int]],
+                   pg_stat: Dict[str, Dict[str, int]]) -> Tuple[OSDCounts, OSDCounts, OSDCounts]:
+    """
+    Count the PG instances, objects and bytes of a pool on each OSD, given
+    the up set of each of its PGs. The stats of a PG are looked up once for
+    all the OSDs it maps to.
+
+    >>> count_pool_pgs({'1.0': [0, 1], '1.1': [1, CRUSHMap.ITEM_NONE]},
+    ...                {'1.0': {'num_objects': 2, 'num_bytes': 20},
+    ...                 '1.1': {'num_objects': 3, 'num_bytes': 30}})
+    ({0: 1, 1: 2}, {0: 2, 1: 5}, {0: 20, 1: 50})
+    """
+    pgs_by_osd: OSDCounts = {}
+    objects_by_osd: OSDCounts = {}
+    bytes_by_osd: OSDCounts = {}
+    for pgid, up in pg_up.items():
+        stat = pg_stat[pgid]
+        num_objects = stat['num_objects']
+        num_bytes = stat['num_bytes']
+        for osd in up:
+            if osd in pgs_by_osd:
+                pgs_by_osd[osd] += 1
+                objects_by_osd[osd] += num_objects
+                bytes_by_osd[osd] += num_bytes
+            elif osd != CRUSHMap.ITEM_NONE:
+                pgs_by_osd[osd] = 1
+                objects_by_osd[osd] = num_objects
+                bytes_by_osd[osd] = num_bytes
+    return pgs_by_osd, objects_by_osd, bytes_by_osd
+
+
+# with a byte budget, the upmaps made are chosen among this many times
+# upmap_max_optimizations candidates
+UPMAP_CANDIDATE_FACTOR = 4
+
+
+def pool_pg_deviation(osdmap: OSDMap,
+                      crush: CRUSHMap,
+                      osd_weight: Dict[int, float],
+                      poolid: int) -> Dict[int, float]:
+    """
+    Return how many PG instances of a pool each OSD has above (or below)
+    its share by CRUSH weight times reweight.
+    """
+    counts: Dict[int, int] = {}
+    for up in osdmap.map_pool_pgs_up(poolid).values():
+        for osd in up:
+            if osd != CRUSHMap.ITEM_NONE:
+                counts[osd] = counts.get(osd, 0) + 1
+    weights: Dict[int, float] = {}
+    for take in crush.find_takes():
+        if poolid in osdmap.get_pools_by_take(take):
+            for osd, w in crush.get_take_weight_osd_map(take).items():
+                weights[osd] = weights.get(osd, 0) + w * osd_weight.get(osd, 0)
+    total = sum(counts.values())
+    total_weight = sum(weights.values())
+    return {osd: counts.get(osd, 0) - (total * weights.get(osd, 0) / total_weight
+                                       if total_weight else 0)
+            for osd in set(counts) | set(weights)}
+
+
+# upper bound on the CRUSH roots optimized at the same time
+UPMAP_MAX_PARALLEL_ROOTS = 8
+
+
+def group_pools_by_root(osdmap: OSDMap,
+                        crush: CRUSHMap,
+                        pool_ids: Dict[str, int],
+                        pools: List[str]) -> List[Tuple[List[str], List[str]]]:
+    """
+    Group pools so that no two groups place PGs on a common OSD: pools
+    whose CRUSH take roots share OSDs end up in the same group. Returns
+    the names of the roots and the pools of every group, with the pools
+    in the order they are given in.
+    """
+    # OSDs, root names, pools
+    groups: List[Tuple[Set[int], Set[str], Set[str]]] = []
+    for take in crush.find_takes():
+        take_pools = set(osdmap.get_pools_by_take(take))
+        members = set(p for p in pools if pool_ids.get(p) in take_pools)
+        if not members:
+            continue
+        osds = set(crush.get_take_weight_osd_map(take))
+        names = {crush.get_item_name(take) or str(take)}
+        for group in [g for g in groups if g[0] & osds or g[2] & members]:
+            groups.remove(group)
+            osds |= group[0]
+            names |= group[1]
+            members |= group[2]
+        groups.append((osds, names, members))
+    return [(sorted(names), [p for p in pools if p in members])
+            for _, names, members in groups]
+
+
+# keys of an OSDMap incremental dump whose presence (or non-empty value)
+# can change the up set of any PG
+INC_REMAP_ALL_KEYS = ('full_map', 'new_pools', 'old_pools', 'new_up_osds', 'osd_state_xor',
+                      'new_primary_affinity')
+
+# keys of an OSDMap incremental dump listing the PGs whose up set changes
+INC_REMAP_PG_KEYS = ('new_pg_upmap', 'old_pg_upmap', 'new_pg_upmap_items',
+                     'old_pg_upmap_items', 'new_pg_upmap_primaries', 'old_pg_upmap_primaries')
+
+
 class MappingState:
-    def __init__(self, osdmap, raw_pg_stats, raw_pool_stats, desc=''):
+    def __init__(self, osdmap, raw_pg_stats, raw_pool_stats, desc='', base=None,
+                 remap_pools=None, remap_pgs=None, mapped=None):
+        """
+        Map the PGs of all pools of ``osdmap``. With a ``base`` state (see
+        apply_incremental) only the PGs of the pools in ``remap_pools`` and
+        the PGs in ``remap_pgs`` are mapped, the others and the PG stats are
+        shared with ``base``. The PGs of the pools ``mapped``, a state of the
+        same OSDMap epoch, has mapped are shared with it instead of being
+        mapped again.
+        """
         self.desc = desc
         self.osdmap = osdmap
-        self.osdmap_dump = self.osdmap.dump()
-        self.crush = osdmap.get_crush()
-        self.crush_dump = self.crush.dump()
         self.raw_pg_stats = raw_pg_stats
         self.raw_pool_stats = raw_pool_stats
+        self.base = base
+        self._osdmap_dump = None
+        self._crush = None
+        self._crush_dump = None
+        self._pg_up = None
+        if base is not None:
+            self.pg_stat = base.pg_stat
+            self.poolids = base.poolids
+            self.pg_up_by_poolid = dict(base.pg_up_by_poolid)
+            self.remapped_pools = set(remap_pools or ()) & self.poolids
+            self.remapped_pgs = set()
+            for poolid in self.remapped_pools:
+                self.pg_up_by_poolid[poolid] = osdmap.map_pool_pgs_up(poolid)
+            copied = set()
+            for pgid in remap_pgs or ():
+                poolid, ps = pgid.split('.')
+                poolid = int(poolid)
+                if poolid not in self.poolids or poolid in self.remapped_pools:
+                    continue
+                if poolid not in copied:
+                    # don't modify the base's mapping
+                    self.pg_up_by_poolid[poolid] = dict(self.pg_up_by_poolid[poolid])
+                    copied.add(poolid)
+                self.pg_up_by_poolid[poolid][pgid] = \
+                    osdmap.pg_to_up_acting_osds(poolid, int(ps, 16))['up']
+                self.remapped_pgs.add(pgid)
+            return
+
         self.pg_stat = {
             i['pgid']: i['stat_sum'] for i in raw_pg_stats.get('pg_stats', [])
         }
         osd_poolids = [p['pool'] for p in self.osdmap_dump.get('pools', [])]
         pg_poolids = [p['poolid'] for p in raw_pool_stats.get('pool_stats', [])]
         self.poolids = set(osd_poolids) & set(pg_poolids)
-        self.pg_up = {}
         self.pg_up_by_poolid = {}
         for poolid in self.poolids:
-            self.pg_up_by_poolid[poolid] = osdmap.map_pool_pgs_up(poolid)
-            for a, b in self.pg_up_by_poolid[poolid].items():
-                self.pg_up[a] = b
+            if mapped is not None and poolid in mapped.pg_up_by_poolid:
+                self.pg_up_by_poolid[poolid] = mapped.pg_up_by_poolid[poolid]
+            else:
+                self.pg_up_by_poolid[poolid] = osdmap.map_pool_pgs_up(poolid)
+
+    @property
+    def osdmap_dump(self):
+        if self._osdmap_dump is None:
+            self._osdmap_dump = self.osdmap.dump()
+        return self._osdmap_dump
+
+    @property
+    def crush(self):
+        if self._crush is None:
+            self._crush = self.osdmap.get_crush()
+        return self._crush
+
+    @property
+    def crush_dump(self):
+        if self._crush_dump is None:
+            self._crush_dump = self.crush.dump()
+        return self._crush_dump
+
+    @property
+    def pg_up(self):
+        if self._pg_up is None:
+            self._pg_up = {}
+            for pg_up in self.pg_up_by_poolid.values():
+                self._pg_up.update(pg_up)
+        return self._pg_up
+
+    def apply_incremental(self, inc, desc='', changed_osds=None):
+        """
+        Return the state of our osdmap with ``inc`` applied. Only the PGs that
+        can have moved are mapped again: the PGs listed in the upmap changes
+        of ``inc``, and all PGs of the pools under a CRUSH root with an OSD
+        whose reweight or CRUSH weight changed (``changed_osds``, which
+        defaults to all OSDs if ``inc`` changes the CRUSH map).
+        """
+        incdump = inc.dump()
+        osdmap = self.osdmap.apply_incremental(inc)
+        if any(incdump.get(k) for k in INC_REMAP_ALL_KEYS) or \
+           incdump.get('new_max_osd', -1) >= 0:
+            return MappingState(osdmap, self.raw_pg_stats, self.raw_pool_stats, desc)
+
+        reweighted = {i['osd'] for i in incdump.get('new_weight', [])}
+        reweighted.update(changed_osds or ())
+        remap_pools = set()
+        if 'crush' in incdump and changed_osds is None:
+            remap_pools = set(self.poolids)
+        elif reweighted:
+            crush = osdmap.get_crush()
+            for take in crush.find_takes():
+                if reweighted & set(crush.get_take_weight_osd_map(take)):
+                    remap_pools.update(osdmap.get_pools_by_take(take))
+
+        remap_pgs = set()
+        for k in INC_REMAP_PG_KEYS:
+            for i in incdump.get(k, []):
+                remap_pgs.add(i['pgid'] if isinstance(i, dict) else i)
+
+        return MappingState(osdmap, self.raw_pg_stats, self.raw_pool_stats, desc,
+                            base=self, remap_pools=remap_pools, remap_pgs=remap_pgs)
 
     def calc_misplaced_from(self, other_ms):
-        num = len(other_ms.pg_up)
-        misplaced = 0
-        for pgid, before in other_ms.pg_up.items():
-            if before != self.pg_up.get(pgid, []):
-                misplaced += 1
+        num = sum(len(pg_up) for pg_up in other_ms.pg_up_by_poolid.values())
+        if self.base is other_ms:
+            # only the remapped PGs can have moved
+            misplaced = 0
+            for poolid in self.remapped_pools:
+                before = other_ms.pg_up_by_poolid[poolid]
+                after = self.pg_up_by_poolid[poolid]
+                misplaced += sum(1 for pgid, up in before.items() if up != after.get(pgid, []))
+            for pgid in self.remapped_pgs:
+                poolid = int(pgid.split('.')[0])
+                if other_ms.pg_up_by_poolid[poolid].get(pgid) != \
+                   self.pg_up_by_poolid[poolid].get(pgid):
+                    misplaced += 1
+        else:
+            misplaced = 0
+            for pgid, before in other_ms.pg_up.items():
+                if before != self.pg_up.get(pgid, []):
+                    misplaced += 1
         if num > 0:
             return float(misplaced) / float(num)
         return 0.0
@@ -70,6 +287,8 @@ class Plan(object):
         self.compat_ws = {}
         self.inc = osdmap.new_incremental()
         self.pg_status = {}
+        # bytes of each PG, see Module.get_pg_bytes()
+        self.pg_bytes: Optional[Dict[str, int]] = None
 
     def dump(self) -> str:
         return json.dumps(self.inc.dump(), indent=4, sort_keys=True)
@@ -90,10 +309,9 @@ class MsPlan(Plan):
     def final_state(self) -> MappingState:
         self.inc.set_osd_reweights(self.osd_weights)
         self.inc.set_crush_compat_weight_set_weights(self.compat_ws)
-        return MappingState(self.initial.osdmap.apply_incremental(self.inc),
-                            self.initial.raw_pg_stats,
-                            self.initial.raw_pool_stats,
-                            'plan %s final' % self.name)
+        return self.initial.apply_incremental(self.inc,
+                                              'plan %s final' % self.name,
+                                              set(self.osd_weights) | set(self.compat_ws))
 
     def show(self) -> str:
         ls = []
@@ -321,6 +539,29 @@ class Module(MgrModule):
                desc='deviation below which no optimization is attempted',
                long_desc='If the number of PGs are within this count then no optimization is attempted',
                runtime=True),
+        Option(name='upmap_parallel_roots',
+               type='bool',
+               default=False,
+               desc='optimize the pools of independent CRUSH roots in parallel',
+               long_desc='Pools are grouped by the CRUSH roots they map to, and groups '
+               'that share no OSDs are optimized concurrently, each with its own '
+               'budget of upmap_max_optimizations changes per attempt',
+               runtime=True),
+        Option(name='upmap_max_bytes',
+               type='size',
+               default=0,
+               desc='maximum bytes of data movement upmap optimizations queue per attempt',
+               long_desc='If set, candidate upmaps are ranked by how much they improve the '
+               'distribution per byte they move, and only as many are made as fit '
+               'into this budget. 0 means no limit',
+               runtime=True),
+        Option(name='upmap_max_bytes_per_osd',
+               type='size',
+               default=0,
+               desc='maximum bytes of data movement upmap optimizations queue into or '
+               'out of a single OSD per attempt',
+               long_desc='Like upmap_max_bytes, but for each OSD. 0 means no limit',
+               runtime=True),
         Option(name='pool_ids',
                type='str',
                default='',
@@ -345,6 +586,9 @@ class Module(MgrModule):
     last_pg_upmap_primaries: List[Dict[str, Any]] = []
     pg_upmap_primaries_added: List[Dict[str, Any]] = []
     pg_upmap_activity_initalized = False
+    upmap_root_stats: Dict[str, Dict[str, Any]] = {}
+    # the last state made by mapping_state()
+    last_state: Optional[MappingState] = None
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super(Module, self).__init__(*args, **kwargs)
@@ -382,7 +626,8 @@ class Module(MgrModule):
             'pg_upmap_items_added': self.pg_upmap_items_added,
             'pg_upmap_items_removed': self.pg_upmap_items_removed,
             'pg_upmap_primaries_added': self.pg_upmap_primaries_added,
-            'pg_upmap_primaries_removed': self.pg_upmap_primaries_removed
+            'pg_upmap_primaries_removed': self.pg_upmap_primaries_removed,
+            'upmap_roots': self.upmap_root_stats,
         }
         return (0, json.dumps(s, indent=4, sort_keys=True), '')
 
@@ -406,10 +651,7 @@ class Module(MgrModule):
                 warn = ('Unable to apply mode {} due to unknown min_compat_client {}.'.format(mode, min_compat_client))
                 return (-errno.EPERM, '', warn)
         elif mode == Mode.crush_compat:
-            ms = MappingState(self.get_osdmap(),
-                              self.get("pg_stats"),
-                              self.get("pool_stats"),
-                              'initialize compat weight-set')
+            ms = self.mapping_state(self.get_osdmap(), 'initialize compat weight-set')
             self.get_compat_weight_set_weights(ms)  # ignore error
         elif (mode == Mode.read) or (mode == Mode.upmap_read):
             try:
@@ -516,10 +758,7 @@ class Module(MgrModule):
     def _state_from_option(self, option: Optional[str] = None) -> Tuple[MappingState, List[str]]:
         pools = []
         if option is None:
-            ms = MappingState(self.get_osdmap(),
-                              self.get("pg_stats"),
-                              self.get("pool_stats"),
-                              'current cluster')
+            ms = self.mapping_state(self.get_osdmap(), 'current cluster')
         elif option in self.plans:
             plan = self.plans.get(option)
             assert plan
@@ -531,10 +770,7 @@ class Module(MgrModule):
                 # Hence ms might not be accurate here since we are basically
                 # using an old snapshotted osdmap vs a fresh copy of pg_stats.
                 # It should not be a big deal though..
-                ms = MappingState(plan.osdmap,
-                                  self.get("pg_stats"),
-                                  self.get("pool_stats"),
-                                  f'plan "{plan.name}"')
+                ms = self.mapping_state(plan.osdmap, f'plan "{plan.name}"')
             else:
                 ms = cast(MsPlan, plan).final_state()
         else:
@@ -544,10 +780,7 @@ class Module(MgrModule):
             if option not in valid_pool_names:
                 raise ValueError(f'option "{option}" not a plan or a pool')
             pools.append(option)
-            ms = MappingState(osdmap,
-                              self.get("pg_stats"),
-                              self.get("pool_stats"),
-                              f'pool "{option}"')
+            ms = self.mapping_state(osdmap, f'pool "{option}"')
         return ms, pools
 
     @CLIReadCommand('balancer eval-verbose')
@@ -606,6 +839,69 @@ class Module(MgrModule):
             self.optimize_result = detail
         return (r, '', detail)
 
+    @CLIReadCommand('balancer simulate')
+    def simulate(self,
+                 ticks: int = 10,
+                 autoscaler: bool = False,
+                 option: Optional[List[str]] = None,
+                 inbuf: Optional[str] = None) -> Tuple[int, str, str]:
+        """
+        Simulate balancer ticks on a copy of the cluster's osdmap and PG
+        stats, or on an export of them passed with -i, with options
+        overridden as key=value
+        """
+        from .simulate import Simulation, CEPH_OPTIONS, parse_option
+        from pg_autoscaler.module import PgAutoscaler
+
+        if inbuf:
+            # {"osdmap": base64 of "ceph osd getmap", "pg_dump": "ceph pg dump -f json",
+            #  "df": "ceph df -f json" (optional)}
+            try:
+                export = json.loads(inbuf)
+                osdmap = OSDMap.decode(base64.b64decode(export['osdmap']))
+                pg_dump = export['pg_dump'].get('pg_map', export['pg_dump'])
+            except (ValueError, KeyError, TypeError) as e:
+                return -errno.EINVAL, '', 'invalid export: %s' % e
+            df = export.get('df')
+        else:
+            osdmap = self.get_osdmap()
+            pg_dump = self.get('pg_dump')
+            df = self.get('df')
+
+        balancer_options = {o['name']: self.get_module_option(o['name'])
+                            for o in self.MODULE_OPTIONS}
+        autoscaler_options = {o['name']: self.get_module_option_ex('pg_autoscaler', o['name'])
+                              for o in PgAutoscaler.MODULE_OPTIONS}
+        ceph_options = {k: self.get_ceph_option(k) for k in CEPH_OPTIONS}
+        for kv in option or []:
+            key, _, value = kv.partition('=')
+            balancer_option = [o for o in self.MODULE_OPTIONS if o['name'] == key]
+            autoscaler_option = [o for o in PgAutoscaler.MODULE_OPTIONS if o['name'] == key]
+            try:
+                if balancer_option:
+                    balancer_options[key] = parse_option(balancer_option[0], value)
+                elif autoscaler_option:
+                    autoscaler_options[key] = parse_option(autoscaler_option[0], value)
+                elif key in ceph_options:
+                    ceph_options[key] = type(ceph_options[key])(value)
+                else:
+                    return -errno.EINVAL, '', 'unknown option %s' % key
+            except ValueError as e:
+                return -errno.EINVAL, '', 'invalid value for %s: %s' % (key, e)
+
+        pools = []
+        pool_ids = cast(str, balancer_options['pool_ids'])
+        if pool_ids:
+            pool_name_by_id = {p['pool']: p['pool_name'] for p in osdmap.dump().get('pools', [])}
+            pools = [pool_name_by_id[int(p)] for p in pool_ids.split(',')
+                     if int(p) in pool_name_by_id]
+        sim = Simulation(osdmap, pg_dump, df, pools,
+                         ceph_options=ceph_options,
+                         balancer_options=balancer_options,
+                         autoscaler_options=autoscaler_options)
+        report = sim.run(ticks, autoscaler)
+        return 0, json.dumps(report, indent=4, sort_keys=True), ''
+
     @CLIReadCommand('balancer show')
     def plan_show(self, plan: str) -> Tuple[int, str, str]:
         """
@@ -749,7 +1045,8 @@ class Module(MgrModule):
                 self.last_optimize_started = time.asctime(time.localtime())
                 self.optimize_result = self.in_progress_string
                 start = time.time()
-                r, detail = self.optimize(plan)
+                with self.profiled('serve', 'optimize'):
+                    r, detail = self.optimize(plan)
                 end = time.time()
                 self.last_optimize_duration = str(datetime.timedelta(seconds=(end - start)))
                 if r == 0:
@@ -774,13 +1071,25 @@ class Module(MgrModule):
         else:
             plan = MsPlan(name,
                           mode,
-                          MappingState(osdmap,
-                                       self.get("pg_stats"),
-                                       self.get("pool_stats"),
-                                       'plan %s initial' % name),
+                          self.mapping_state(osdmap, 'plan %s initial' % name),
                           pools)
         return plan
 
+    def mapping_state(self, osdmap: OSDMap, desc: str) -> MappingState:
+        """
+        The MappingState of ``osdmap`` with the current PG stats. The PG
+        mappings of the last state made are reused if it was made from an
+        OSDMap of the same epoch, so that the PGs are only mapped again
+        once the cluster moved on to a new OSDMap.
+        """
+        last = self.last_state
+        if last is not None and last.osdmap.get_epoch() != osdmap.get_epoch():
+            last = None
+        ms = MappingState(osdmap, self.get("pg_stats"), self.get("pool_stats"), desc,
+                          mapped=last)
+        self.last_state = ms
+        return ms
+
     def calc_eval(self, ms: MappingState, pools: List[str]) -> Eval:
         pe = Eval(ms)
         pool_rule = {}
@@ -856,53 +1165,34 @@ class Module(MgrModule):
         # pool and root actual
         for pool, pi in pool_info.items():
             poolid = pi['pool']
-            pm = ms.pg_up_by_poolid[poolid]
+            pgs_by_osd, objects_by_osd, bytes_by_osd = count_pool_pgs(
+                ms.pg_up_by_poolid[poolid], ms.pg_stat)
             pgs = 0
             objects = 0
             bytes = 0
-            pgs_by_osd = {}
-            objects_by_osd = {}
-            bytes_by_osd = {}
-            for pgid, up in pm.items():
-                for osd in [int(osd) for osd in up]:
-                    if osd == CRUSHMap.ITEM_NONE:
-                        continue
-                    if osd not in pgs_by_osd:
-                        pgs_by_osd[osd] = 0
-                        objects_by_osd[osd] = 0
-                        bytes_by_osd[osd] = 0
-                    pgs_by_osd[osd] += 1
-                    objects_by_osd[osd] += ms.pg_stat[pgid]['num_objects']
-                    bytes_by_osd[osd] += ms.pg_stat[pgid]['num_bytes']
-                    # pick a root to associate this pg instance with.
-                    # note that this is imprecise if the roots have
-                    # overlapping children.
-                    # FIXME: divide bytes by k for EC pools.
-                    for root in pe.pool_roots[pool]:
-                        if osd in pe.target_by_root[root]:
-                            actual_by_root[root]['pgs'][osd] += 1
-                            actual_by_root[root]['objects'][osd] += ms.pg_stat[pgid]['num_objects']
-                            actual_by_root[root]['bytes'][osd] += ms.pg_stat[pgid]['num_bytes']
-                            pgs += 1
-                            objects += ms.pg_stat[pgid]['num_objects']
-                            bytes += ms.pg_stat[pgid]['num_bytes']
-                            pe.total_by_root[root]['pgs'] += 1
-                            pe.total_by_root[root]['objects'] += ms.pg_stat[pgid]['num_objects']
-                            pe.total_by_root[root]['bytes'] += ms.pg_stat[pgid]['num_bytes']
-                            break
+            for osd, num_pgs in pgs_by_osd.items():
+                # pick a root to associate the pg instances on this osd
+                # with. note that this is imprecise if the roots have
+                # overlapping children.
+                # FIXME: divide bytes by k for EC pools.
+                for root in pe.pool_roots[pool]:
+                    if osd in pe.target_by_root[root]:
+                        num_objects = objects_by_osd[osd]
+                        num_bytes = bytes_by_osd[osd]
+                        actual_by_root[root]['pgs'][osd] += num_pgs
+                        actual_by_root[root]['objects'][osd] += num_objects
+                        actual_by_root[root]['bytes'][osd] += num_bytes
+                        pgs += num_pgs
+                        objects += num_objects
+                        bytes += num_bytes
+                        pe.total_by_root[root]['pgs'] += num_pgs
+                        pe.total_by_root[root]['objects'] += num_objects
+                        pe.total_by_root[root]['bytes'] += num_bytes
+                        break
             pe.count_by_pool[pool] = {
-                'pgs': {
-                    k: v
-                    for k, v in pgs_by_osd.items()
-                },
-                'objects': {
-                    k: v
-                    for k, v in objects_by_osd.items()
-                },
-                'bytes': {
-                    k: v
-                    for k, v in bytes_by_osd.items()
-                },
+                'pgs': pgs_by_osd,
+                'objects': objects_by_osd,
+                'bytes': bytes_by_osd,
             }
             pe.actual_by_pool[pool] = {
                 'pgs': {
@@ -1158,8 +1448,6 @@ class Module(MgrModule):
 
         adjusted_pools = []
         inc = plan.inc
-        total_did = 0
-        left = max_optimizations
         pools_with_pg_merge = [p['pool_name'] for p in osdmap_dump.get('pools', [])
                                if p['pg_num'] > p['pg_num_target']]
         crush_rule_by_pool_name = dict((p['pool_name'], p['crush_rule'])
@@ -1174,12 +1462,55 @@ class Module(MgrModule):
             adjusted_pools.append(pool)
         # shuffle so all pools get equal (in)attention
         random.shuffle(adjusted_pools)
-        pool_dump = osdmap_dump.get('pools', [])
-        for pool in adjusted_pools:
-            for p in pool_dump:
-                if p['pool_name'] == pool:
-                    pool_id = p['pool']
-                    break
+        max_bytes = cast(int, self.get_module_option('upmap_max_bytes'))
+        max_bytes_per_osd = cast(int, self.get_module_option('upmap_max_bytes_per_osd'))
+        max_candidates = int(max_optimizations)
+        if max_bytes or max_bytes_per_osd:
+            # pick from more candidates than will be taken
+            inc = plan.osdmap.new_incremental()
+            max_candidates *= UPMAP_CANDIDATE_FACTOR
+        if self.get_module_option('upmap_parallel_roots'):
+            total_did = self.do_upmap_by_root(plan, inc, adjusted_pools, max_deviation,
+                                              max_candidates)
+        else:
+            total_did, _ = self.calc_pool_upmaps(plan, inc, adjusted_pools, max_deviation,
+                                                 max_candidates)
+        deferred = 0
+        if inc is not plan.inc:
+            total_did, deferred = self.select_upmaps_by_cost(plan, inc, self.get_pg_bytes(plan),
+                                                             int(max_optimizations),
+                                                             max_bytes, max_bytes_per_osd)
+        self.log.info('prepared %d/%d upmap changes' % (total_did, max_optimizations))
+        if total_did == 0 and deferred:
+            # not balanced, just held back by the byte budget
+            return -errno.EAGAIN, 'All %d upmap changes were deferred by the byte budget ' \
+                                  '(upmap_max_bytes, upmap_max_bytes_per_osd)' % deferred
+        if total_did == 0:
+            self.no_optimization_needed = True
+            return -errno.EALREADY, 'Unable to find further optimization, ' \
+                                    'or pool(s) pg_num is decreasing, ' \
+                                    'or distribution is already perfect'
+        return 0, ''
+
+    def calc_pool_upmaps(self,
+                         plan: Plan,
+                         inc: OSDMapIncremental,
+                         pools: List[str],
+                         max_deviation: int,
+                         max_optimizations: int) -> Tuple[int, bool]:
+        """
+        Calculate upmaps for one pool after another into ``inc`` until
+        ``max_optimizations`` changes are made. Returns the number of
+        changes and whether the number of active+clean PGs of any pool
+        limited the changes for it.
+        """
+        pool_id_by_name = {p['pool_name']: p['pool']
+                           for p in plan.osdmap_dump.get('pools', [])}
+        total_did = 0
+        limited = False
+        left = max_optimizations
+        for pool in pools:
+            pool_id = pool_id_by_name[pool]
 
             # note that here we deliberately exclude any scrubbing pgs too
             # since scrubbing activities have significant impacts on performance
@@ -1193,18 +1524,152 @@ class Module(MgrModule):
                         num_pg_active_clean += s['count']
                         break
             available = min(left, num_pg_active_clean)
+            limited |= available < left
             did = plan.osdmap.calc_pg_upmaps(inc, max_deviation, available, [pool])
             total_did += did
             left -= did
             if left <= 0:
                 break
-        self.log.info('prepared %d/%d upmap changes' % (total_did, max_optimizations))
-        if total_did == 0:
-            self.no_optimization_needed = True
-            return -errno.EALREADY, 'Unable to find further optimization, ' \
-                                    'or pool(s) pg_num is decreasing, ' \
-                                    'or distribution is already perfect'
-        return 0, ''
+        return total_did, limited
+
+    def do_upmap_by_root(self,
+                         plan: Plan,
+                         inc: OSDMapIncremental,
+                         pools: List[str],
+                         max_deviation: int,
+                         max_optimizations: int) -> int:
+        """
+        Calculate the upmaps of pools under CRUSH roots that share no OSDs
+        concurrently, each into an incremental of its own, and merge those
+        into ``inc``. calc_pg_upmaps() drops the GIL while it runs.
+        """
+        pool_ids = {p['pool_name']: p['pool'] for p in plan.osdmap_dump.get('pools', [])}
+        groups = group_pools_by_root(plan.osdmap, plan.osdmap.get_crush(), pool_ids, pools)
+        self.log.info('upmap root groups %s' % groups)
+
+        def optimize(group_pools: List[str]) -> Tuple['OSDMapIncremental', Dict[str, Any]]:
+            group_inc = plan.osdmap.new_incremental()
+            start = time.monotonic()
+            did, limited = self.calc_pool_upmaps(plan, group_inc, group_pools, max_deviation,
+                                                 max_optimizations)
+            return group_inc, {
+                'pools': group_pools,
+                'changes': did,
+                'converged': did < max_optimizations and not limited,
+                'duration': time.monotonic() - start,
+            }
+
+        if not groups:
+            return 0
+        workers = min(len(groups), UPMAP_MAX_PARALLEL_ROOTS)
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='balancer-upmap') as executor:
+            results = list(executor.map(optimize, [group_pools for _, group_pools in groups]))
+
+        total_did = 0
+        self.upmap_root_stats = {}
+        for (roots, _), (group_inc, stats) in zip(groups, results):
+            inc.merge_upmaps(group_inc)
+            total_did += stats['changes']
+            self.upmap_root_stats[','.join(roots)] = stats
+            self.log.info('roots %s: %s' % (roots, stats))
+        return total_did
+
+    def get_pg_bytes(self, plan: Plan) -> Dict[str, int]:
+        """
+        The bytes of each PG, from the PG stats of the initial state of an
+        MsPlan, or else fetched once per plan.
+        """
+        if plan.pg_bytes is None:
+            if isinstance(plan, MsPlan):
+                pg_stat = plan.initial.pg_stat
+            else:
+                pg_stat = {s['pgid']: s['stat_sum']
+                           for s in self.get('pg_stats').get('pg_stats', [])}
+            plan.pg_bytes = {pgid: s.get('num_bytes', 0) for pgid, s in pg_stat.items()}
+        return plan.pg_bytes
+
+    def select_upmaps_by_cost(self,
+                              plan: Plan,
+                              candidates: OSDMapIncremental,
+                              pg_bytes: Dict[str, int],
+                              max_optimizations: int,
+                              max_bytes: int,
+                              max_bytes_per_osd: int) -> Tuple[int, int]:
+        """
+        Merge the upmap changes of ``candidates`` that reduce the PG count
+        deviation of their pool the most per byte of data they move into
+        the plan, without queueing more than ``max_bytes`` in total and
+        more than ``max_bytes_per_osd`` into or out of a single OSD (0 for
+        no limit). ``pg_bytes`` are the bytes of each PG. If no change fits
+        into the budget, the best one is taken anyway, so that PGs bigger
+        than the budget still move. Returns the number of changes taken and
+        deferred.
+        """
+        pgids = set()
+        incdump = candidates.dump()
+        for k in INC_REMAP_PG_KEYS:
+            for i in incdump.get(k, []):
+                pgids.add(i['pgid'] if isinstance(i, dict) else i)
+        if not pgids:
+            return 0, 0
+
+        after = plan.osdmap.apply_incremental(candidates)
+        crush = plan.osdmap.get_crush()
+        osd_weight = {o['osd']: o['weight'] for o in plan.osdmap_dump.get('osds', [])}
+        deviation: Dict[int, Dict[int, float]] = {}
+        # (improvement per byte, pgid, bytes, OSDs the data moves between)
+        ranked: List[Tuple[float, str, int, Set[int]]] = []
+        for pgid in pgids:
+            pool, ps = pgid.split('.')
+            poolid = int(pool)
+            if poolid not in deviation:
+                deviation[poolid] = pool_pg_deviation(plan.osdmap, crush, osd_weight, poolid)
+            dev = deviation[poolid]
+            before = set(plan.osdmap.pg_to_up_acting_osds(poolid, int(ps, 16))['up'])
+            up = set(after.pg_to_up_acting_osds(poolid, int(ps, 16))['up'])
+            src = before - up - {CRUSHMap.ITEM_NONE}
+            dst = up - before - {CRUSHMap.ITEM_NONE}
+            # half the change in the sum of squared deviations
+            gain = sum(dev.get(osd, 0) for osd in src) - \
+                sum(dev.get(osd, 0) for osd in dst) - len(dst)
+            if gain <= 0:
+                continue
+            cost = len(dst) * pg_bytes.get(pgid, 0)
+            ranked.append((gain / max(cost, 1), pgid, cost, src | dst))
+        ranked.sort(reverse=True)
+
+        taken: List[str] = []
+        total_bytes = 0
+        bytes_by_osd: Dict[int, int] = {}
+        deferred = 0
+        for _, pgid, cost, osds in ranked:
+            if len(taken) >= max_optimizations:
+                break
+            num_bytes = pg_bytes.get(pgid, 0)
+            over_budget = max_bytes and total_bytes + cost > max_bytes
+            if max_bytes_per_osd:
+                over_budget = over_budget or any(
+                    bytes_by_osd.get(osd, 0) + num_bytes > max_bytes_per_osd for osd in osds)
+            if over_budget:
+                deferred += 1
+                continue
+            taken.append(pgid)
+            total_bytes += cost
+            for osd in osds:
+                bytes_by_osd[osd] = bytes_by_osd.get(osd, 0) + num_bytes
+        if not taken and ranked:
+            # every change is over the budget on its own
+            _, pgid, cost, _ = ranked[0]
+            self.log.info('taking upmap candidate %s moving %d bytes over the byte budget'
+                          % (pgid, cost))
+            taken.append(pgid)
+            total_bytes += cost
+            deferred -= 1
+        plan.inc.merge_upmaps(candidates, taken)
+        self.log.info('took %d of %d upmap candidates moving %d bytes, %d deferred '
+                      'by the byte budget' % (len(taken), len(pgids), total_bytes, deferred))
+        return len(taken), deferred
 
     def do_crush_compat(self, plan: MsPlan) -> Tuple[int, str]:
         self.log.info('do_crush_compat')
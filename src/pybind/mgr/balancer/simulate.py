@@ -0,0 +1,243 @@
+"""
+What-if simulation of the balancer and the pg_autoscaler.
+
+A Simulation runs balancer ticks against a copy of an OSDMap and a PG
+dump: every plan is applied to the copy as if the data movement it causes
+completed before the next tick, until the balancer finds nothing left to
+do. The module code runs unchanged, on stand-ins that answer its
+MgrModule calls from the simulated state instead of the cluster, so
+nothing is ever sent to the monitors.
+"""
+
+import errno
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from mgr_module import CommandResult, CRUSHMap, EpochMemo, MAP_EPOCH_NAMES, Option, OptionValue, \
+    OSDMap
+
+from .module import MappingState, Module as Balancer, MsPlan
+
+# ceph options the simulated modules read, with their defaults
+CEPH_OPTIONS: Dict[str, OptionValue] = {
+    'target_max_misplaced_ratio': 0.05,
+    'mon_target_pg_per_osd': 100,
+    'mon_max_pg_per_osd': 250,
+}
+
+
+def parse_option(option: Option, value: str) -> OptionValue:
+    """
+    Convert the string ``value`` to the type of ``option``.
+
+    >>> parse_option(Option(name='upmap_max_deviation', type='int'), '3')
+    3
+    >>> parse_option(Option(name='upmap_parallel_roots', type='bool'), 'true')
+    True
+    """
+    t = option.get('type', 'str')
+    if t in ('int', 'uint', 'secs', 'size'):
+        return int(value)
+    if t == 'float':
+        return float(value)
+    if t == 'bool':
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return value
+
+
+class StandInModule:
+    """
+    Base of the stand-ins made by stand_in(). Answers the MgrModule calls
+    of the simulated modules from a Simulation.
+    """
+
+    def __init__(self, sim: 'Simulation', options: Dict[str, OptionValue]) -> None:
+        self._sim = sim
+        self._options = options
+        self._logger = logging.getLogger('%s.%s' % (__name__, type(self).__name__))
+        self._epoch_memo = EpochMemo()
+        self._osdmap: Optional[OSDMap] = None
+        self._osdmap_epoch = 0
+
+    @property
+    def log(self) -> logging.Logger:
+        return self._logger
+
+    def get_module_option(self, key: str, default: OptionValue = None) -> OptionValue:
+        if key in self._options:
+            return self._options[key]
+        for option in getattr(self, 'MODULE_OPTIONS', []):
+            if option['name'] == key:
+                return option.get('default', default)
+        return default
+
+    def get_ceph_option(self, key: str) -> OptionValue:
+        return self._sim.ceph_options[key]
+
+    def get(self, data_name: str) -> Any:
+        return self._sim.get(data_name)
+
+    def get_osdmap(self) -> OSDMap:
+        return self._sim.osdmap
+
+    def get_map_epochs(self) -> Dict[str, int]:
+        # every OSDMap the simulation moves to is a new epoch
+        if self._sim.osdmap is not self._osdmap:
+            self._osdmap = self._sim.osdmap
+            self._osdmap_epoch += 1
+        epochs = dict.fromkeys(MAP_EPOCH_NAMES, 0)
+        epochs['osd_map'] = self._osdmap_epoch
+        return epochs
+
+    def send_command(self, result: CommandResult, *args: Any, **kwargs: Any) -> None:
+        result.complete(-errno.EROFS, '', 'commands are not sent in a simulation')
+
+
+def stand_in(cls: type) -> Type[StandInModule]:
+    """
+    Make a class with the methods and attributes ``cls`` defines itself on
+    top of StandInModule. The MgrModule methods a stand-in doesn't provide
+    are missing, rather than reaching into the mgr.
+    """
+    ns = {k: v for k, v in vars(cls).items()
+          if not k.startswith('__') and k not in vars(StandInModule)}
+    return type('StandIn' + cls.__name__, (StandInModule,), ns)
+
+
+def count_moved(before: MappingState, after: MappingState) -> Tuple[int, int]:
+    """
+    Count the PGs that map to a new OSD in ``after``, and the bytes that
+    have to be copied to the new OSDs.
+    """
+    moved_pgs = 0
+    moved_bytes = 0
+    for poolid, pg_up in after.pg_up_by_poolid.items():
+        old_pg_up = before.pg_up_by_poolid.get(poolid, {})
+        if pg_up is old_pg_up:
+            # shared with the base state, so nothing moved
+            continue
+        for pgid, up in pg_up.items():
+            new = set(up) - set(old_pg_up.get(pgid, [])) - {CRUSHMap.ITEM_NONE}
+            if new:
+                moved_pgs += 1
+                moved_bytes += len(new) * after.pg_stat.get(pgid, {}).get('num_bytes', 0)
+    return moved_pgs, moved_bytes
+
+
+class Simulation:
+    """
+    ``pg_dump`` is the ``pg_map`` section of ``ceph pg dump``. The pool
+    usage the pg_autoscaler looks at is taken from ``df`` (``ceph df``)
+    if given, and estimated from the PG dump otherwise.
+    """
+
+    def __init__(self,
+                 osdmap: OSDMap,
+                 pg_dump: Dict[str, Any],
+                 df: Optional[Dict[str, Any]] = None,
+                 pools: Sequence[str] = (),
+                 ceph_options: Optional[Dict[str, OptionValue]] = None,
+                 balancer_options: Optional[Dict[str, OptionValue]] = None,
+                 autoscaler_options: Optional[Dict[str, OptionValue]] = None) -> None:
+        self.osdmap = osdmap
+        self.pg_dump = pg_dump
+        self.df = df
+        self.pools = list(pools)
+        self.ceph_options = dict(CEPH_OPTIONS, **(ceph_options or {}))
+        self.balancer_options = balancer_options or {}
+        self.autoscaler_options = autoscaler_options or {}
+
+    def get(self, data_name: str) -> Any:
+        if data_name in ('pg_stats', 'pool_stats', 'osd_stats'):
+            return {data_name: self.pg_dump.get(data_name, [])}
+        if data_name == 'pg_status':
+            # the data movement of the previous tick is done
+            return {
+                'pgs_by_pool_state': [
+                    {'pool_id': p['pool'],
+                     'pg_state_counts': [{'state_name': 'active+clean',
+                                          'count': p['pg_num']}]}
+                    for p in self.osdmap.dump().get('pools', [])
+                ],
+            }
+        if data_name == 'df':
+            if self.df is not None:
+                return self.df
+            pools = []
+            for p in self.pg_dump.get('pool_stats', []):
+                raw_used_rate = self.osdmap.pool_raw_used_rate(p['poolid'])
+                pools.append({'id': p['poolid'],
+                              'stats': {'bytes_used': p['stat_sum']['num_bytes'] * raw_used_rate}})
+            return {'pools': pools}
+        if data_name == 'osd_map':
+            return self.osdmap.dump()
+        raise KeyError('%s is not available in a simulation' % data_name)
+
+    def run_autoscaler(self) -> Dict[str, Any]:
+        from pg_autoscaler.module import PgAutoscaler
+
+        autoscaler: Any = stand_in(PgAutoscaler)(self, self.autoscaler_options)
+        autoscaler.config_notify()
+        cpu = time.thread_time()
+        ps, _ = autoscaler._get_pool_status(self.osdmap, self.osdmap.get_pools_by_name())
+        return {
+            'cpu_seconds': time.thread_time() - cpu,
+            'pools': [{k: p[k] for k in ('pool_name', 'pg_num_target', 'pg_num_final',
+                                         'would_adjust')}
+                      for p in ps],
+        }
+
+    def run(self, ticks: int, autoscaler: bool = False) -> Dict[str, Any]:
+        """
+        Run up to ``ticks`` balancer ticks and report the score, the data
+        moved and the CPU time of every tick, and whether the balancer
+        converged, i.e. found nothing more to optimize.
+        """
+        balancer: Any = stand_in(Balancer)(self, self.balancer_options)
+        ms = MappingState(self.osdmap, self.get('pg_stats'), self.get('pool_stats'),
+                          'simulation start')
+        report: Dict[str, Any] = {
+            'mode': balancer.get_module_option('mode'),
+            'initial_score': balancer.calc_eval(ms, self.pools).score,
+            'converged': False,
+            'moved_pgs': 0,
+            'moved_bytes': 0,
+            'cpu_seconds': 0.0,
+        }
+        results: List[Dict[str, Any]] = []
+        for tick in range(1, ticks + 1):
+            cpu = time.thread_time()
+            wall = time.monotonic()
+            plan = balancer.plan_create('simulation-%d' % tick, self.osdmap, self.pools)
+            r, detail = balancer.optimize(plan)
+            if r == 0 and isinstance(plan, MsPlan):
+                # fill in the incremental
+                plan.final_state()
+            result: Dict[str, Any] = {
+                'tick': tick,
+                'cpu_seconds': time.thread_time() - cpu,
+                'wall_seconds': time.monotonic() - wall,
+            }
+            report['cpu_seconds'] += result['cpu_seconds']
+            results.append(result)
+            if r != 0:
+                report['converged'] = r == -errno.EALREADY
+                result['detail'] = detail
+                break
+
+            next_ms = ms.apply_incremental(plan.inc, 'simulation tick %d' % tick)
+            result['moved_pgs'], result['moved_bytes'] = count_moved(ms, next_ms)
+            result['score'] = balancer.calc_eval(next_ms, self.pools).score
+            report['moved_pgs'] += result['moved_pgs']
+            report['moved_bytes'] += result['moved_bytes']
+            ms = next_ms
+            self.osdmap = ms.osdmap
+
+        # ticks that changed something
+        report['ticks'] = sum(1 for result in results if 'score' in result)
+        report['final_score'] = balancer.calc_eval(ms, self.pools).score
+        report['tick_results'] = results
+        if autoscaler:
+            report['autoscaler'] = self.run_autoscaler()
+        return report
@@ -0,0 +1,19 @@
+import pytest
+
+from .bench_calc_eval import SyntheticMappingState, calc_eval, legacy_count
+
+
+@pytest.mark.parametrize('num_osd,num_pgs,num_pools', [
+    (3, 8, 1),
+    (10, 256, 2),
+    (64, 4096, 4),
+])
+def test_calc_eval_matches_legacy_counts(num_osd, num_pgs, num_pools):
+    ms = SyntheticMappingState(num_osd, num_pgs, num_pools, seed=num_osd)
+    count_by_pool, total_by_root = legacy_count(ms)
+    pe = calc_eval(ms)
+    assert pe.count_by_pool == count_by_pool
+    assert pe.total_by_root == total_by_root
+    for pool, counts in count_by_pool.items():
+        assert pe.total_by_pool[pool]['pgs'] == sum(counts['pgs'].values())
+    assert 0 <= pe.score < 1
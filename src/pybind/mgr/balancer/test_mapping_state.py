@@ -0,0 +1,154 @@
+from .module import MappingState, Module
+
+
+class FakeInc:
+    def __init__(self, dump=None):
+        self._dump = dump or {}
+
+    def dump(self):
+        return self._dump
+
+
+class FakeCRUSH:
+    def find_takes(self):
+        return [-1, -2]
+
+    def get_take_weight_osd_map(self, take):
+        return {-1: {0: 1.0, 1: 1.0, 2: 1.0}, -2: {3: 1.0, 4: 1.0}}[take]
+
+    def dump(self):
+        return {}
+
+
+class FakeOSDMap:
+    """
+    Pool 1 is under root -1 (osds 0-2), pool 2 under root -2 (osds 3-4).
+    """
+
+    def __init__(self, shift=0, upmap=None, epoch=1):
+        self.shift = shift
+        self.upmap = upmap or {}
+        self.epoch = epoch
+        self.mapped_pools = []
+        self.mapped_pgs = []
+
+    def dump(self):
+        return {'pools': [{'pool': 1}, {'pool': 2}]}
+
+    def get_epoch(self):
+        return self.epoch
+
+    def get_crush(self):
+        return FakeCRUSH()
+
+    def get_pools_by_take(self, take):
+        return {-1: [1], -2: [2]}[take]
+
+    def _up(self, poolid, ps):
+        pgid = '%d.%x' % (poolid, ps)
+        if pgid in self.upmap:
+            return self.upmap[pgid]
+        if poolid == 1:
+            return [(ps + self.shift) % 3, (ps + self.shift + 1) % 3]
+        return [3 + ps % 2]
+
+    def map_pool_pgs_up(self, poolid):
+        self.mapped_pools.append(poolid)
+        return {'%d.%x' % (poolid, ps): self._up(poolid, ps) for ps in range(4)}
+
+    def pg_to_up_acting_osds(self, poolid, ps):
+        self.mapped_pgs.append((poolid, ps))
+        return {'up': self._up(poolid, ps)}
+
+
+class IncOSDMap(FakeOSDMap):
+    def __init__(self, after):
+        super().__init__()
+        self.after = after
+
+    def apply_incremental(self, inc):
+        return self.after
+
+
+RAW_PG_STATS = {'pg_stats': [{'pgid': '%d.%x' % (pool, ps), 'stat_sum': {}}
+                             for pool in (1, 2) for ps in range(4)]}
+RAW_POOL_STATS = {'pool_stats': [{'poolid': 1}, {'poolid': 2}]}
+
+
+def make_states(after, incdump, changed_osds=None):
+    before = MappingState(IncOSDMap(after), RAW_PG_STATS, RAW_POOL_STATS)
+    return before, before.apply_incremental(FakeInc(incdump), 'after', changed_osds)
+
+
+def test_reweight_remaps_pools_under_root():
+    after = FakeOSDMap(shift=1)
+    before, ms = make_states(after, {'new_weight': [{'osd': 1, 'weight': 0.5}]})
+    assert after.mapped_pools == [1]
+    assert ms.pg_stat is before.pg_stat
+    assert ms.pg_up_by_poolid[2] is before.pg_up_by_poolid[2]
+    assert ms.pg_up['1.0'] == [1, 2]
+    assert ms.calc_misplaced_from(before) == 0.5
+
+
+def test_upmap_items_remap_listed_pgs():
+    after = FakeOSDMap(upmap={'2.1': [3]})
+    before, ms = make_states(after, {'new_pg_upmap_items': [{'pgid': '2.1', 'mappings': []}],
+                                     'old_pg_upmap_items': ['2.3']})
+    assert after.mapped_pools == []
+    assert sorted(after.mapped_pgs) == [(2, 1), (2, 3)]
+    # the base mapping is left alone
+    assert before.pg_up['2.1'] == [4]
+    assert ms.pg_up['2.1'] == [3]
+    assert ms.calc_misplaced_from(before) == 1 / 8
+    # compared to an unrelated state all PGs are compared
+    assert ms.calc_misplaced_from(MappingState(FakeOSDMap(), RAW_PG_STATS, RAW_POOL_STATS)) == \
+        1 / 8
+
+
+def test_crush_change_remaps_all_pools():
+    after = FakeOSDMap()
+    make_states(after, {'crush': {}})
+    assert sorted(after.mapped_pools) == [1, 2]
+
+    after = FakeOSDMap()
+    make_states(after, {'crush': {}}, changed_osds={4})
+    assert after.mapped_pools == [2]
+
+
+def test_other_changes_map_everything_again():
+    after = FakeOSDMap()
+    before, ms = make_states(after, {'osd_state_xor': [{'osd': 0, 'state_xor': 2}]})
+    assert ms.base is None
+    assert ms.pg_stat is not before.pg_stat
+    assert sorted(after.mapped_pools) == [1, 2]
+
+
+def test_new_primary_affinity_maps_everything_again():
+    after = FakeOSDMap()
+    before, ms = make_states(after, {'new_primary_affinity': [{'osd': 0, 'affinity': 0}]})
+    assert ms.base is None
+    assert sorted(after.mapped_pools) == [1, 2]
+
+
+class FakeModule:
+    mapping_state = Module.mapping_state
+    last_state = None
+
+    def get(self, data_name):
+        return {'pg_stats': RAW_PG_STATS, 'pool_stats': RAW_POOL_STATS}[data_name]
+
+
+def test_mapping_state_reuses_mapping_of_same_epoch():
+    module = FakeModule()
+    first = module.mapping_state(FakeOSDMap(), 'first')
+    osdmap = FakeOSDMap()
+    ms = module.mapping_state(osdmap, 'second')
+    assert osdmap.mapped_pools == []
+    assert ms.pg_up_by_poolid[1] is first.pg_up_by_poolid[1]
+    assert ms.pg_stat is not first.pg_stat
+
+    osdmap = FakeOSDMap(shift=1, epoch=2)
+    ms = module.mapping_state(osdmap, 'third')
+    assert sorted(osdmap.mapped_pools) == [1, 2]
+    assert ms.pg_up['1.0'] == [1, 2]
+    assert module.last_state is ms
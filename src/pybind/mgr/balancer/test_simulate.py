@@ -0,0 +1,215 @@
+import pytest
+
+from .module import Module
+from .simulate import Simulation, stand_in
+
+NUM_OSD = 4
+PG_NUM = 16
+
+
+class FakeInc:
+    def __init__(self):
+        self.upmaps = {}
+
+    def dump(self):
+        return {'new_pg_upmap_items': [{'pgid': pgid, 'mappings': []} for pgid in self.upmaps]}
+
+    def merge_upmaps(self, other, pgids=None):
+        self.upmaps.update((pgid, up) for pgid, up in other.upmaps.items()
+                           if pgids is None or pgid in pgids)
+
+
+class FakeCRUSH:
+    def find_takes(self):
+        return [-1]
+
+    def get_item_name(self, item):
+        return 'default'
+
+    def get_take_weight_osd_map(self, take):
+        return {osd: 1.0 for osd in range(NUM_OSD)}
+
+    def get_rule_by_id(self, rule_id):
+        return {'rule_name': 'replicated_rule'}
+
+    def get_rule_root(self, rule_name):
+        return -1
+
+    def get_osds_under(self, root_id):
+        return list(range(NUM_OSD))
+
+    def dump(self):
+        return {'buckets': [{'id': -1}], 'choose_args': {}}
+
+
+class FakeOSDMap:
+    """
+    One pool whose PGs all start out on osd.0 and osd.1. calc_pg_upmaps()
+    moves PG instances from the fullest to the emptiest OSD.
+    """
+
+    def __init__(self, upmaps=None, epoch=1):
+        self.upmaps = upmaps or {}
+        self.epoch = epoch
+
+    def dump(self):
+        return {
+            'flags': '',
+            'pools': [{'pool': 1, 'pool_name': 'rbd', 'crush_rule': 0, 'size': 2,
+                       'pg_num': PG_NUM, 'pg_num_target': PG_NUM, 'flags_names': '',
+                       'pg_autoscale_mode': 'on', 'options': {}}],
+            'osds': [{'osd': osd, 'weight': 1.0} for osd in range(NUM_OSD)],
+        }
+
+    def get_pools_by_name(self):
+        return {p['pool_name']: p for p in self.dump()['pools']}
+
+    def get_crush(self):
+        return FakeCRUSH()
+
+    def get_pools_by_take(self, take):
+        return [1]
+
+    def pool_raw_used_rate(self, poolid):
+        return 2.0
+
+    def new_incremental(self):
+        return FakeInc()
+
+    def get_epoch(self):
+        return self.epoch
+
+    def apply_incremental(self, inc):
+        return FakeOSDMap(dict(self.upmaps, **inc.upmaps), self.epoch + 1)
+
+    def map_pool_pgs_up(self, poolid):
+        return {'1.%x' % ps: self.pg_to_up_acting_osds(poolid, ps)['up'] for ps in range(PG_NUM)}
+
+    def pg_to_up_acting_osds(self, poolid, ps):
+        return {'up': self.upmaps.get('1.%x' % ps, [0, 1])}
+
+    def calc_pg_upmaps(self, inc, max_deviation, max_iterations, pools):
+        upmaps = dict(self.upmaps, **inc.upmaps)
+        did = 0
+        while did < max_iterations:
+            pg_up = {'1.%x' % ps: upmaps.get('1.%x' % ps, [0, 1]) for ps in range(PG_NUM)}
+            counts = {osd: 0 for osd in range(NUM_OSD)}
+            for up in pg_up.values():
+                for osd in up:
+                    counts[osd] += 1
+            fullest = max(counts, key=lambda osd: counts[osd])
+            emptiest = min(counts, key=lambda osd: counts[osd])
+            if counts[fullest] - PG_NUM * 2 // NUM_OSD <= max_deviation:
+                break
+            pgid = next(pgid for pgid, up in sorted(pg_up.items())
+                        if fullest in up and emptiest not in up)
+            inc.upmaps[pgid] = [emptiest if osd == fullest else osd for osd in pg_up[pgid]]
+            upmaps[pgid] = inc.upmaps[pgid]
+            did += 1
+        return did
+
+
+PG_DUMP = {
+    'pg_stats': [{'pgid': '1.%x' % ps, 'stat_sum': {'num_objects': 1, 'num_bytes': 100}}
+                 for ps in range(PG_NUM)],
+    'pool_stats': [{'poolid': 1, 'stat_sum': {'num_bytes': 100 * PG_NUM}}],
+    'osd_stats': [{'osd': osd, 'kb': 1 << 20} for osd in range(NUM_OSD)],
+}
+
+
+def test_stand_in_options():
+    balancer = stand_in(Module)(None, {'upmap_max_deviation': 1})
+    assert balancer.get_module_option('upmap_max_deviation') == 1
+    assert balancer.get_module_option('upmap_max_optimizations') == 10
+    assert not hasattr(balancer, 'mon_command')
+
+
+def test_upmap_converges():
+    sim = Simulation(FakeOSDMap(), PG_DUMP,
+                     balancer_options={'upmap_max_optimizations': 4, 'upmap_max_deviation': 1})
+    report = sim.run(ticks=10)
+    assert report['converged']
+    assert report['ticks'] == 4
+    assert report['tick_results'][-1]['detail'].startswith('Unable to find further optimization')
+    # 7 PGs moved both of their instances off osd.0 and osd.1
+    assert report['moved_pgs'] == 7
+    assert report['moved_bytes'] == 1400
+    assert report['final_score'] < report['initial_score']
+    # the simulated cluster is the balanced one
+    assert sorted(sim.osdmap.upmaps.values()) == [[2, 3]] * 7
+
+
+def test_tick_limit():
+    sim = Simulation(FakeOSDMap(), PG_DUMP, balancer_options={'upmap_max_optimizations': 1})
+    report = sim.run(ticks=3)
+    assert not report['converged']
+    assert report['ticks'] == 3
+    assert [r['moved_pgs'] for r in report['tick_results']] == [1, 1, 1]
+
+
+def test_byte_budget():
+    # PGs with an even ps are big
+    pg_dump = dict(PG_DUMP, pg_stats=[
+        {'pgid': '1.%x' % ps, 'stat_sum': {'num_objects': 1, 'num_bytes': 10 if ps % 2 else 1000}}
+        for ps in range(PG_NUM)])
+    sim = Simulation(FakeOSDMap(), pg_dump,
+                     balancer_options={'upmap_max_optimizations': 4, 'upmap_max_deviation': 1,
+                                       'upmap_max_bytes': 50})
+    report = sim.run(ticks=1)
+    # both instances of two small PGs fit into the budget
+    assert report['moved_pgs'] == 2
+    assert report['moved_bytes'] == 40
+    assert all(int(pgid.split('.')[1], 16) % 2 for pgid in sim.osdmap.upmaps)
+
+    sim = Simulation(FakeOSDMap(), pg_dump,
+                     balancer_options={'upmap_max_optimizations': 4, 'upmap_max_deviation': 1,
+                                       'upmap_max_bytes_per_osd': 1000})
+    report = sim.run(ticks=1)
+    # the three small PGs among the candidates are taken first, after
+    # which no big one fits any more
+    assert report['moved_pgs'] == 3
+    assert report['moved_bytes'] == 60
+
+
+def test_byte_budget_smaller_than_any_pg():
+    pg_dump = dict(PG_DUMP, pg_stats=[
+        {'pgid': '1.%x' % ps, 'stat_sum': {'num_objects': 1, 'num_bytes': 1000}}
+        for ps in range(PG_NUM)])
+    for option in ('upmap_max_bytes', 'upmap_max_bytes_per_osd'):
+        sim = Simulation(FakeOSDMap(), pg_dump,
+                         balancer_options={'upmap_max_optimizations': 4,
+                                           'upmap_max_deviation': 1, option: 50})
+        report = sim.run(ticks=2)
+        # the best candidate is taken anyway, one per tick
+        assert not report['converged']
+        assert [r['moved_pgs'] for r in report['tick_results']] == [1, 1]
+
+
+def test_crush_compat_without_weight_set():
+    # creating the compat weight-set would need a command to the monitors
+    sim = Simulation(FakeOSDMap(), PG_DUMP, balancer_options={'mode': 'crush-compat'})
+    report = sim.run(ticks=1)
+    assert not report['converged']
+    assert report['ticks'] == 0
+    assert report['tick_results'][0]['detail']
+
+
+def test_autoscaler_threshold():
+    # the pool is nearly empty, so it is scaled to the minimum of 32 PGs
+    for threshold, would_adjust in ((2.0, False), (1.5, True)):
+        sim = Simulation(FakeOSDMap(), PG_DUMP, autoscaler_options={'threshold': threshold})
+        report = sim.run(ticks=0, autoscaler=True)
+        assert report['autoscaler']['pools'] == [{
+            'pool_name': 'rbd',
+            'pg_num_target': PG_NUM,
+            'pg_num_final': 32,
+            'would_adjust': would_adjust,
+        }]
+
+
+def test_get():
+    sim = Simulation(FakeOSDMap(), PG_DUMP)
+    assert sim.get('df')['pools'][0]['stats']['bytes_used'] == 3200
+    assert sim.get('pg_status')['pgs_by_pool_state'][0]['pg_state_counts'][0]['count'] == PG_NUM
+    with pytest.raises(KeyError):
+        sim.get('io_rate')
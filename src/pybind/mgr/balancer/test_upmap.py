@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+from .module import Module, MsPlan, Plan, group_pools_by_root
+
+
+class FakeInc:
+    def __init__(self):
+        self.items = {}
+
+    def merge_upmaps(self, other):
+        self.items.update(other.items)
+
+
+class FakeCRUSH:
+    # root -> osds; 'ssd' shares osd 4 with 'default'
+    ROOTS = {-1: ('default', [0, 1, 2, 3, 4]), -2: ('ssd', [4, 5]), -3: ('archive', [6, 7])}
+
+    def find_takes(self):
+        return list(self.ROOTS)
+
+    def get_item_name(self, take):
+        return self.ROOTS[take][0]
+
+    def get_take_weight_osd_map(self, take):
+        return {osd: 1.0 for osd in self.ROOTS[take][1]}
+
+
+class FakeOSDMap:
+    POOLS_BY_TAKE = {-1: [1, 2], -2: [3], -3: [4]}
+
+    def __init__(self, upmaps_per_pool=3):
+        self.upmaps_per_pool = upmaps_per_pool
+        self.threads = set()
+
+    def dump(self):
+        return {'pools': [{'pool': i, 'pool_name': 'pool%d' % i, 'pg_num': 8, 'pg_num_target': 8,
+                           'crush_rule': 0} for i in range(1, 5)]}
+
+    def get_crush(self):
+        return FakeCRUSH()
+
+    def get_pools_by_take(self, take):
+        return self.POOLS_BY_TAKE[take]
+
+    def new_incremental(self):
+        return FakeInc()
+
+    def calc_pg_upmaps(self, inc, max_deviation, max_iterations, pools):
+        self.threads.add(threading.current_thread().name)
+        time.sleep(0.01)
+        did = min(max_iterations, self.upmaps_per_pool)
+        for i in range(did):
+            inc.items['%s.%x' % (pools[0], i)] = max_deviation
+        return did
+
+
+class FakeModule:
+    do_upmap = Module.do_upmap
+    calc_pool_upmaps = Module.calc_pool_upmaps
+    do_upmap_by_root = Module.do_upmap_by_root
+    get_pg_bytes = Module.get_pg_bytes
+
+    def __init__(self, parallel, max_optimizations=10):
+        self.log = logging.getLogger(__name__)
+        self.options = {
+            'upmap_parallel_roots': parallel,
+            'upmap_max_optimizations': max_optimizations,
+            'upmap_max_deviation': 1,
+            'upmap_max_bytes': 0,
+            'upmap_max_bytes_per_osd': 0,
+        }
+        self.no_optimization_needed = False
+        self.upmap_root_stats = {}
+        self.fetched = []
+
+    def get(self, data_name):
+        self.fetched.append(data_name)
+        assert data_name == 'pg_stats'
+        return {'pg_stats': [{'pgid': '1.0', 'stat_sum': {'num_bytes': 100}}]}
+
+    def get_module_option(self, key):
+        return self.options[key]
+
+
+def make_plan(osdmap):
+    plan = Plan('test', 'upmap', osdmap, [])
+    plan.pg_status = {'pgs_by_pool_state': [
+        {'pool_id': i, 'pg_state_counts': [{'state_name': 'active+clean', 'count': 8}]}
+        for i in range(1, 5)]}
+    return plan
+
+
+def test_group_pools_by_root():
+    osdmap = FakeOSDMap()
+    pool_ids = {'pool%d' % i: i for i in range(1, 5)}
+    groups = group_pools_by_root(osdmap, FakeCRUSH(), pool_ids,
+                                 ['pool4', 'pool3', 'pool1', 'pool2'])
+    assert sorted(groups) == [(['archive'], ['pool4']),
+                              (['default', 'ssd'], ['pool3', 'pool1', 'pool2'])]
+    # roots without selected pools are left out
+    assert group_pools_by_root(osdmap, FakeCRUSH(), pool_ids, ['pool4']) == \
+        [(['archive'], ['pool4'])]
+
+
+def test_sequential_shares_budget():
+    osdmap = FakeOSDMap()
+    module = FakeModule(parallel=False, max_optimizations=5)
+    plan = make_plan(osdmap)
+    assert module.do_upmap(plan) == (0, '')
+    assert len(plan.inc.items) == 5
+    assert module.upmap_root_stats == {}
+
+
+def test_parallel_roots():
+    osdmap = FakeOSDMap()
+    module = FakeModule(parallel=True, max_optimizations=5)
+    plan = make_plan(osdmap)
+    assert module.do_upmap(plan) == (0, '')
+    # each group of roots gets the whole budget
+    assert len(plan.inc.items) == 8
+    stats = module.upmap_root_stats
+    assert sorted(stats) == ['archive', 'default,ssd']
+    assert stats['archive']['changes'] == 3
+    assert stats['archive']['converged']
+    assert stats['default,ssd']['changes'] == 5
+    assert not stats['default,ssd']['converged']
+    assert all(name.startswith('balancer-upmap') for name in osdmap.threads)
+
+
+def test_parallel_roots_nothing_to_do():
+    module = FakeModule(parallel=True)
+    plan = make_plan(FakeOSDMap(upmaps_per_pool=0))
+    assert module.do_upmap(plan)[1].startswith('Unable to find further optimization')
+    assert module.no_optimization_needed
+
+
+def test_pg_bytes_fetched_once_per_plan():
+    module = FakeModule(parallel=False)
+    plan = make_plan(FakeOSDMap())
+    assert module.get_pg_bytes(plan) == {'1.0': 100}
+    assert module.get_pg_bytes(plan) == {'1.0': 100}
+    assert module.fetched == ['pg_stats']
+
+
+def test_pg_bytes_of_ms_plan():
+    class FakeMappingState:
+        osdmap = FakeOSDMap()
+        pg_stat = {'1.0': {'num_bytes': 200}, '1.1': {}}
+
+    module = FakeModule(parallel=False)
+    plan = MsPlan('test', 'upmap-read', FakeMappingState(), [])
+    assert module.get_pg_bytes(plan) == {'1.0': 200, '1.1': 0}
+    assert module.fetched == []
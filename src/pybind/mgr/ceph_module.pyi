@@ -25,12 +25,15 @@ class BasePyOSDMap(object):
     def _pool_raw_used_rate(self, pool_id):...
     @classmethod
     def _build_simple(cls, epoch: int, uuid: Optional[str], num_osd: int) -> 'BasePyOSDMap' :...
+    @classmethod
+    def _decode(cls, data: bytes) -> 'BasePyOSDMap' :...
 
 class BasePyOSDMapIncremental(object):
     def _get_epoch(self):...
     def _dump(self):...
     def _set_osd_reweights(self, weightmap):...
     def _set_crush_compat_weight_set_weights(self, weightmap):...
+    def _merge_upmaps(self, other: 'BasePyOSDMapIncremental', pgids: Optional[List[str]] = None):...
 
 class BasePyCRUSH(object):
     def _dump(self):...
@@ -39,6 +42,7 @@ class BasePyCRUSH(object):
     def _find_roots(self):...
     def _find_takes(self):...
     def _get_take_weight_osd_map(self, root):...
+    def _get_checksum(self) -> int: ...
 
 class BaseMgrStandbyModule(object):
     def __init__(self, capsule): pass
@@ -71,7 +75,9 @@ class BaseMgrModule(object):
     def _ceph_get(self, data_name: str) -> Any: ...
     def _ceph_get_server(self, hostname: Optional[str]) -> Union[ServerInfoT,
                                                                  List[ServerInfoT]]: ...
+    def _ceph_get_pg_progress(self, since: int) -> Dict[str, Any]: ...
     def _ceph_get_perf_schema(self, svc_type: str, svc_name: str) -> Dict[str, Any]: ...
+    def _ceph_get_unlabeled_perf_counters(self, services: List[str], counters: List[str], prio_limit: int, since: float) -> Dict[str, Any]: ...
     def _ceph_get_rocksdb_version(self) -> str: ...
     def _ceph_get_counter(self, svc_type: str, svc_name: str, path: str) -> Dict[str, List[Tuple[float, int]]]: ...
     def _ceph_get_latest_counter(self, svc_type, svc_name, path): ...
@@ -29,6 +29,9 @@ from typing import Any, Dict, List, Set, TYPE_CHECKING, Optional, MutableMapping
 if TYPE_CHECKING:
     from cephadm.module import CephadmOrchestrator
 
+# the sections of the host metadata an agent reports
+METADATA_SECTIONS = ['ls', 'networks', 'facts', 'volume']
+
 
 def cherrypy_filter(record: logging.LogRecord) -> bool:
     blocked = [
@@ -657,6 +660,8 @@ class HostData(Server):
             # host agent is reporting on is marked offline, it shouldn't be any more
             self.mgr.offline_hosts_remove(data['host'])
             results['result'] = self.handle_metadata(data)
+            # lets the agent leave out unchanged sections from its next report
+            results['digests'] = dict(self.mgr.cache.metadata_digests.get(data['host'], {}))
         return results
 
     def check_request_fields(self, data: Dict[str, Any]) -> None:
@@ -685,9 +690,10 @@ class HostData(Server):
         except Exception as e:
             raise Exception(
                 f'Counter value from agent on host {host} could not be converted to an integer: {e}')
-        metadata_types = ['ls', 'networks', 'facts', 'volume']
+        metadata_types = METADATA_SECTIONS
         metadata_types_str = '{' + ', '.join(metadata_types) + '}'
-        if not all(item in data.keys() for item in metadata_types):
+        digests = data.get('digests') or {}
+        if not all(item in data.keys() or item in digests for item in metadata_types):
             self.mgr.log.warning(
                 f'Agent on host {host} reported incomplete metadata. Not all of {metadata_types_str} were present. Received fields {fields}')
 
@@ -720,6 +726,23 @@ class HostData(Server):
                 self.mgr.log.debug(
                     f'Received old metadata from agent on host {host}. Requested up-to-date metadata.')
 
+            # Agents that send digests leave out the sections that haven't
+            # changed since the digests we returned for their last report.
+            digests = data.get('digests') or {}
+            known_digests = self.mgr.cache.metadata_digests.setdefault(host, {})
+            unchanged = [
+                section for section in METADATA_SECTIONS
+                if section not in data and section in digests
+                and known_digests.get(section) == digests[section]
+            ]
+            if any(section not in data and section not in unchanged for section in digests):
+                # we no longer have what the agent left out
+                if not self.mgr.agent_cache.messaging_agent(host):
+                    self.mgr.agent_helpers._request_agent_acks({host})
+                self.mgr.log.debug(
+                    f'Agent on host {host} left out metadata we no longer have. Requested full metadata.')
+            self.mgr.cache.touch_host_metadata(host, unchanged)
+
             if 'ls' in data and data['ls']:
                 self.mgr._process_ls_output(host, data['ls'])
                 self.mgr.update_failed_daemon_health_check()
@@ -730,6 +753,9 @@ class HostData(Server):
             if 'volume' in data and data['volume']:
                 ret = Devices.from_json(json.loads(data['volume']))
                 self.mgr.cache.update_host_devices(host, ret.devices)
+            for section in METADATA_SECTIONS:
+                if data.get(section) and section in digests:
+                    known_digests[section] = digests[section]
 
             if (
                 error_daemons_old != set([dd.name() for dd in self.mgr.cache.get_error_daemons()])
@@ -737,9 +763,10 @@ class HostData(Server):
             ):
                 self.mgr.log.debug(
                     f'Change detected in state of daemons from {host} agent metadata. Kicking serve loop')
+                self.mgr.cache.refresh_scheduler.wake(host)
                 self.mgr._kick_serve_loop()
 
-            if up_to_date and ('ls' in data and data['ls']):
+            if up_to_date and (('ls' in data and data['ls']) or 'ls' in unchanged):
                 was_out_of_date = not self.mgr.cache.all_host_metadata_up_to_date()
                 self.mgr.cache.metadata_up_to_date[host] = True
                 if was_out_of_date and self.mgr.cache.all_host_metadata_up_to_date():
@@ -0,0 +1,109 @@
+"""
+Benchmark of the HostCache daemon lookups on a synthetic cluster.
+
+Every host runs a crash and a node-exporter daemon and a share of the
+OSDs; the first hosts also run the mons, mgrs and rgws. The full scans of
+HostCache.daemons the lookups did before HostCache indexed the daemons are
+timed alongside, and checked to give the same daemons in the same order::
+
+    cd src/pybind/mgr
+    UNITTEST=1 PYTHONPATH=..:. python3 -m cephadm.bench_daemon_lookups --daemons 5000
+"""
+
+import argparse
+import random
+import time
+from typing import Callable, Dict, List, Tuple
+
+from orchestrator import DaemonDescription, OrchestratorError, service_to_daemon_types
+
+from .inventory import HostCache
+
+
+def synthetic_daemons(num_daemons: int, num_hosts: int) -> Dict[str, Dict[str, DaemonDescription]]:
+    hosts = ['host%d' % i for i in range(num_hosts)]
+    dms: Dict[str, Dict[str, DaemonDescription]] = {host: {} for host in hosts}
+
+    def add(daemon_type: str, daemon_id: str, host: str) -> None:
+        dd = DaemonDescription(daemon_type=daemon_type, daemon_id=daemon_id, hostname=host)
+        dms[host][dd.name()] = dd
+
+    for host in hosts:
+        add('crash', host, host)
+        add('node-exporter', host, host)
+    for host in hosts[:3]:
+        add('mon', host, host)
+        add('mgr', host + '.abcdef', host)
+    for i, host in enumerate(hosts[:4]):
+        add('rgw', 'foo.%s.%06d' % (host, i), host)
+    for osd in range(max(0, num_daemons - sum(len(dm) for dm in dms.values()))):
+        add('osd', str(osd), hosts[osd % num_hosts])
+    return dms
+
+
+def scan_daemon(cache: HostCache, daemon_name: str) -> List[DaemonDescription]:
+    for dm in cache.daemons.values():
+        for dd in dm.values():
+            if dd.name() == daemon_name:
+                return [dd]
+    return []
+
+
+def scan_by_service(cache: HostCache, service_name: str) -> List[DaemonDescription]:
+    return [d for dm in cache.daemons.values() for d in dm.values()
+            if d.service_name() == service_name]
+
+
+def scan_by_type(cache: HostCache, service_type: str) -> List[DaemonDescription]:
+    return [d for dm in cache.daemons.values() for d in dm.values()
+            if d.daemon_type in service_to_daemon_types(service_type)]
+
+
+def get_daemon(cache: HostCache, daemon_name: str) -> List[DaemonDescription]:
+    try:
+        return [cache.get_daemon(daemon_name)]
+    except OrchestratorError:
+        return []
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='benchmark cephadm daemon lookups')
+    parser.add_argument('--daemons', type=int, default=5000)
+    parser.add_argument('--hosts', type=int, default=200)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    cache = HostCache(None)  # type: ignore
+    cache.daemons = synthetic_daemons(args.daemons, args.hosts)
+    names = [name for dm in cache.daemons.values() for name in dm]
+    rng = random.Random(0)
+    queries: List[Tuple[str, Callable, Callable, List[str]]] = [
+        ('get_daemon', scan_daemon, get_daemon,
+         [rng.choice(names) for _ in range(args.lookups)]),
+        ('get_daemons_by_service', scan_by_service, HostCache.get_daemons_by_service,
+         [rng.choice(['mon', 'mgr', 'crash', 'rgw.foo', 'osd']) for _ in range(args.lookups)]),
+        ('get_daemons_by_type', scan_by_type, HostCache.get_daemons_by_type,
+         [rng.choice(['mon', 'mgr', 'crash', 'rgw', 'osd']) for _ in range(args.lookups)]),
+    ]
+    print('{} daemons on {} hosts, {} lookups each'.format(
+        len(names), len(cache.daemons), args.lookups))
+
+    # builds the index
+    cache.get_daemons_by_service('mon')
+
+    for query, scan, lookup, keys in queries:
+        for key in set(keys):
+            assert scan(cache, key) == lookup(cache, key), key
+        for name, f in (('full scan', scan), ('indexed', lookup)):
+            times = []
+            for _ in range(args.runs):
+                t = time.perf_counter()
+                for key in keys:
+                    f(cache, key)
+                times.append(time.perf_counter() - t)
+            print('{:<24} {:<10} best {:.3f}s of {}'.format(query, name, min(times), args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,15 @@
 import datetime
 import enum
 from copy import copy
+import hashlib
 import ipaddress
 import itertools
 import json
 import logging
 import math
 import socket
-from typing import TYPE_CHECKING, Dict, List, Iterator, Optional, Any, Tuple, Set, Mapping, cast, \
+import threading
+from typing import TYPE_CHECKING, Dict, List, Iterable, Iterator, Optional, Any, Tuple, Set, Mapping, cast, \
     NamedTuple, Type, ValuesView, Union
 
 import orchestrator
@@ -26,6 +28,7 @@ from orchestrator import OrchestratorError, HostSpec, OrchestratorEvent, service
 from cephadm.services.cephadmservice import CephadmDaemonDeploySpec
 
 from .utils import resolve_ip, SpecialHostLabels
+from .refresh import HostRefreshScheduler
 from .migrations import queue_migrate_nfs_spec, queue_migrate_rgw_spec
 
 if TYPE_CHECKING:
@@ -675,6 +678,83 @@ class TunedProfileStore():
         return [p for p in self.profiles.values()]
 
 
+class DaemonIndex():
+    """
+    The daemons of HostCache.daemons by daemon name, by service name and by
+    daemon type.
+
+    Lookups return the daemons in the order of HostCache.daemons, i.e. by
+    host, then in the order of the daemons of the host. Every entry carries
+    the position of its daemon for that.
+    """
+
+    Entries = Dict[Tuple[str, str], Tuple[Tuple[int, int], orchestrator.DaemonDescription]]
+
+    def __init__(self) -> None:
+        self.by_name: Dict[str, DaemonIndex.Entries] = {}
+        self.by_service: Dict[str, DaemonIndex.Entries] = {}
+        self.by_type: Dict[str, DaemonIndex.Entries] = {}
+        self._host_pos: Dict[str, int] = {}
+        self._next_host_pos = 0
+        self._next_daemon_pos: Dict[str, int] = {}
+
+    def _indexes(self, dd: orchestrator.DaemonDescription) -> Iterator[Tuple[Dict[str, 'DaemonIndex.Entries'], str]]:
+        yield self.by_name, dd.name()
+        yield self.by_type, cast(str, dd.daemon_type)
+        try:
+            yield self.by_service, dd.service_name()
+        except OrchestratorError:
+            # e.g. daemons without a host; no service can own them
+            pass
+
+    def _add(self, host: str, name: str, dd: orchestrator.DaemonDescription, pos: Tuple[int, int]) -> None:
+        for index, key in self._indexes(dd):
+            index.setdefault(key, {})[(host, name)] = (pos, dd)
+
+    def _remove(self, host: str, name: str, dd: orchestrator.DaemonDescription) -> None:
+        for index, key in self._indexes(dd):
+            entries = index.get(key, {})
+            entries.pop((host, name), None)
+            if not entries:
+                index.pop(key, None)
+
+    def set_host(self,
+                 host: str,
+                 old: Dict[str, orchestrator.DaemonDescription],
+                 new: Optional[Dict[str, orchestrator.DaemonDescription]]) -> None:
+        for name, dd in old.items():
+            self._remove(host, name, dd)
+        if new is None:
+            self._host_pos.pop(host, None)
+            self._next_daemon_pos.pop(host, None)
+            return
+        if host not in self._host_pos:
+            self._host_pos[host] = self._next_host_pos
+            self._next_host_pos += 1
+        for i, (name, dd) in enumerate(new.items()):
+            self._add(host, name, dd, (self._host_pos[host], i))
+        self._next_daemon_pos[host] = len(new)
+
+    def set_daemon(self,
+                   host: str,
+                   name: str,
+                   old: Optional[orchestrator.DaemonDescription],
+                   new: Optional[orchestrator.DaemonDescription]) -> None:
+        if old is not None:
+            pos = self.by_name[old.name()][(host, name)][0]
+            self._remove(host, name, old)
+        else:
+            pos = (self._host_pos[host], self._next_daemon_pos[host])
+            self._next_daemon_pos[host] += 1
+        if new is not None:
+            self._add(host, name, new, pos)
+
+    @staticmethod
+    def lookup(index: Dict[str, 'DaemonIndex.Entries'], keys: Iterable[str]) -> List[orchestrator.DaemonDescription]:
+        entries = [e for key in keys for e in index.get(key, {}).values()]
+        return [dd for _, dd in sorted(entries, key=lambda e: e[0])]
+
+
 class HostCache():
     """
     HostCache stores different things:
@@ -704,11 +784,21 @@ class HostCache():
     Used to run daemon actions after deploying a daemon. We need to
     store it persistently, in order to stay consistent across
     MGR failovers.
+
+    Lookups of daemons by name, service and type go through a DaemonIndex.
+    It is kept up to date by the methods that change `daemons`, and built
+    again from scratch after `daemons` is replaced.
+
+    save_host() only marks a host dirty. The serve loop persists the dirty
+    hosts with flush(), which skips config-key writes whose content did not
+    change since the last write.
     """
 
     def __init__(self, mgr):
         # type: (CephadmOrchestrator) -> None
         self.mgr: CephadmOrchestrator = mgr
+        self._daemon_index_lock = threading.Lock()
+        self._daemon_index: Optional[DaemonIndex] = None
         self.daemons = {}   # type: Dict[str, Dict[str, orchestrator.DaemonDescription]]
         self._tmp_daemons = {}  # type: Dict[str, Dict[str, orchestrator.DaemonDescription]]
         self.last_daemon_update = {}   # type: Dict[str, datetime.datetime]
@@ -738,6 +828,47 @@ class HostCache():
         self.scheduled_daemon_actions: Dict[str, Dict[str, str]] = {}
 
         self.metadata_up_to_date = {}  # type: Dict[str, bool]
+        # host -> metadata section -> digest of what the agent last reported
+        self.metadata_digests: Dict[str, Dict[str, str]] = {}
+
+        # hosts to persist with the next flush()
+        self._dirty_hosts: Set[str] = set()
+        self._dirty_devices: Set[str] = set()
+        # config-key -> digest of the value we last wrote to it
+        self._stored_digests: Dict[str, str] = {}
+
+        self.refresh_scheduler = HostRefreshScheduler()
+
+    @property
+    def daemons(self) -> Dict[str, Dict[str, orchestrator.DaemonDescription]]:
+        return self._daemons
+
+    @daemons.setter
+    def daemons(self, daemons: Dict[str, Dict[str, orchestrator.DaemonDescription]]) -> None:
+        with self._daemon_index_lock:
+            self._daemons = daemons
+            self._daemon_index = None
+
+    def _lookup_daemons(self, index: str, *keys: str) -> List[orchestrator.DaemonDescription]:
+        with self._daemon_index_lock:
+            if self._daemon_index is None:
+                self._daemon_index = DaemonIndex()
+                for host, dm in self._daemons.items():
+                    self._daemon_index.set_host(host, {}, dm)
+            return DaemonIndex.lookup(getattr(self._daemon_index, index), keys)
+
+    def _set_host_daemons(self, host: str, dm: Optional[Dict[str, orchestrator.DaemonDescription]]) -> None:
+        """
+        Replace the daemons of ``host`` with ``dm``, or remove the host if
+        ``dm`` is None.
+        """
+        with self._daemon_index_lock:
+            if self._daemon_index is not None:
+                self._daemon_index.set_host(host, self._daemons.get(host, {}), dm)
+            if dm is None:
+                self._daemons.pop(host, None)
+            else:
+                self._daemons[host] = dm
 
     def load(self):
         # type: () -> None
@@ -751,6 +882,7 @@ class HostCache():
                 self.mgr.set_store(k, None)
             try:
                 j = json.loads(v)
+                self._stored_digests[k] = self._store_digest(v)
                 if 'last_device_update' in j:
                     self.last_device_update[host] = str_to_datetime(j['last_device_update'])
                 else:
@@ -761,18 +893,20 @@ class HostCache():
                 # and always trigger a new scrape on mgr restart.
                 self.daemon_refresh_queue.append(host)
                 self.network_refresh_queue.append(host)
-                self.daemons[host] = {}
+                self._set_host_daemons(host, {})
                 self.osdspec_previews[host] = []
                 self.osdspec_last_applied[host] = {}
                 self.networks[host] = {}
                 self.daemon_config_deps[host] = {}
-                for name, d in j.get('daemons', {}).items():
-                    self.daemons[host][name] = \
-                        orchestrator.DaemonDescription.from_json(d)
+                self._set_host_daemons(host, {
+                    name: orchestrator.DaemonDescription.from_json(d)
+                    for name, d in j.get('daemons', {}).items()
+                })
                 self.devices[host] = []
                 # still want to check old device location for upgrade scenarios
                 for d in j.get('devices', []):
                     self.devices[host].append(inventory.Device.from_json(d))
+                    self._dirty_devices.add(host)
                 self.devices[host] += self.load_host_devices(host)
                 self.networks[host] = j.get('networks_and_interfaces', {})
                 self.osdspec_previews[host] = j.get('osdspec_previews', {})
@@ -823,9 +957,10 @@ class HostCache():
 
     def update_host_daemons(self, host, dm):
         # type: (str, Dict[str, orchestrator.DaemonDescription]) -> None
-        self.daemons[host] = dm
+        self._set_host_daemons(host, dm)
         self._tmp_daemons.pop(host, {})
         self.last_daemon_update[host] = datetime_now()
+        self.forget_metadata_digest(host, 'ls')
 
     def append_tmp_daemon(self, host: str, dd: orchestrator.DaemonDescription) -> None:
         # for storing empty daemon descriptions representing daemons we have
@@ -845,6 +980,7 @@ class HostCache():
             hostnames.append(v if isinstance(v, str) else '')
         self.mgr.inventory.update_known_hostnames(hostnames[0], hostnames[1], hostnames[2])
         self.last_facts_update[host] = datetime_now()
+        self.forget_metadata_digest(host, 'facts')
 
     def update_autotune(self, host: str) -> None:
         self.last_autotune[host] = datetime_now()
@@ -875,6 +1011,8 @@ class HostCache():
             self.last_device_change[host] = datetime_now()
         self.last_device_update[host] = datetime_now()
         self.devices[host] = dls
+        self._dirty_devices.add(host)
+        self.forget_metadata_digest(host, 'volume')
 
     def update_host_networks(
             self,
@@ -883,6 +1021,28 @@ class HostCache():
     ) -> None:
         self.networks[host] = nets
         self.last_network_update[host] = datetime_now()
+        self.forget_metadata_digest(host, 'networks')
+
+    def forget_metadata_digest(self, host: str, section: str) -> None:
+        self.metadata_digests.get(host, {}).pop(section, None)
+
+    def touch_host_metadata(self, host: str, sections: Iterable[str]) -> None:
+        """
+        Mark the sections of the metadata of ``host`` an agent reported as
+        unchanged as refreshed, without parsing or persisting them again.
+        """
+        now = datetime_now()
+        for section in sections:
+            if section == 'ls':
+                self.last_daemon_update[host] = now
+                for dd in self.daemons.get(host, {}).values():
+                    dd.last_refresh = now
+            elif section == 'networks':
+                self.last_network_update[host] = now
+            elif section == 'facts':
+                self.last_facts_update[host] = now
+            elif section == 'volume':
+                self.last_device_update[host] = now
 
     def update_daemon_config_deps(self, host: str, name: str, deps: List[str], stamp: datetime.datetime) -> None:
         self.daemon_config_deps[host][name] = {
@@ -921,7 +1081,7 @@ class HostCache():
         """
         Install an empty entry for a host
         """
-        self.daemons[host] = {}
+        self._set_host_daemons(host, {})
         self.devices[host] = []
         self.networks[host] = {}
         self.osdspec_previews[host] = []
@@ -933,6 +1093,7 @@ class HostCache():
         self.osdspec_previews_refresh_queue.append(host)
         self.registry_login_queue.add(host)
         self.last_client_files[host] = {}
+        self.refresh_scheduler.wake(host)
 
     def refresh_all_host_info(self, host):
         # type: (str) -> None
@@ -944,12 +1105,16 @@ class HostCache():
         self.last_facts_update.pop(host, None)
         self.osdspec_previews_refresh_queue.append(host)
         self.last_autotune.pop(host, None)
+        self.metadata_digests.pop(host, None)
+        self.refresh_scheduler.wake(host)
 
     def invalidate_host_daemons(self, host):
         # type: (str) -> None
         self.daemon_refresh_queue.append(host)
         if host in self.last_daemon_update:
             del self.last_daemon_update[host]
+        self.forget_metadata_digest(host, 'ls')
+        self.refresh_scheduler.wake(host)
         self.mgr.event.set()
 
     def invalidate_host_devices(self, host):
@@ -957,6 +1122,8 @@ class HostCache():
         self.device_refresh_queue.append(host)
         if host in self.last_device_update:
             del self.last_device_update[host]
+        self.forget_metadata_digest(host, 'volume')
+        self.refresh_scheduler.wake(host)
         self.mgr.event.set()
 
     def invalidate_host_networks(self, host):
@@ -964,12 +1131,43 @@ class HostCache():
         self.network_refresh_queue.append(host)
         if host in self.last_network_update:
             del self.last_network_update[host]
+        self.forget_metadata_digest(host, 'networks')
+        self.refresh_scheduler.wake(host)
         self.mgr.event.set()
 
     def distribute_new_registry_login_info(self) -> None:
         self.registry_login_queue = set(self.mgr.inventory.keys())
+        for host in self.registry_login_queue:
+            self.refresh_scheduler.wake(host)
 
     def save_host(self, host: str) -> None:
+        self._dirty_hosts.add(host)
+
+    def flush(self) -> None:
+        """
+        Persist the hosts saved since the last flush.
+        """
+        while self._dirty_devices:
+            host = self._dirty_devices.pop()
+            if host in self.devices:
+                self.save_host_devices(host)
+        while self._dirty_hosts:
+            host = self._dirty_hosts.pop()
+            if host in self.mgr.inventory:
+                self._write_host(host)
+
+    @staticmethod
+    def _store_digest(value: str) -> str:
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def _set_store(self, key: str, value: str) -> None:
+        digest = self._store_digest(value)
+        if self._stored_digests.get(key) == digest:
+            return
+        self.mgr.set_store(key, value)
+        self._stored_digests[key] = digest
+
+    def _write_host(self, host: str) -> None:
         j: Dict[str, Any] = {
             'daemons': {},
             'devices': [],
@@ -1013,43 +1211,41 @@ class HostCache():
             j['scheduled_daemon_actions'] = self.scheduled_daemon_actions[host]
         if host in self.metadata_up_to_date:
             j['metadata_up_to_date'] = self.metadata_up_to_date[host]
-        if host in self.devices:
-            self.save_host_devices(host)
 
-        self.mgr.set_store(HOST_CACHE_PREFIX + host, json.dumps(j))
+        self._set_store(HOST_CACHE_PREFIX + host, json.dumps(j))
 
     def save_host_devices(self, host: str) -> None:
         if host not in self.devices or not self.devices[host]:
             logger.debug(f'Host {host} has no devices to save')
             return
 
-        devs: List[Dict[str, Any]] = []
-        for d in self.devices[host]:
-            devs.append(d.to_json())
+        # Every device is serialized once; the entries are put together
+        # from these strings. With json's default ensure_ascii the length
+        # of a string is its length in bytes.
+        devs: List[str] = [json.dumps(d.to_json()) for d in self.devices[host]]
+        devs_len = sum(len(d) for d in devs) + 2 * len(devs)
 
-        def byte_len(s: str) -> int:
-            return len(s.encode('utf-8'))
+        def entry(dev_list: List[str], entries: Optional[int]) -> str:
+            # the same as json.dumps({'devices': [...], 'entries': entries})
+            e = '{"devices": [' + ', '.join(dev_list) + ']'
+            if entries is not None:
+                e += ', "entries": %d' % entries
+            return e + '}'
 
-        dev_cache_counter: int = 0
         cache_size: int = self.mgr.get_foreign_ceph_option('mon', 'mon_config_key_max_entry_size')
-        if cache_size is not None and cache_size != 0 and byte_len(json.dumps(devs)) > cache_size - 1024:
+        if cache_size is not None and cache_size != 0 and devs_len > cache_size - 1024:
             # no guarantee all device entries take up the same amount of space
             # splitting it up so there's one more entry than we need should be fairly
             # safe and save a lot of extra logic checking sizes
-            cache_entries_needed = math.ceil(byte_len(json.dumps(devs)) / cache_size) + 1
+            cache_entries_needed = math.ceil(devs_len / cache_size) + 1
             dev_sublist_size = math.ceil(len(devs) / cache_entries_needed)
-            dev_lists: List[List[Dict[str, Any]]] = [devs[i:i + dev_sublist_size]
-                                                     for i in range(0, len(devs), dev_sublist_size)]
-            for dev_list in dev_lists:
-                dev_dict: Dict[str, Any] = {'devices': dev_list}
-                if dev_cache_counter == 0:
-                    dev_dict.update({'entries': len(dev_lists)})
-                self.mgr.set_store(HOST_CACHE_PREFIX + host + '.devices.'
-                                   + str(dev_cache_counter), json.dumps(dev_dict))
-                dev_cache_counter += 1
+            dev_lists: List[List[str]] = [devs[i:i + dev_sublist_size]
+                                          for i in range(0, len(devs), dev_sublist_size)]
         else:
-            self.mgr.set_store(HOST_CACHE_PREFIX + host + '.devices.'
-                               + str(dev_cache_counter), json.dumps({'devices': devs, 'entries': 1}))
+            dev_lists = [devs]
+        for dev_cache_counter, dev_list in enumerate(dev_lists):
+            self._set_store(HOST_CACHE_PREFIX + host + '.devices.' + str(dev_cache_counter),
+                            entry(dev_list, len(dev_lists) if dev_cache_counter == 0 else None))
 
     def load_host_devices(self, host: str) -> List[inventory.Device]:
         dev_cache_counter: int = 0
@@ -1080,8 +1276,7 @@ class HostCache():
 
     def rm_host(self, host):
         # type: (str) -> None
-        if host in self.daemons:
-            del self.daemons[host]
+        self._set_host_daemons(host, None)
         if host in self.devices:
             del self.devices[host]
         if host in self.facts:
@@ -1114,6 +1309,11 @@ class HostCache():
             del self.scheduled_daemon_actions[host]
         if host in self.last_client_files:
             del self.last_client_files[host]
+        self.metadata_digests.pop(host, None)
+        self.refresh_scheduler.remove(host)
+        self._dirty_hosts.discard(host)
+        self._dirty_devices.discard(host)
+        self._stored_digests.pop(HOST_CACHE_PREFIX + host, None)
         self.mgr.set_store(HOST_CACHE_PREFIX + host, None)
 
     def get_hosts(self):
@@ -1245,9 +1445,12 @@ class HostCache():
 
     def get_daemon(self, daemon_name: str, host: Optional[str] = None) -> orchestrator.DaemonDescription:
         assert not daemon_name.startswith('ha-rgw.')
-        dds = self.get_daemons_by_host(host) if host else self._get_daemons()
-        for dd in dds:
-            if dd.name() == daemon_name:
+        if host:
+            dd = self.daemons.get(host, {}).get(daemon_name)
+            if dd is not None:
+                return dd
+        else:
+            for dd in self._lookup_daemons('by_name', daemon_name):
                 return dd
 
         raise orchestrator.OrchestratorError(f'Unable to find {daemon_name} daemon(s)')
@@ -1280,18 +1483,18 @@ class HostCache():
         assert not service_name.startswith('keepalived.')
         assert not service_name.startswith('haproxy.')
 
-        return list(dd for dd in self._get_daemons() if dd.service_name() == service_name)
+        return self._lookup_daemons('by_service', service_name)
 
     def get_related_service_daemons(self, service_spec: ServiceSpec) -> Optional[List[orchestrator.DaemonDescription]]:
         if service_spec.service_type == 'ingress':
-            dds = list(dd for dd in self._get_daemons() if dd.service_name() == cast(IngressSpec, service_spec).backend_service)
+            dds = self._lookup_daemons('by_service', cast(IngressSpec, service_spec).backend_service)
             dds += list(dd for dd in self._get_tmp_daemons() if dd.service_name() == cast(IngressSpec, service_spec).backend_service)
             logger.debug(f'Found related daemons {dds} for service {service_spec.service_name()}')
             return dds
         else:
             for ingress_spec in [cast(IngressSpec, s) for s in self.mgr.spec_store.active_specs.values() if s.service_type == 'ingress']:
                 if ingress_spec.backend_service == service_spec.service_name():
-                    dds = list(dd for dd in self._get_daemons() if dd.service_name() == ingress_spec.service_name())
+                    dds = self._lookup_daemons('by_service', ingress_spec.service_name())
                     dds += list(dd for dd in self._get_tmp_daemons() if dd.service_name() == ingress_spec.service_name())
                     logger.debug(f'Found related daemons {dds} for service {service_spec.service_name()}')
                     return dds
@@ -1300,9 +1503,10 @@ class HostCache():
     def get_daemons_by_type(self, service_type: str, host: str = '') -> List[orchestrator.DaemonDescription]:
         assert service_type not in ['keepalived', 'haproxy']
 
-        daemons = self.daemons[host].values() if host else self._get_daemons()
-
-        return [d for d in daemons if d.daemon_type in service_to_daemon_types(service_type)]
+        if host:
+            return [d for d in self.daemons[host].values()
+                    if d.daemon_type in service_to_daemon_types(service_type)]
+        return self._lookup_daemons('by_type', *service_to_daemon_types(service_type))
 
     def get_daemon_types(self, hostname: str) -> Set[str]:
         """Provide a list of the types of daemons on the host"""
@@ -1433,6 +1637,42 @@ class HostCache():
         #  to be updated periodically.
         return False
 
+    def host_refresh_queued(self, host: str) -> bool:
+        """
+        Whether anything was queued for ``host`` outside of its refresh
+        intervals, e.g. by adding items to the refresh queues directly.
+        """
+        return (
+            host in self.daemon_refresh_queue
+            or host in self.device_refresh_queue
+            or host in self.network_refresh_queue
+            or host in self.osdspec_previews_refresh_queue
+            or host in self.registry_login_queue
+            or not self.host_metadata_up_to_date(host)
+        )
+
+    def next_refresh_due(self, host: str) -> Tuple[datetime.datetime, int]:
+        """
+        When the first of the cached items of ``host`` goes stale, and the
+        refresh interval of that item.
+        """
+        now = datetime_now()
+        timestamps = [
+            (self.last_host_check, self.mgr.host_check_interval),
+            (self.last_daemon_update, self.mgr.daemon_cache_timeout),
+            (self.last_facts_update, self.mgr.facts_cache_timeout),
+            (self.last_device_update, self.mgr.device_cache_timeout),
+            (self.last_network_update, self.mgr.device_cache_timeout),
+        ]
+        if not self.mgr.inventory.has_label(host, SpecialHostLabels.NO_MEMORY_AUTOTUNE):
+            timestamps.append((self.last_autotune, self.mgr.autotune_interval))
+        due = []
+        for last, interval in timestamps:
+            if host not in last:
+                return now, 0
+            due.append((last[host] + datetime.timedelta(seconds=interval), interval))
+        return min(due)
+
     def host_needs_check(self, host):
         # type: (str) -> bool
         cutoff = datetime_now() - datetime.timedelta(
@@ -1478,14 +1718,22 @@ class HostCache():
     def add_daemon(self, host, dd):
         # type: (str, orchestrator.DaemonDescription) -> None
         assert host in self.daemons
-        self.daemons[host][dd.name()] = dd
+        name = dd.name()
+        with self._daemon_index_lock:
+            if self._daemon_index is not None:
+                self._daemon_index.set_daemon(host, name, self._daemons[host].get(name), dd)
+            self._daemons[host][name] = dd
+        self.forget_metadata_digest(host, 'ls')
 
     def rm_daemon(self, host: str, name: str) -> None:
         assert not name.startswith('ha-rgw.')
 
-        if host in self.daemons:
-            if name in self.daemons[host]:
-                del self.daemons[host][name]
+        with self._daemon_index_lock:
+            if host in self._daemons and name in self._daemons[host]:
+                if self._daemon_index is not None:
+                    self._daemon_index.set_daemon(host, name, self._daemons[host][name], None)
+                del self._daemons[host][name]
+        self.forget_metadata_digest(host, 'ls')
 
     def daemon_cache_filled(self) -> bool:
         """
@@ -1751,6 +1999,8 @@ class AgentCache():
         self.agent_keys = {}  # type: Dict[str, str]
         self.agent_ports = {}  # type: Dict[str, int]
         self.sending_agent_message = {}  # type: Dict[str, bool]
+        # agents to persist with the next flush()
+        self._dirty_agents: Set[str] = set()
 
     def load(self):
         # type: () -> None
@@ -1781,6 +2031,18 @@ class AgentCache():
                 pass
 
     def save_agent(self, host: str) -> None:
+        self._dirty_agents.add(host)
+
+    def flush(self) -> None:
+        """
+        Persist the agents saved since the last flush.
+        """
+        while self._dirty_agents:
+            host = self._dirty_agents.pop()
+            if host in self.mgr.inventory:
+                self._write_agent(host)
+
+    def _write_agent(self, host: str) -> None:
         j: Dict[str, Any] = {}
         if host in self.agent_config_deps:
             j['agent_config_deps'] = {
@@ -1172,6 +1172,7 @@ class CephadmOrchestrator(orchestrator.Orchestrator, MgrModule,
         ret = {
             "workers": worker_count,
             "paused": self.paused,
+            "refresh_scheduler": self.cache.refresh_scheduler.metrics(),
         }
 
         return True, err, ret
@@ -2315,6 +2316,8 @@ Then run the following:
         tgt_host['status'] = ""
         self.inventory._inventory[hostname] = tgt_host
         self.inventory.save()
+        # the host was parked by the refresh scheduler while in maintenance
+        self.cache.refresh_scheduler.wake(hostname)
 
         self._set_maintenance_healthcheck()
 
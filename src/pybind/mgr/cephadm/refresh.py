@@ -0,0 +1,169 @@
+import datetime
+import heapq
+import logging
+import threading
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from ceph.utils import datetime_now
+
+logger = logging.getLogger(__name__)
+
+# hosts are refreshed up to this fraction of the refresh interval late,
+# so that hosts added at the same time don't stay in lockstep
+JITTER_FRACTION = 0.1
+
+
+def host_jitter(host: str, interval: float) -> float:
+    """
+    A per-host delay in [0, JITTER_FRACTION * interval) seconds. It is
+    derived from the host name, so a host keeps its offset across passes
+    and mgr failovers.
+
+    >>> host_jitter('host1', 0)
+    0.0
+    >>> host_jitter('host1', 600) == host_jitter('host1', 600) < 60
+    True
+    """
+    return (zlib.crc32(host.encode('utf-8')) % 1000) / 1000 * JITTER_FRACTION * interval
+
+
+class HostRefreshScheduler:
+    """
+    Decides which hosts the serve loop refreshes.
+
+    Every host has a due time, the earliest time at which any of its
+    cached metadata goes stale. The serve loop only looks at the hosts
+    that are due, instead of checking every host on every pass. Hosts
+    that are woken up, e.g. because their daemons were invalidated, are
+    due immediately.
+
+    The due times are kept in a heap of (due, host). Rescheduling a host
+    leaves its old entry in the heap; entries that don't match ``_due``
+    are skipped when popped.
+
+    Hosts that can't be refreshed, e.g. because they are offline or in
+    maintenance, are parked instead: they are due again after a while,
+    but don't count for next_due(), so that they don't keep the serve
+    loop from sleeping.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[datetime.datetime, str]] = []
+        self._due: Dict[str, datetime.datetime] = {}
+        self._parked: Dict[str, datetime.datetime] = {}
+        self._woken: Set[str] = set()
+
+        # outcome of the last refresh of a host, reported until the
+        # host is refreshed again
+        self.host_check_failures: Dict[str, List[str]] = {}
+        self.refresh_failures: Dict[str, List[str]] = {}
+
+        self.passes = 0
+        self.last_pass_hosts = 0
+        self.last_pass_max_lag = 0.0
+        self.last_pass_avg_lag = 0.0
+
+    def schedule(self, host: str, due: datetime.datetime, interval: float = 0) -> None:
+        """
+        Make ``host`` due at ``due``, delayed by its jitter for ``interval``.
+        """
+        due += datetime.timedelta(seconds=host_jitter(host, interval))
+        with self._lock:
+            self._parked.pop(host, None)
+            self._due[host] = due
+            heapq.heappush(self._heap, (due, host))
+
+    def park(self, host: str, until: datetime.datetime) -> None:
+        """
+        Make ``host`` due at ``until`` without counting for next_due().
+        """
+        with self._lock:
+            self._due.pop(host, None)
+            self._parked[host] = until
+
+    def wake(self, host: str) -> None:
+        with self._lock:
+            self._woken.add(host)
+
+    def remove(self, host: str) -> None:
+        with self._lock:
+            self._due.pop(host, None)
+            self._parked.pop(host, None)
+            self._woken.discard(host)
+        self.host_check_failures.pop(host, None)
+        self.refresh_failures.pop(host, None)
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        with self._lock:
+            if self._woken:
+                return datetime_now()
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self,
+                hosts: Iterable[str],
+                now: Optional[datetime.datetime] = None) -> List[str]:
+        """
+        Take the hosts out of ``hosts`` that are due at ``now``: the ones
+        that were woken up, never scheduled, or whose due or parked time
+        has passed. They stay unscheduled until the caller schedules or
+        parks them again.
+
+        Hosts that are no longer in ``hosts`` are forgotten.
+        """
+        if now is None:
+            now = datetime_now()
+        hosts = set(hosts)
+        due: Set[str] = set()
+        lags: List[float] = []
+        with self._lock:
+            for host in set(self._due) - hosts:
+                del self._due[host]
+            for host in set(self._parked) - hosts:
+                del self._parked[host]
+            due |= self._woken & hosts
+            self._woken.clear()
+            due |= hosts - set(self._due) - set(self._parked)
+            for host, until in list(self._parked.items()):
+                if until <= now:
+                    due.add(host)
+            while self._heap and self._heap[0][0] <= now:
+                when, host = heapq.heappop(self._heap)
+                if self._due.get(host) != when:
+                    continue
+                del self._due[host]
+                due.add(host)
+                lags.append((now - when).total_seconds())
+            for host in due:
+                self._due.pop(host, None)
+                self._parked.pop(host, None)
+
+        self.passes += 1
+        self.last_pass_hosts = len(due)
+        self.last_pass_max_lag = max(lags, default=0.0)
+        self.last_pass_avg_lag = sum(lags) / len(lags) if lags else 0.0
+        for host in set(self.host_check_failures) - hosts:
+            del self.host_check_failures[host]
+        for host in set(self.refresh_failures) - hosts:
+            del self.refresh_failures[host]
+        return sorted(due)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        The scheduler lag is how late the hosts refreshed in the last pass
+        were, compared to their due time.
+        """
+        next_due = self.next_due()
+        return {
+            'scheduled_hosts': len(self._due),
+            'parked_hosts': len(self._parked),
+            'passes': self.passes,
+            'last_pass_hosts': self.last_pass_hosts,
+            'last_pass_max_lag': round(self.last_pass_max_lag, 3),
+            'last_pass_avg_lag': round(self.last_pass_avg_lag, 3),
+            'next_due_in': round(max(0.0, (next_due - datetime_now()).total_seconds()), 3)
+            if next_due else None,
+        }
@@ -1,5 +1,6 @@
 import ipaddress
 import hashlib
+import datetime
 import json
 import logging
 import uuid
@@ -76,6 +77,9 @@ class CephadmServe:
             self.log.debug("serve loop start")
 
             try:
+                # persist what the previous pass changed, also if it
+                # was cut short
+                self._flush_stores()
 
                 self.convert_tags_to_repo_digest()
 
@@ -132,6 +136,7 @@ class CephadmServe:
             self.log.debug("serve loop sleep")
             self._serve_sleep()
             self.log.debug("serve loop wake")
+        self._flush_stores()
         self.log.debug("serve exit")
 
     def _check_certificates(self) -> None:
@@ -179,10 +184,22 @@ class CephadmServe:
                 self.mgr.device_cache_timeout,
             )
         )
+        # wake up when the next host is due
+        next_due = self.mgr.cache.refresh_scheduler.next_due()
+        if next_due is not None:
+            sleep_interval = min(
+                sleep_interval,
+                max(30, int((next_due - datetime_now()).total_seconds()) + 1)
+            )
+        self._flush_stores()
         self.log.debug('Sleeping for %d seconds', sleep_interval)
         self.mgr.event.wait(sleep_interval)
         self.mgr.event.clear()
 
+    def _flush_stores(self) -> None:
+        self.mgr.cache.flush()
+        self.mgr.agent_cache.flush()
+
     def _update_paused_health(self) -> None:
         self.log.debug('_update_paused_health')
         if self.mgr.paused:
@@ -248,85 +265,50 @@ class CephadmServe:
 
     def _refresh_hosts_and_daemons(self) -> None:
         self.log.debug('_refresh_hosts_and_daemons')
-        bad_hosts = []
-        failures = []
+        scheduler = self.mgr.cache.refresh_scheduler
+        hosts = self.mgr.cache.get_hosts()
         agents_down: List[str] = []
 
-        @forall_hosts
-        def refresh(host: str) -> None:
+        def in_maintenance(host: str) -> bool:
+            # hosts in maintenance could be powered off
+            return self.mgr.inventory._inventory[host].get("status", "").lower() == "maintenance"
 
-            # skip hosts that are in maintenance - they could be powered off
-            if self.mgr.inventory._inventory[host].get("status", "").lower() == "maintenance":
-                return
-
-            if self.mgr.use_agent:
-                if self.mgr.agent_helpers._check_agent(host):
+        if self.mgr.use_agent:
+            # every agent is checked, so that the health check covers all of them
+            @forall_hosts
+            def check_agent(host: str) -> None:
+                if not in_maintenance(host) and self.mgr.agent_helpers._check_agent(host):
                     agents_down.append(host)
 
-            if self.mgr.cache.host_needs_check(host):
-                r = self._check_host(host)
-                if r is not None:
-                    bad_hosts.append(r)
-
-            if (
-                not self.mgr.use_agent
-                or self.mgr.cache.is_host_draining(host)
-                or host in agents_down
-            ):
-                if self.mgr.cache.host_needs_daemon_refresh(host):
-                    self.log.debug('refreshing %s daemons' % host)
-                    r = self._refresh_host_daemons(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_facts_refresh(host):
-                    self.log.debug(('Refreshing %s facts' % host))
-                    r = self._refresh_facts(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_network_refresh(host):
-                    self.log.debug(('Refreshing %s networks' % host))
-                    r = self._refresh_host_networks(host)
-                    if r:
-                        failures.append(r)
-
-                if self.mgr.cache.host_needs_device_refresh(host):
-                    self.log.debug('refreshing %s devices' % host)
-                    r = self._refresh_host_devices(host)
-                    if r:
-                        failures.append(r)
-                self.mgr.cache.metadata_up_to_date[host] = True
-            elif not self.mgr.cache.get_daemons_by_type('agent', host=host):
-                if self.mgr.cache.host_needs_daemon_refresh(host):
-                    self.log.debug('refreshing %s daemons' % host)
-                    r = self._refresh_host_daemons(host)
-                    if r:
-                        failures.append(r)
-                self.mgr.cache.metadata_up_to_date[host] = True
-
-            if self.mgr.cache.host_needs_registry_login(host) and self.mgr.get_store('registry_credentials'):
-                self.log.debug(f"Logging `{host}` into custom registry")
-                with self.mgr.async_timeout_handler(host, 'cephadm registry-login'):
-                    r = self.mgr.wait_async(self._registry_login(
-                        host, json.loads(str(self.mgr.get_store('registry_credentials')))))
-                if r:
-                    bad_hosts.append(r)
+            check_agent(hosts)
 
-            if self.mgr.cache.host_needs_osdspec_preview_refresh(host):
-                self.log.debug(f"refreshing OSDSpec previews for {host}")
-                r = self._refresh_host_osdspec_previews(host)
-                if r:
-                    failures.append(r)
+        due = set(scheduler.pop_due(hosts))
+        due.update(h for h in hosts if self.mgr.cache.host_refresh_queued(h))
+        due.update(agents_down)
 
-            if (
-                    self.mgr.cache.host_needs_autotune_memory(host)
-                    and not self.mgr.inventory.has_label(host, SpecialHostLabels.NO_MEMORY_AUTOTUNE)
-            ):
-                self.log.debug(f"autotuning memory for {host}")
-                self._autotune_host_memory(host)
+        @forall_hosts
+        def refresh(host: str) -> None:
+            bad_hosts: List[str] = []
+            failures: List[str] = []
+            try:
+                if not in_maintenance(host):
+                    self._refresh_host(host, host in agents_down, bad_hosts, failures)
+            finally:
+                now = datetime_now()
+                due, interval = self.mgr.cache.next_refresh_due(host)
+                if in_maintenance(host) or host in self.mgr.offline_hosts or due <= now:
+                    # skipped, unreachable or failed to refresh: look at it
+                    # again with the next host check
+                    scheduler.park(host, now + datetime.timedelta(
+                        seconds=self.mgr.host_check_interval))
+                else:
+                    scheduler.schedule(host, due, interval)
+            scheduler.host_check_failures[host] = bad_hosts
+            scheduler.refresh_failures[host] = failures
 
-        refresh(self.mgr.cache.get_hosts())
+        refresh(sorted(due))
+        self.log.debug('refreshed %d of %d hosts, scheduler: %s',
+                       len(due), len(hosts), scheduler.metrics())
 
         self._write_all_client_files()
 
@@ -342,6 +324,10 @@ class CephadmServe:
                 'CEPHADM_REFRESH_FAILED',
         ]:
             self.mgr.remove_health_warning(k)
+        bad_hosts = [r for h in sorted(scheduler.host_check_failures)
+                     for r in scheduler.host_check_failures[h]]
+        failures = [r for h in sorted(scheduler.refresh_failures)
+                    for r in scheduler.refresh_failures[h]]
         if bad_hosts:
             self.mgr.set_health_warning(
                 'CEPHADM_HOST_CHECK_FAILED', f'{len(bad_hosts)} hosts fail cephadm check', len(bad_hosts), bad_hosts)
@@ -350,6 +336,71 @@ class CephadmServe:
                 'CEPHADM_REFRESH_FAILED', 'failed to probe daemons or devices', len(failures), failures)
         self.mgr.update_failed_daemon_health_check()
 
+    def _refresh_host(self, host: str, agent_down: bool,
+                      bad_hosts: List[str], failures: List[str]) -> None:
+        if self.mgr.cache.host_needs_check(host):
+            r = self._check_host(host)
+            if r is not None:
+                bad_hosts.append(r)
+
+        if (
+            not self.mgr.use_agent
+            or self.mgr.cache.is_host_draining(host)
+            or agent_down
+        ):
+            if self.mgr.cache.host_needs_daemon_refresh(host):
+                self.log.debug('refreshing %s daemons' % host)
+                r = self._refresh_host_daemons(host)
+                if r:
+                    failures.append(r)
+
+            if self.mgr.cache.host_needs_facts_refresh(host):
+                self.log.debug(('Refreshing %s facts' % host))
+                r = self._refresh_facts(host)
+                if r:
+                    failures.append(r)
+
+            if self.mgr.cache.host_needs_network_refresh(host):
+                self.log.debug(('Refreshing %s networks' % host))
+                r = self._refresh_host_networks(host)
+                if r:
+                    failures.append(r)
+
+            if self.mgr.cache.host_needs_device_refresh(host):
+                self.log.debug('refreshing %s devices' % host)
+                r = self._refresh_host_devices(host)
+                if r:
+                    failures.append(r)
+            self.mgr.cache.metadata_up_to_date[host] = True
+        elif not self.mgr.cache.get_daemons_by_type('agent', host=host):
+            if self.mgr.cache.host_needs_daemon_refresh(host):
+                self.log.debug('refreshing %s daemons' % host)
+                r = self._refresh_host_daemons(host)
+                if r:
+                    failures.append(r)
+            self.mgr.cache.metadata_up_to_date[host] = True
+
+        if self.mgr.cache.host_needs_registry_login(host) and self.mgr.get_store('registry_credentials'):
+            self.log.debug(f"Logging `{host}` into custom registry")
+            with self.mgr.async_timeout_handler(host, 'cephadm registry-login'):
+                r = self.mgr.wait_async(self._registry_login(
+                    host, json.loads(str(self.mgr.get_store('registry_credentials')))))
+            if r:
+                bad_hosts.append(r)
+
+        if self.mgr.cache.host_needs_osdspec_preview_refresh(host):
+            self.log.debug(f"refreshing OSDSpec previews for {host}")
+            r = self._refresh_host_osdspec_previews(host)
+            if r:
+                failures.append(r)
+
+        if (
+                self.mgr.cache.host_needs_autotune_memory(host)
+                and not self.mgr.inventory.has_label(host, SpecialHostLabels.NO_MEMORY_AUTOTUNE)
+        ):
+            self.log.debug(f"autotuning memory for {host}")
+            self._autotune_host_memory(host)
+
     def _check_host(self, host: str) -> Optional[str]:
         if host not in self.mgr.inventory:
             return None
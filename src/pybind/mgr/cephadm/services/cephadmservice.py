@@ -880,6 +880,11 @@ class MgrService(CephService):
                                            'INFO', 'Failing over to other MGR')
                 logger.info('Failing over to other MGR')
 
+                # the host and agent caches are written at the serve loop
+                # boundaries, persist what this pass changed so far
+                self.mgr.cache.flush()
+                self.mgr.agent_cache.flush()
+
                 # fail over
                 ret, out, err = self.mgr.check_mon_command({
                     'prefix': 'mgr fail',
@@ -16,6 +16,7 @@ from cephadm.inventory import (
     CERT_STORE_CERT_PREFIX,
     CERT_STORE_KEY_PREFIX,
 )
+from cephadm.agent import HostData
 from cephadm.services.osd import OSD, OSDRemovalQueue, OsdIdClaims
 from cephadm.utils import SpecialHostLabels
 
@@ -1692,6 +1693,76 @@ class TestCephadm(object):
             ]
             _set_store.assert_has_calls(expected_calls)
 
+    @mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+    def test_host_cache_flush(self, cephadm_module: CephadmOrchestrator):
+        with with_host(cephadm_module, 'test'):
+            cache = cephadm_module.cache
+            cache.flush()
+            with mock.patch.object(cephadm_module, 'set_store') as _set_store:
+                cache.save_host('test')
+                cache.save_host('test')
+                _set_store.assert_not_called()
+                # nothing changed since the last write
+                cache.flush()
+                _set_store.assert_not_called()
+
+                cache.update_last_host_check('test')
+                cache.save_host('test')
+                cache.save_host('test')
+                cache.flush()
+                _set_store.assert_called_once()
+                assert _set_store.call_args[0][0] == 'host.test'
+
+    @mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+    def test_host_cache_flushed_before_mgr_fail(self, cephadm_module: CephadmOrchestrator):
+        with with_host(cephadm_module, 'test'):
+            cache = cephadm_module.cache
+            cache.flush()
+            cache.update_last_host_check('test')
+            cache.save_host('test')
+            mgr_service = cephadm_module.cephadm_services['mgr']
+            with mock.patch.object(cephadm_module, 'set_store') as _set_store, \
+                    mock.patch.object(mgr_service, 'mgr_map_has_standby', return_value=True), \
+                    mock.patch.object(cephadm_module, 'check_mon_command') as _mon_command:
+
+                def mgr_fail(cmd):
+                    # the cache is written before the mgr fails over
+                    _set_store.assert_called_once()
+                    return 0, '', ''
+                _mon_command.side_effect = mgr_fail
+                mgr_service.fail_over()
+                assert _mon_command.call_args[0][0]['prefix'] == 'mgr fail'
+                assert _set_store.call_args[0][0] == 'host.test'
+
+    def test_daemon_index(self, cephadm_module: CephadmOrchestrator):
+        cache = cephadm_module.cache
+
+        def dd(daemon_type, daemon_id, host):
+            return DaemonDescription(daemon_type=daemon_type, daemon_id=daemon_id, hostname=host)
+
+        cache.update_host_daemons('host1', {'mon.a': dd('mon', 'a', 'host1'),
+                                            'crash.host1': dd('crash', 'host1', 'host1')})
+        cache.update_host_daemons('host2', {'mon.b': dd('mon', 'b', 'host2')})
+        assert [d.name() for d in cache.get_daemons_by_service('mon')] == ['mon.a', 'mon.b']
+
+        cache.add_daemon('host1', dd('mon', 'c', 'host1'))
+        cache.add_daemon('host2', dd('crash', 'host2', 'host2'))
+        assert [d.name() for d in cache.get_daemons_by_type('mon')] == ['mon.a', 'mon.c', 'mon.b']
+        assert [d.name() for d in cache.get_daemons_by_service('crash')] == ['crash.host1', 'crash.host2']
+        assert cache.get_daemon('mon.c').hostname == 'host1'
+
+        cache.rm_daemon('host1', 'mon.a')
+        assert not cache.has_daemon('mon.a')
+        # replacing the daemons of a host keeps its position
+        cache.update_host_daemons('host1', {'mon.d': dd('mon', 'd', 'host1')})
+        assert [d.name() for d in cache.get_daemons_by_service('mon')] == ['mon.d', 'mon.b']
+        assert [d.name() for d in cache.get_daemons_by_service('crash')] == ['crash.host2']
+
+        cache.rm_host('host2')
+        assert [d.name() for d in cache.get_daemons_by_service('mon')] == ['mon.d']
+        cache.daemons = {}
+        assert cache.get_daemons_by_service('mon') == []
+
     @mock.patch("cephadm.module.CephadmOrchestrator.get_store")
     def test_load_devices(self, _get_store, cephadm_module: CephadmOrchestrator):
         def _fake_store(key):
@@ -2122,6 +2193,26 @@ class TestCephadm(object):
             assert_rm_daemon(cephadm_module, spec.service_name(), 'host1')  # verifies ok-to-stop
             assert_rm_daemon(cephadm_module, spec.service_name(), 'host2')
 
+    @mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+    def test_offline_and_maintenance_hosts_are_parked(self, cephadm_module):
+        with with_host(cephadm_module, 'test1'):
+            with with_host(cephadm_module, 'test2'):
+                with with_host(cephadm_module, 'test3'):
+                    scheduler = cephadm_module.cache.refresh_scheduler
+                    cephadm_module.offline_hosts = {'test2'}
+                    cephadm_module.inventory._inventory['test3']['status'] = 'maintenance'
+                    scheduler.wake('test2')
+                    scheduler.wake('test3')
+                    CephadmServe(cephadm_module)._refresh_hosts_and_daemons()
+
+                    # they are looked at again with the next host check, but
+                    # don't make the serve loop wake up early
+                    assert sorted(scheduler._parked) == ['test2', 'test3']
+                    next_due = scheduler.next_due()
+                    assert next_due is None or next_due > datetime_now()
+
+                    cephadm_module.offline_hosts = set()
+
     @mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('{}'))
     def test_dont_touch_offline_or_maintenance_host_daemons(self, cephadm_module):
         # test daemons on offline/maint hosts not removed when applying specs
@@ -2293,6 +2384,7 @@ class TestCephadm(object):
                                                     '/var/lib/ceph/fsid/config/ceph.conf',
                                                     b'[mon]\nk=v\n', 0o644, 0, 0, None)])
             # reload
+            cephadm_module.cache.flush()
             cephadm_module.cache.last_client_files = {}
             cephadm_module.cache.load()
 
@@ -3007,3 +3099,40 @@ Traceback (most recent call last):
             assert osd.cpu_percentage == '6.54%'
             assert osd.memory_usage == 73410805
             assert osd.created == str_to_datetime('2023-09-22T22:41:03.615080Z')
+
+    @mock.patch("cephadm.serve.CephadmServe._run_cephadm", _run_cephadm('[]'))
+    @mock.patch("cephadm.module.CephadmOrchestrator._process_ls_output")
+    def test_agent_metadata_digests(self, _process_ls_output, cephadm_module):
+        with with_host(cephadm_module, 'test'):
+            cache = cephadm_module.cache
+            cephadm_module.agent_cache.agent_counter['test'] = 1
+            _process_ls_output.reset_mock()
+            host_data = mock.MagicMock(mgr=cephadm_module)
+            report = {
+                'host': 'test',
+                'port': '7777',
+                'ack': '1',
+                'digests': {'ls': 'ls-digest', 'networks': 'networks-digest'},
+            }
+            HostData.handle_metadata(host_data, dict(
+                report,
+                ls=[{'name': 'mon.test'}],
+                networks={'1.2.3.0/24': {'eth0': ['1.2.3.4']}}))
+            assert _process_ls_output.call_count == 1
+            assert cache.metadata_digests['test'] == report['digests']
+
+            # unchanged sections are left out of the report
+            cache.metadata_up_to_date['test'] = False
+            HostData.handle_metadata(host_data, report)
+            assert _process_ls_output.call_count == 1
+            assert cache.networks['test'] == {'1.2.3.0/24': {'eth0': ['1.2.3.4']}}
+            assert cache.metadata_up_to_date['test']
+
+            # the daemons changed on our side, so the agent has to send them again
+            cache.invalidate_host_daemons('test')
+            assert cache.metadata_digests['test'] == {'networks': 'networks-digest'}
+            cephadm_module.agent_helpers._request_agent_acks.reset_mock()
+            cache.metadata_up_to_date['test'] = False
+            HostData.handle_metadata(host_data, report)
+            cephadm_module.agent_helpers._request_agent_acks.assert_called_once_with({'test'})
+            assert not cache.metadata_up_to_date['test']
@@ -0,0 +1,93 @@
+import datetime
+
+from cephadm.refresh import HostRefreshScheduler, host_jitter
+
+NOW = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def at(seconds):
+    return NOW + datetime.timedelta(seconds=seconds)
+
+
+def test_new_hosts_are_due():
+    s = HostRefreshScheduler()
+    assert s.pop_due(['host1', 'host2'], NOW) == ['host1', 'host2']
+    # popped hosts stay due until they are scheduled again
+    assert s.pop_due(['host1', 'host2'], NOW) == ['host1', 'host2']
+
+
+def test_due_order_and_lag():
+    s = HostRefreshScheduler()
+    hosts = ['host1', 'host2', 'host3']
+    s.schedule('host1', at(10))
+    s.schedule('host2', at(20))
+    s.schedule('host3', at(30))
+    assert s.next_due() == at(10)
+    assert s.pop_due(hosts, at(5)) == []
+    assert s.pop_due(hosts, at(25)) == ['host1', 'host2']
+    assert s.last_pass_hosts == 2
+    assert s.last_pass_max_lag == 15
+    assert s.last_pass_avg_lag == 10
+    assert s.next_due() == at(30)
+
+
+def test_reschedule_replaces_due_time():
+    s = HostRefreshScheduler()
+    s.schedule('host1', at(10))
+    s.schedule('host1', at(100))
+    assert s.pop_due(['host1'], at(50)) == []
+    assert s.next_due() == at(100)
+    assert s.pop_due(['host1'], at(100)) == ['host1']
+
+
+def test_wake():
+    s = HostRefreshScheduler()
+    s.schedule('host1', at(100))
+    s.schedule('host2', at(100))
+    s.wake('host2')
+    assert s.next_due() <= datetime.datetime.now(datetime.timezone.utc)
+    assert s.pop_due(['host1', 'host2'], NOW) == ['host2']
+    assert s.next_due() == at(100)
+
+
+def test_removed_hosts_are_forgotten():
+    s = HostRefreshScheduler()
+    s.schedule('host1', at(10))
+    s.schedule('host2', at(10))
+    s.refresh_failures['host2'] = ['failed']
+    assert s.pop_due(['host1'], NOW) == []
+    assert s.refresh_failures == {}
+    assert s.metrics()['scheduled_hosts'] == 1
+    s.remove('host1')
+    assert s.next_due() is None
+
+
+def test_jitter():
+    s = HostRefreshScheduler()
+    hosts = ['host%d' % i for i in range(100)]
+    for host in hosts:
+        s.schedule(host, NOW, 600)
+    jitters = [host_jitter(host, 600) for host in hosts]
+    assert all(0 <= j < 60 for j in jitters)
+    assert len(set(jitters)) > 50
+    assert s.pop_due(hosts, at(60)) == sorted(hosts)
+
+
+def test_parked_hosts_do_not_count_for_next_due():
+    s = HostRefreshScheduler()
+    s.schedule('host1', at(100))
+    s.park('host2', at(50))
+    assert s.next_due() == at(100)
+    assert s.metrics()['parked_hosts'] == 1
+    # parked hosts are not due before their time, not even as unscheduled hosts
+    assert s.pop_due(['host1', 'host2'], at(10)) == []
+    assert s.pop_due(['host1', 'host2'], at(60)) == ['host2']
+    s.park('host2', at(200))
+    s.wake('host2')
+    assert s.pop_due(['host1', 'host2'], at(60)) == ['host2']
+    # scheduling a parked host unparks it
+    s.park('host2', at(200))
+    s.schedule('host2', at(150))
+    assert s.next_due() == at(100)
+    assert s.pop_due(['host1', 'host2'], at(160)) == ['host1', 'host2']
+    assert s.metrics()['parked_hosts'] == 0
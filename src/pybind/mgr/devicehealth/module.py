@@ -14,6 +14,9 @@ from typing import cast, Any, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKI
 
 TIME_FORMAT = '%Y%m%d-%H%M%S'
 
+# smart commands scrape_all() keeps in flight at once
+MAX_CONCURRENT_SCRAPES = 16
+
 DEVICE_HEALTH = 'DEVICE_HEALTH'
 DEVICE_HEALTH_IN_USE = 'DEVICE_HEALTH_IN_USE'
 DEVICE_HEALTH_TOOMANY = 'DEVICE_HEALTH_TOOMANY'
@@ -435,8 +438,14 @@ class Module(MgrModule):
         monmap = self.get("mon_map")
         for mon in monmap['mons']:
             ids.append(('mon', mon['name']))
-        for daemon_type, daemon_id in ids:
-            raw_smart_data = self.do_scrape_daemon(daemon_type, daemon_id)
+        # scrape the daemons concurrently, but handle the results in order
+        # so that the first daemon reporting a device wins
+        with self.command_pipeline(max_in_flight=MAX_CONCURRENT_SCRAPES) as pipeline:
+            futures = [pipeline.submit(daemon_type, daemon_id, self._smart_command())
+                       for daemon_type, daemon_id in ids]
+        for (daemon_type, daemon_id), future in zip(ids, futures):
+            r, outb, outs = future.result()
+            raw_smart_data = self._parse_smart_data(daemon_type, daemon_id, outb)
             if not raw_smart_data:
                 continue
             for device, raw_data in raw_smart_data.items():
@@ -478,13 +487,22 @@ class Module(MgrModule):
         """
         self.log.debug('do_scrape_daemon %s.%s' % (daemon_type, daemon_id))
         result = CommandResult('')
-        self.send_command(result, daemon_type, daemon_id, json.dumps({
+        self.send_command(result, daemon_type, daemon_id,
+                          json.dumps(self._smart_command(devid)), '')
+        r, outb, outs = result.wait()
+        return self._parse_smart_data(daemon_type, daemon_id, outb)
+
+    def _smart_command(self, devid: str = '') -> Dict[str, str]:
+        return {
             'prefix': 'smart',
             'format': 'json',
             'devid': devid,
-        }), '')
-        r, outb, outs = result.wait()
+        }
 
+    def _parse_smart_data(self,
+                          daemon_type: str,
+                          daemon_id: str,
+                          outb: str) -> Optional[Dict[str, Any]]:
         try:
             return json.loads(outb)
         except (IndexError, ValueError):
@@ -47,6 +47,7 @@ class Module(MgrModule):
             runtime=True),
     ]
     NOTIFY_TYPES = [NotifyType.osd_map]
+    NOTIFY_BATCH_INTERVAL = 1.0
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super(Module, self).__init__(*args, **kwargs)
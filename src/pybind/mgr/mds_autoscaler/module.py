@@ -17,6 +17,7 @@ class MDSAutoscaler(orchestrator.OrchestratorClientMixin, MgrModule):
     MDS autoscaler.
     """
     NOTIFY_TYPES = [NotifyType.fs_map]
+    NOTIFY_BATCH_INTERVAL = 1.0
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         MgrModule.__init__(self, *args, **kwargs)
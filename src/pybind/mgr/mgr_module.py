@@ -3,6 +3,8 @@ import ceph_module  # noqa
 from typing import (
     Any,
     Callable,
+    ContextManager,
+    Deque,
     Dict,
     Generic,
     Iterator,
@@ -14,6 +16,7 @@ from typing import (
     Set,
     TYPE_CHECKING,
     Tuple,
+    TypeVar,
     Union,
     cast,
 )
@@ -31,7 +34,8 @@ import functools
 import json
 import subprocess
 import threading
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Future
 from contextlib import contextmanager
 from enum import IntEnum, Enum
 import os
@@ -41,8 +45,9 @@ import socket
 import sqlite3
 import sys
 import time
+from collections import OrderedDict
 from ceph_argparse import CephArgtype
-from mgr_util import profile_method
+from mgr_util import profile_method, ModuleProfiler, StackSampler
 
 if sys.version_info >= (3, 8):
     from typing import get_args, get_origin
@@ -57,6 +62,8 @@ else:
         return getattr(tp, '__origin__', None)
 
 
+T = TypeVar('T')
+
 ERROR_MSG_EMPTY_INPUT_FILE = 'Empty input file'
 ERROR_MSG_NO_INPUT_FILE = 'Input file not specified'
 # Full list of strings in "osd_types.cc:pg_state_string()"
@@ -183,6 +190,57 @@ class HandleCommandResult(NamedTuple):
     stderr: str = ""            # Typically used for error messages.
 
 
+# the map (see MAP_EPOCH_NAMES) whose epoch changes whenever the data of
+# get(data_name, shared=True) does
+SHARED_MAP_EPOCHS = {
+    'osd_map': 'osd_map',
+    'pg_dump': 'pg_map',
+    'pg_stats': 'pg_map',
+    'pool_stats': 'pg_map',
+    'osd_stats': 'pg_map',
+}
+
+
+class DecodedMapCache(object):
+    """
+    The cluster maps returned by ``get(..., shared=True)``, along with the
+    epoch of the map they were fetched at (see SHARED_MAP_EPOCHS). A map is
+    built from the mgr's copy once per epoch instead of on every call.
+
+    The cached values are shared by all callers and must not be modified.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[int, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data_name: str, epoch: int, fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(data_name)
+            if entry is not None and entry[0] == epoch:
+                self.hits += 1
+                return entry[1]
+        value = fetch()
+        with self._lock:
+            self.misses += 1
+            self._entries[data_name] = (epoch, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def dump(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': {name: epoch for name, (epoch, _) in self._entries.items()},
+            }
+
+
 class MonCommandFailed(RuntimeError):
     pass
 
@@ -191,6 +249,188 @@ class MgrDBNotReady(RuntimeError):
     pass
 
 
+class CommandTimedOut(TimeoutError):
+    pass
+
+
+class _PipelinedCommand(CommandResult):
+    def __init__(self,
+                 pipeline: 'CommandPipeline',
+                 svc_type: str,
+                 svc_id: str,
+                 cmd_dict: Dict[str, Any],
+                 inbuf: Optional[str],
+                 timeout: Optional[float],
+                 one_shot: bool) -> None:
+        super(_PipelinedCommand, self).__init__()
+        self.pipeline = pipeline
+        self.svc_type = svc_type
+        self.svc_id = svc_id
+        self.cmd_dict = cmd_dict
+        self.inbuf = inbuf
+        self.timeout = timeout
+        self.one_shot = one_shot
+        self.deadline: Optional[float] = None
+        self.future: 'Future[HandleCommandResult]' = Future()
+
+    def complete(self, r: int, outb: str, outs: str) -> None:
+        super(_PipelinedCommand, self).complete(r, outb, outs)
+        self.pipeline._completed(self)
+
+    def __str__(self) -> str:
+        return '{}.{}: {}'.format(self.svc_type, self.svc_id, self.cmd_dict['prefix'])
+
+
+class CommandPipeline(object):
+    """
+    Keeps up to ``max_in_flight`` commands in flight on behalf of a module,
+    created by ``MgrModule.command_pipeline()``. Every submitted command
+    returns a ``concurrent.futures.Future`` of its ``HandleCommandResult``;
+    wrap it with ``asyncio.wrap_future()`` to await it in asyncio code::
+
+        with self.command_pipeline(max_in_flight=32, timeout=10) as pipeline:
+            futures = [pipeline.submit('osd', str(i), {'prefix': 'smart'})
+                       for i in osd_ids]
+        for f in futures:
+            r, outb, outs = f.result()
+
+    Commands still queued can be cancelled with ``Future.cancel()`` or
+    ``cancel()``. A command that has not completed ``timeout`` seconds after
+    it was sent fails with ``CommandTimedOut`` and frees its slot, its late
+    result is discarded.
+    """
+
+    def __init__(self,
+                 module: 'MgrModule',
+                 max_in_flight: int = 16,
+                 timeout: Optional[float] = None) -> None:
+        assert max_in_flight > 0
+        self.module = module
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue: Deque[_PipelinedCommand] = deque()
+        self._in_flight: Set[_PipelinedCommand] = set()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='mgr-command-pipeline',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self,
+               svc_type: str,
+               svc_id: str,
+               cmd_dict: Dict[str, Any],
+               inbuf: Optional[str] = None,
+               *,
+               timeout: Optional[float] = None,
+               one_shot: bool = False) -> 'Future[HandleCommandResult]':
+        """
+        Queue a command for ``svc_type.svc_id`` (``'mon', ''`` for the
+        monitors), see ``MgrModule.send_command``.
+        """
+        cmd = _PipelinedCommand(self, svc_type, svc_id, cmd_dict, inbuf,
+                                timeout if timeout is not None else self.timeout,
+                                one_shot)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('command pipeline is closed')
+            self._queue.append(cmd)
+            self._cond.notify()
+        return cmd.future
+
+    def mon_command(self,
+                    cmd_dict: Dict[str, Any],
+                    inbuf: Optional[str] = None,
+                    *,
+                    timeout: Optional[float] = None) -> 'Future[HandleCommandResult]':
+        return self.submit('mon', '', cmd_dict, inbuf, timeout=timeout)
+
+    def cancel(self) -> int:
+        """
+        Cancel the commands that were not sent yet, return how many.
+        """
+        with self._cond:
+            queued, self._queue = self._queue, deque()
+        return sum(cmd.future.cancel() for cmd in queued)
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Accept no more commands. The queued ones are still sent, unless
+        cancelled. With ``wait``, block until all commands finished.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if wait:
+            self._thread.join()
+
+    def __enter__(self) -> 'CommandPipeline':
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, tb: Any) -> None:
+        if exc_type is not None:
+            self.cancel()
+        self.close()
+
+    def _completed(self, cmd: _PipelinedCommand) -> None:
+        with self._cond:
+            if cmd not in self._in_flight:
+                # timed out already
+                return
+            self._in_flight.remove(cmd)
+            self._cond.notify()
+        cmd.future.set_result(HandleCommandResult(cmd.r, cmd.outb, cmd.outs))
+
+    def _next(self) -> Optional[Tuple[List[_PipelinedCommand], List[_PipelinedCommand]]]:
+        """
+        Wait for commands to send or to time out, return None once closed
+        and drained.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                expired = [cmd for cmd in self._in_flight
+                           if cmd.deadline is not None and cmd.deadline <= now]
+                self._in_flight.difference_update(expired)
+                to_send = []
+                while self._queue and len(self._in_flight) < self.max_in_flight:
+                    cmd = self._queue.popleft()
+                    if not cmd.future.set_running_or_notify_cancel():
+                        continue
+                    if cmd.timeout:
+                        cmd.deadline = now + cmd.timeout
+                    self._in_flight.add(cmd)
+                    to_send.append(cmd)
+                if expired or to_send:
+                    return expired, to_send
+                if self._closed and not self._queue and not self._in_flight:
+                    return None
+                deadlines = [cmd.deadline for cmd in self._in_flight
+                             if cmd.deadline is not None]
+                self._cond.wait(min(deadlines) - now if deadlines else None)
+
+    def _run(self) -> None:
+        while True:
+            ready = self._next()
+            if ready is None:
+                return
+            expired, to_send = ready
+            for cmd in expired:
+                cmd.future.set_exception(CommandTimedOut(
+                    '{} timed out after {}s'.format(cmd, cmd.timeout)))
+            for cmd in to_send:
+                try:
+                    self.module.send_command(cmd, cmd.svc_type, cmd.svc_id,
+                                             json.dumps(cmd.cmd_dict), '', cmd.inbuf,
+                                             one_shot=cmd.one_shot)
+                except Exception as e:
+                    with self._cond:
+                        if cmd not in self._in_flight:
+                            continue
+                        self._in_flight.remove(cmd)
+                    cmd.future.set_exception(e)
+
+
 class MgrDBNotAllowed(MgrDBNotReady):
     """A more specific subclass of MgrDBNotReady raised when mgr_pool option
     disabled.
@@ -257,6 +497,14 @@ class OSDMap(ceph_module.BasePyOSDMap):
     def build_simple(cls, epoch: int = 1, uuid: Optional[str] = None, num_osd: int = -1) -> 'ceph_module.BasePyOSDMap':
         return cls._build_simple(epoch, uuid, num_osd)
 
+    @classmethod
+    def decode(cls, data: bytes) -> 'ceph_module.BasePyOSDMap':
+        """
+        Create an OSDMap from its binary encoding, e.g. the output of
+        ``ceph osd getmap``. Raises ValueError if ``data`` can't be decoded.
+        """
+        return cls._decode(data)
+
     def get_ec_profile(self, name: str) -> Optional[List[Dict[str, str]]]:
         # FIXME: efficient implementation
         d = self._dump()
@@ -287,14 +535,101 @@ class OSDMapIncremental(ceph_module.BasePyOSDMapIncremental):
         """
         return self._set_crush_compat_weight_set_weights(weightmap)
 
+    def merge_upmaps(self, other: 'OSDMapIncremental',
+                     pgids: Optional[List[str]] = None) -> None:
+        """
+        Take over the pg_upmap, pg_upmap_items and pg_upmap_primary
+        changes of ``other``, or only those of the PGs in ``pgids``;
+        its changes win for PGs both touch.
+        """
+        return self._merge_upmaps(other, pgids)
+
+
+class CRUSHTopology(object):
+    """
+    The rules of a CRUSH map, the roots they take and the OSDs under its
+    buckets, indexed from one dump of the map. The OSDs under a bucket are
+    looked up on first use. Device class shadow trees are buckets too: the
+    take step of a rule for a device class names the shadow root.
+
+    The rules are shared by all users of the topology and must not be
+    modified.
+    """
+
+    def __init__(self, dump: Dict[str, Any]) -> None:
+        rules = dump.get('rules', [])
+        self.rules_by_name: Dict[str, Dict[str, Any]] = {r['rule_name']: r for r in rules}
+        self.rules_by_id: Dict[int, Dict[str, Any]] = {r['rule_id']: r for r in rules}
+        self.rule_roots: Dict[str, Optional[int]] = {}
+        for rule in rules:
+            take = next((s for s in rule['steps'] if s.get('op') == 'take'), None)
+            self.rule_roots[rule['rule_name']] = take['item'] if take else None
+        self.buckets: Dict[int, Dict[str, Any]] = {b['id']: b for b in dump.get('buckets', [])}
+        counts: Dict[str, int] = defaultdict(int)
+        for device in dump.get('devices', []):
+            counts[device.get('class', None)] += 1
+        self.device_class_counts = dict(counts)
+        self._osds_under: Dict[int, Tuple[int, ...]] = {}
+
+    def osds_under(self, bucket_id: int) -> Tuple[int, ...]:
+        """
+        The OSDs under a bucket, in the order of a depth first walk.
+        Raises KeyError if there is no such bucket.
+        """
+        osds = self._osds_under.get(bucket_id)
+        if osds is None:
+            found: List[int] = []
+            for item in self.buckets[bucket_id]['items']:
+                if item['id'] >= 0:
+                    found.append(item['id'])
+                elif item['id'] in self.buckets:
+                    found.extend(self.osds_under(item['id']))
+            osds = tuple(found)
+            self._osds_under[bucket_id] = osds
+        return osds
+
 
 class CRUSHMap(ceph_module.BasePyCRUSH):
     ITEM_NONE = 0x7fffffff
     DEFAULT_CHOOSE_ARGS = '-1'
 
+    # the topologies of the latest CRUSH maps by their checksums, shared by
+    # all instances. The crush_version doesn't identify a map: maps
+    # derived from the same OSDMap, like the plans of the balancer, may
+    # have the same version but different contents.
+    MAX_TOPOLOGIES = 8
+    _topologies: 'OrderedDict[int, CRUSHTopology]' = OrderedDict()
+    _topologies_lock = threading.Lock()
+
     def dump(self) -> Dict[str, Any]:
         return self._dump()
 
+    def get_checksum(self) -> int:
+        return self._get_checksum()
+
+    def topology(self) -> CRUSHTopology:
+        """
+        The topology index of this map. It is built from a dump() once per
+        map content, and then shared by all CRUSHMap objects of that content.
+        """
+        topology: Optional[CRUSHTopology] = self.__dict__.get('_topology')
+        if topology is not None:
+            return topology
+        key = self.get_checksum()
+        cls = CRUSHMap
+        with cls._topologies_lock:
+            topology = cls._topologies.get(key)
+            if topology is not None:
+                cls._topologies.move_to_end(key)
+        if topology is None:
+            topology = CRUSHTopology(self.dump())
+            with cls._topologies_lock:
+                cls._topologies[key] = topology
+                while len(cls._topologies) > cls.MAX_TOPOLOGIES:
+                    cls._topologies.popitem(last=False)
+        self._topology = topology
+        return topology
+
     def get_item_weight(self, item: int) -> Optional[int]:
         return self._get_item_weight(item)
 
@@ -322,64 +657,27 @@ class CRUSHMap(ceph_module.BasePyCRUSH):
         return choose_args.get(CRUSHMap.DEFAULT_CHOOSE_ARGS, [])
 
     def get_rule(self, rule_name: str) -> Optional[Dict[str, Any]]:
-        # TODO efficient implementation
-        for rule in self.dump()['rules']:
-            if rule_name == rule['rule_name']:
-                return rule
-
-        return None
+        return self.topology().rules_by_name.get(rule_name)
 
     def get_rule_by_id(self, rule_id: int) -> Optional[Dict[str, Any]]:
-        for rule in self.dump()['rules']:
-            if rule['rule_id'] == rule_id:
-                return rule
-
-        return None
+        return self.topology().rules_by_id.get(rule_id)
 
     def get_rule_root(self, rule_name: str) -> Optional[int]:
-        rule = self.get_rule(rule_name)
-        if rule is None:
+        topology = self.topology()
+        if rule_name not in topology.rules_by_name:
             return None
 
-        try:
-            first_take = next(s for s in rule['steps'] if s.get('op') == 'take')
-        except StopIteration:
+        root = topology.rule_roots[rule_name]
+        if root is None:
             logging.warning("CRUSH rule '{0}' has no 'take' step".format(
                 rule_name))
-            return None
-        else:
-            return first_take['item']
+        return root
 
     def get_osds_under(self, root_id: int) -> List[int]:
-        # TODO don't abuse dump like this
-        d = self.dump()
-        buckets = dict([(b['id'], b) for b in d['buckets']])
-
-        osd_list = []
-
-        def accumulate(b: Dict[str, Any]) -> None:
-            for item in b['items']:
-                if item['id'] >= 0:
-                    osd_list.append(item['id'])
-                else:
-                    try:
-                        accumulate(buckets[item['id']])
-                    except KeyError:
-                        pass
-
-        accumulate(buckets[root_id])
-
-        return osd_list
+        return list(self.topology().osds_under(root_id))
 
     def device_class_counts(self) -> Dict[str, int]:
-        result = defaultdict(int)  # type: Dict[str, int]
-        # TODO don't abuse dump like this
-        d = self.dump()
-        for device in d['devices']:
-            cls = device.get('class', None)
-            result[cls] += 1
-
-        return dict(result)
+        return dict(self.topology().device_class_counts)
 
 
 HandlerFuncType = Callable[..., Tuple[int, str, str]]
@@ -608,6 +906,154 @@ def CLIRequiresDB(func: HandlerFuncType) -> HandlerFuncType:
     return check
 
 
+# daemon types get_unlabeled_perf_counters() returns the counters of by default
+PERF_COUNTER_SERVICES = (
+    "mds",
+    "mon",
+    "osd",
+    "rbd-mirror",
+    "cephfs-mirror",
+    "rgw",
+    "tcmu-runner",
+)
+
+# cluster maps whose epoch (version for the pg_map) MgrModule.get('map_epochs')
+# returns
+MAP_EPOCH_NAMES = ('osd_map', 'fs_map', 'mgr_map', 'mon_map', 'pg_map')
+
+
+class EpochMemo(object):
+    """
+    Values computed by methods decorated with MemoizeByEpoch, along with the
+    map epochs they were computed at.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # function -> (args, kwargs) -> (epochs, value), oldest first
+        self._values: Dict[str, 'OrderedDict[Any, Tuple[Tuple[int, ...], Any]]'] = \
+            defaultdict(OrderedDict)
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+
+    def call(self, name: str, key: Any, epochs: Tuple[int, ...], maxsize: int,
+             compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            values = self._values[name]
+            entry = values.get(key)
+            if entry is not None and entry[0] == epochs:
+                self._hits[name] += 1
+                values.move_to_end(key)
+                return entry[1]
+            self._misses[name] += 1
+        value = compute()
+        with self._lock:
+            values[key] = (epochs, value)
+            values.move_to_end(key)
+            while len(values) > maxsize:
+                values.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def dump(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {
+                name: {
+                    'hits': self._hits[name],
+                    'misses': self._misses[name],
+                    'entries': len(self._values.get(name, ())),
+                }
+                for name in sorted(set(self._hits) | set(self._misses))
+            }
+
+
+def MemoizeByEpoch(*maps: str, maxsize: int = 16) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Decorator for MgrModule methods deriving a value from cluster maps. The
+    value is returned from the module's memo until the epoch of one of
+    ``maps`` (see MAP_EPOCH_NAMES) changes. Arguments are part of the key,
+    up to ``maxsize`` argument combinations are kept per method.
+
+    The memoized value is shared by all callers and must not be modified.
+
+    ::
+
+        @MemoizeByEpoch('osd_map')
+        def get_pool_names(self) -> List[str]:
+            return [p['pool_name'] for p in self.get('osd_map')['pools']]
+    """
+    for m in maps:
+        assert m in MAP_EPOCH_NAMES, 'unknown map: {}'.format(m)
+
+    def outer(f: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(f)
+        def wrapper(self: 'MgrModule', *args: Any, **kwargs: Any) -> T:
+            current = self.get_map_epochs()
+            epochs = tuple(current[m] for m in maps)
+            key = (args, tuple(sorted(kwargs.items())))
+            return self._epoch_memo.call(f.__qualname__, key, epochs, maxsize,
+                                         lambda: f(self, *args, **kwargs))
+        return wrapper
+    return outer
+
+
+# notifications that are delivered right away even if a module batches its
+# notifications: their ids are distinct events rather than a cue to re-read
+# some state
+UNBATCHED_NOTIFY_TYPES = (NotifyType.clog, NotifyType.command)
+
+
+class NotifyBatcher(threading.Thread):
+    """
+    Coalesces the notifications of a module with a NOTIFY_BATCH_INTERVAL:
+    the first notification opens a window of ``interval`` seconds, at its end
+    ``flush`` is called once with every notify type and the distinct ids that
+    fired during the window.
+    """
+
+    def __init__(self,
+                 interval: float,
+                 flush: Callable[[Dict[NotifyType, List[str]]], None]) -> None:
+        super(NotifyBatcher, self).__init__(name='mgr-notify-batcher', daemon=True)
+        self.interval = interval
+        self._flush = flush
+        self._cond = threading.Condition()
+        # notify type -> ids, in the order they first fired
+        self._pending: Dict[NotifyType, Dict[str, None]] = OrderedDict()
+        self._stopping = False
+        self.received = 0
+        self.batches = 0
+
+    def add(self, notify_type: NotifyType, notify_id: str) -> None:
+        with self._cond:
+            self.received += 1
+            if not self._pending:
+                self._cond.notify()
+            self._pending.setdefault(notify_type, OrderedDict())[notify_id] = None
+
+    def run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+            # let the window fill up
+            time.sleep(self.interval)
+            with self._cond:
+                pending, self._pending = self._pending, OrderedDict()
+                self.batches += 1
+            self._flush({t: list(ids) for t, ids in pending.items()})
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+
 def _get_localized_key(prefix: str, key: str) -> str:
     return '{}/{}'.format(prefix, key)
 
@@ -1037,6 +1483,10 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
     MODULE_OPTIONS: List[Option] = []
     MODULE_OPTION_DEFAULTS = {}  # type: Dict[str, Any]
 
+    # Seconds to coalesce notifications for, see notify_batch(). 0 delivers
+    # every notification right away.
+    NOTIFY_BATCH_INTERVAL = 0.0
+
     # Database Schema
     SCHEMA = None  # type: Optional[List[str]]
     SCHEMA_VERSIONED = None  # type: Optional[List[List[str]]]
@@ -1105,6 +1555,17 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
         self._perf_schema_cache = None
 
+        # decoded maps for get(..., shared=True)
+        self._map_cache = DecodedMapCache()
+        # values of methods decorated with MemoizeByEpoch
+        self._epoch_memo = EpochMemo()
+
+        # latencies of the calls into this module, see get_profile_stats()
+        self._profiler = ModuleProfiler()
+        self._stack_sampler: Optional[StackSampler] = None
+
+        self._notify_batcher: Optional[NotifyBatcher] = None
+
         # Keep a librados instance for those that need it.
         self._rados: Optional[rados.Rados] = None
 
@@ -1155,14 +1616,14 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
 
     @API.expose
     def pool_exists(self, name: str) -> bool:
-        pools = [p['pool_name'] for p in self.get('osd_map')['pools']]
+        pools = [p['pool_name'] for p in self.get('osd_map', shared=True)['pools']]
         return name in pools
 
     @API.expose
     def have_enough_osds(self) -> bool:
         # wait until we have enough OSDs to allow the pool to be healthy
         ready = 0
-        for osd in self.get("osd_map")["osds"]:
+        for osd in self.get("osd_map", shared=True)["osds"]:
             if osd["up"] and osd["in"]:
                 ready += 1
 
@@ -1406,6 +1867,24 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         """
         return self._ceph_get_context()
 
+    def _dispatch_notify(self, notify_type: NotifyType, notify_id: str) -> None:
+        if self.NOTIFY_BATCH_INTERVAL > 0 and notify_type not in UNBATCHED_NOTIFY_TYPES:
+            if self._notify_batcher is None:
+                self._notify_batcher = NotifyBatcher(self.NOTIFY_BATCH_INTERVAL,
+                                                     self._dispatch_notify_batch)
+                self._notify_batcher.start()
+            self._notify_batcher.add(notify_type, notify_id)
+            return
+        with self._profiler.timed('notify', str(notify_type)):
+            self.notify(notify_type, notify_id)
+
+    def _dispatch_notify_batch(self, notifications: Dict[NotifyType, List[str]]) -> None:
+        with self._profiler.timed('notify', 'batch'):
+            try:
+                self.notify_batch(notifications)
+            except Exception:
+                self.log.exception('notify_batch failed for %s', list(notifications))
+
     def notify(self, notify_type: NotifyType, notify_id: str) -> None:
         """
         Called by the ceph-mgr service to notify the Python plugin
@@ -1423,6 +1902,20 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         """
         pass
 
+    def notify_batch(self, notifications: Dict[NotifyType, List[str]]) -> None:
+        """
+        Called instead of ``notify`` in modules that set
+        ``NOTIFY_BATCH_INTERVAL``, once per interval with every notify type
+        that fired and its distinct ids, in the order they first fired.
+        ``clog`` and ``command`` notifications are never batched.
+
+        The default implementation calls ``notify`` once per type and id, so
+        e.g. a burst of ``osd_map`` notifications results in a single call.
+        """
+        for notify_type, notify_ids in notifications.items():
+            for notify_id in notify_ids:
+                self.notify(notify_type, notify_id)
+
     def _config_notify(self) -> None:
         # check logging options for changes
         mgr_level = cast(str, self.get_ceph_option("debug_mgr"))
@@ -1480,9 +1973,13 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             self._rados.shutdown()
             self._ceph_unregister_client(None, addrs)
             self._rados = None
+        if self._stack_sampler is not None:
+            self._stack_sampler.stop()
+        if self._notify_batcher is not None:
+            self._notify_batcher.stop()
 
     @API.expose
-    def get(self, data_name: str) -> Any:
+    def get(self, data_name: str, shared: bool = False) -> Any:
         """
         Called by the plugin to fetch named cluster-wide objects from ceph-mgr.
 
@@ -1492,17 +1989,106 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                 health, mon_status, devices, device <devid>, pg_stats,
                 pool_stats, pg_ready, osd_ping_times, mgr_map, mgr_ips,
                 modified_config_options, service_map, mds_metadata,
-                have_local_config_map, osd_pool_stats, pg_status.
+                have_local_config_map, osd_pool_stats, pg_status, map_epochs.
+        :param bool shared: Return an object that is shared with other
+                callers of this module and is only fetched again once the
+                epoch of its map changes, for the data names in
+                SHARED_MAP_EPOCHS. The returned object must be treated as
+                read-only.
 
         Note:
             All these structures have their own JSON representations: experiment
             or look at the C++ ``dump()`` methods to learn about them.
         """
-        obj = self._ceph_get(data_name)
-        if isinstance(obj, bytes):
-            obj = json.loads(obj)
+        def fetch() -> Any:
+            obj = self._ceph_get(data_name)
+            if isinstance(obj, bytes):
+                obj = json.loads(obj)
+            return obj
 
-        return obj
+        epoch_name = SHARED_MAP_EPOCHS.get(data_name) if shared else None
+        if epoch_name is None:
+            return fetch()
+        # read before the map: a map newer than its epoch is fetched again
+        # on the next call, rather than an old map kept for a new epoch
+        epoch = self.get_map_epochs()[epoch_name]
+        return self._map_cache.get(data_name, epoch, fetch)
+
+    def get_map_epochs(self) -> Dict[str, int]:
+        """
+        Return the current epochs of the OSDMap, FSMap, MgrMap and MonMap
+        and the version of the PGMap, keyed by the names in MAP_EPOCH_NAMES.
+        Much cheaper than fetching any of the maps.
+        """
+        return self.get('map_epochs')
+
+    def get_enabled_modules(self) -> List[str]:
+        """
+        Return the names of the enabled and the always-on mgr modules.
+        """
+        mgr_map = self.get('mgr_map')
+        names = set(mgr_map['modules'])
+        names.update(mgr_map['always_on_modules'].get(self.release_name, []))
+        return sorted(names)
+
+    def profiled(self, kind: str, name: str) -> ContextManager[None]:
+        """
+        Record the time spent in a ``with`` block in the module's profile,
+        e.g. every iteration of a ``serve()`` loop::
+
+            while self.run:
+                with self.profiled('serve', 'optimize'):
+                    ...
+
+        """
+        return self._profiler.timed(kind, name)
+
+    def get_profile_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Return the latency histograms of the notify handlers, commands and
+        remote() calls of this module, of its ``profiled()`` sections and of
+        its methods decorated with ``profile_method``, keyed by kind and
+        name. Called remotely by ``ceph mgr profile dump``.
+        """
+        return self._profiler.dump()
+
+    def reset_profile_stats(self) -> None:
+        """
+        Clear the latency histograms of this module. Called remotely by
+        ``ceph mgr profile reset``.
+        """
+        self._profiler.reset()
+
+    def start_stack_sampling(self, duration: float, interval: float) -> bool:
+        """
+        Start sampling the stacks of all threads of this module for
+        ``duration`` seconds. Returns False if sampling is already running.
+        """
+        if self._stack_sampler is not None and self._stack_sampler.is_alive():
+            return False
+        self._stack_sampler = StackSampler(duration, interval)
+        self._stack_sampler.start()
+        return True
+
+    def get_stack_samples(self, limit: int = 50) -> Optional[Dict[str, Any]]:
+        """
+        Return the ``limit`` most frequently sampled stacks of the current or
+        last stack sampling, or None if sampling was never started.
+        """
+        if self._stack_sampler is None:
+            return None
+        return self._stack_sampler.dump(limit)
+
+    def get_memo_stats(self) -> Dict[str, Any]:
+        """
+        Return hit, miss and entry counts of the methods memoized with
+        MemoizeByEpoch and of the map cache used by get(shared=True).
+        Called remotely by ``ceph mgr memo dump``.
+        """
+        return {
+            'memoized': self._epoch_memo.dump(),
+            'decoded_maps': self._map_cache.dump(),
+        }
 
     def _stattype_to_str(self, stattype: int) -> str:
 
@@ -1627,6 +2213,22 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         """
         return cast(ServerInfoT, self._ceph_get_server(hostname))
 
+    @API.expose
+    def get_pg_progress(self, since: int = 0) -> Dict[str, Any]:
+        """
+        Called by the plugin to fetch the recovery progress of the PGs that
+        changed after PGMap version ``since``, like ``get("pg_progress")``
+        does for all PGs.
+
+        The result has the PGMap ``version`` to pass as ``since`` next
+        time, the changed ``pgs``, the ``removed`` pgids and ``pg_ready``.
+        If the changes since ``since`` are no longer known, e.g. on the
+        first call, ``full`` is set and ``pgs`` has all PGs.
+
+        :param since: a PGMap version returned by an earlier call, or 0
+        """
+        return self._ceph_get_pg_progress(since)
+
     @API.expose
     def get_perf_schema(self,
                         svc_type: str,
@@ -1747,12 +2349,24 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
             raise MonCommandFailed(f'{cmd_dict["prefix"]} failed: {r.stderr} retval: {r.retval}')
         return r
 
+    def command_pipeline(self,
+                         max_in_flight: int = 16,
+                         timeout: Optional[float] = None) -> CommandPipeline:
+        """
+        Return a ``CommandPipeline`` to run many commands concurrently, at
+        most ``max_in_flight`` at a time, each failing with
+        ``CommandTimedOut`` after ``timeout`` seconds. Close it (or use it as
+        a context manager) when done.
+        """
+        return CommandPipeline(self, max_in_flight, timeout)
+
     def mon_command(self, cmd_dict: dict, inbuf: Optional[str] = None) -> Tuple[int, str, str]:
         """
         Helper for modules that do simple, synchronous mon command
         execution.
 
-        See send_command for general case.
+        See send_command for general case, and command_pipeline to run many
+        commands concurrently.
 
         :return: status int, out std, err str
         """
@@ -1945,10 +2559,11 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
                         inbuf: str,
                         cmd: Dict[str, Any]) -> Union[HandleCommandResult,
                                                       Tuple[int, str, str]]:
-        if cmd['prefix'] not in CLICommand.COMMANDS:
-            return self.handle_command(inbuf, cmd)
+        with self._profiler.timed('command', cmd['prefix']):
+            if cmd['prefix'] not in CLICommand.COMMANDS:
+                return self.handle_command(inbuf, cmd)
 
-        return CLICommand.COMMANDS[cmd['prefix']].call(self, cmd, inbuf)
+            return CLICommand.COMMANDS[cmd['prefix']].call(self, cmd, inbuf)
 
     def handle_command(self,
                        inbuf: str,
@@ -2200,15 +2815,8 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
     def get_unlabeled_perf_counters(
         self,
         prio_limit: int = PRIO_USEFUL,
-        services: Sequence[str] = (
-            "mds",
-            "mon",
-            "osd",
-            "rbd-mirror",
-            "cephfs-mirror",
-            "rgw",
-            "tcmu-runner",
-        ),
+        services: Sequence[str] = PERF_COUNTER_SERVICES,
+        counters: Sequence[str] = (),
     ) -> Dict[str, dict]:
         """
         Return the perf counters currently known to this ceph-mgr
@@ -2220,62 +2828,40 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         info structure, which is the information from
         the schema, plus an additional "value" member with the latest
         value.
-        """
 
-        result = defaultdict(dict)  # type: Dict[str, dict]
+        :param counters: if not empty, only return the counters whose path
+            starts with one of these prefixes (e.g. ``"osd.op_"``).
+        """
+        _, result = self.get_unlabeled_perf_counters_delta(
+            0.0, prio_limit, services, counters)
+        return {daemon: c for daemon, c in result.items() if c}
 
-        for server in self.list_servers():
-            for service in cast(List[ServiceInfoT], server['services']):
-                if service['type'] not in services:
-                    continue
+    @API.expose
+    def get_unlabeled_perf_counters_delta(
+        self,
+        cursor: float = 0.0,
+        prio_limit: int = PRIO_USEFUL,
+        services: Sequence[str] = PERF_COUNTER_SERVICES,
+        counters: Sequence[str] = (),
+    ) -> Tuple[float, Dict[str, dict]]:
+        """
+        Like ``get_unlabeled_perf_counters``, but only return the counters
+        whose value changed since ``cursor``, the cursor returned by the
+        previous call (0 returns all counters)::
 
-                schemas = self.get_perf_schema(service['type'], service['id'])
-                if not schemas:
-                    self.log.warning("No perf counter schema for {0}.{1}".format(
-                        service['type'], service['id']
-                    ))
-                    continue
+            cursor, changed = self.get_unlabeled_perf_counters_delta()
+            ...
+            cursor, changed = self.get_unlabeled_perf_counters_delta(cursor)
 
-                # Value is returned in a potentially-multi-service format,
-                # get just the service we're asking about
-                svc_full_name = "{0}.{1}".format(
-                    service['type'], service['id'])
-                schema = schemas[svc_full_name]
-
-                # Populate latest values
-                for counter_path, counter_schema in schema.items():
-                    # self.log.debug("{0}: {1}".format(
-                    #     counter_path, json.dumps(counter_schema)
-                    # ))
-                    priority = counter_schema['priority']
-                    assert isinstance(priority, int)
-                    if priority < prio_limit:
-                        continue
+        Every daemon of ``services`` is part of the result, with an empty
+        dict if none of its counters changed, so that daemons which are gone
+        can be told apart.
 
-                    tp = counter_schema['type']
-                    assert isinstance(tp, int)
-                    counter_info = dict(counter_schema)
-                    # Also populate count for the long running avgs
-                    if tp & self.PERFCOUNTER_LONGRUNAVG:
-                        v, c = self.get_latest_avg(
-                            service['type'],
-                            service['id'],
-                            counter_path
-                        )
-                        counter_info['value'], counter_info['count'] = v, c
-                        result[svc_full_name][counter_path] = counter_info
-                    else:
-                        counter_info['value'] = self.get_latest(
-                            service['type'],
-                            service['id'],
-                            counter_path
-                        )
-
-                    result[svc_full_name][counter_path] = counter_info
-
-        self.log.debug("returning {0} counter".format(len(result)))
-
-        return result
+        :return: the cursor for the next call and the changed counters
+        """
+        result = self._ceph_get_unlabeled_perf_counters(
+            list(services), list(counters), prio_limit, cursor)
+        return result['cursor'], result['counters']
 
     @API.expose
     def set_uri(self, uri: str) -> None:
@@ -2373,8 +2959,9 @@ class MgrModule(ceph_module.BaseMgrModule, MgrModuleLoggingMixin):
         :raises RuntimeError: **Any** error raised within the method is converted to a RuntimeError
         :raises ImportError: No such module
         """
-        return self._ceph_dispatch_remote(module_name, method_name,
-                                          args, kwargs)
+        with self._profiler.timed('remote', '{}.{}'.format(module_name, method_name)):
+            return self._ceph_dispatch_remote(module_name, method_name,
+                                              args, kwargs)
 
     def add_osd_perf_query(self, query: Dict[str, Any]) -> Optional[int]:
         """
@@ -11,6 +11,7 @@ if 'UNITTEST' in os.environ:
     import tests  # noqa
 
 import bcrypt
+import bisect
 import cephfs
 import contextlib
 import datetime
@@ -20,7 +21,8 @@ import time
 import logging
 import sys
 from ipaddress import ip_address
-from threading import Lock, Condition
+from collections import Counter
+from threading import Lock, Condition, Thread, enumerate as enumerate_threads
 from typing import no_type_check, NewType
 import urllib
 from functools import wraps
@@ -29,7 +31,7 @@ if sys.version_info >= (3, 3):
 else:
     from threading import _Timer as Timer
 
-from typing import Tuple, Any, Callable, Optional, Dict, TYPE_CHECKING, TypeVar, List, Iterable, Generator, Generic, Iterator
+from typing import Tuple, Any, Callable, Optional, Dict, TYPE_CHECKING, TypeVar, List, Iterable, Set, Generator, Generic, Iterator
 
 from ceph.deployment.utils import wrap_ipv6
 
@@ -946,10 +948,164 @@ def to_pretty_timedelta(n: datetime.timedelta) -> str:
     return str(int(n.total_seconds()) // (3600 * 24 * 365)) + 'y'
 
 
+# upper bounds (seconds) of the buckets of a LatencyHistogram
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram(object):
+    """
+    Call latencies in the (cumulative) bucket layout of a Prometheus
+    histogram.
+
+    >>> h = LatencyHistogram()
+    >>> h.observe(0.002)
+    >>> h.observe(2.0)
+    >>> d = h.dump()
+    >>> d['count'], d['buckets']['0.005'], d['buckets']['5.0'], d['buckets']['+Inf']
+    (2, 1, 2, 2)
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def dump(self) -> Dict[str, Any]:
+        buckets = {}
+        total = 0
+        for le, n in zip(LATENCY_BUCKETS, self.buckets):
+            total += n
+            buckets[str(le)] = total
+        buckets['+Inf'] = self.count
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+class ModuleProfiler(object):
+    """
+    Latency histograms of the calls into a mgr module, keyed by the kind of
+    call (serve, notify, command, remote, method) and its name.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+
+    def observe(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def timed(self, kind: str, name: str) -> Iterator[None]:
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(kind, name, time.monotonic() - t)
+
+    def dump(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (kind, name), histogram in sorted(self._histograms.items()):
+                result.setdefault(kind, {})[name] = histogram.dump()
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+class StackSampler(Thread):
+    """
+    Sampling profiler: records the stacks of all other threads of the
+    (sub-)interpreter it runs in every ``interval`` seconds for ``duration``
+    seconds. Unlike cProfile it covers every thread of a module and adds
+    little overhead to the sampled code.
+
+    sys._current_frames() returns the threads of all sub-interpreters of
+    the mgr, so the frames are limited to the threads the ``threading``
+    module of this interpreter knows about.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self, duration: float, interval: float) -> None:
+        super(StackSampler, self).__init__(name='mgr-stack-sampler', daemon=True)
+        self.duration = duration
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self._stopping = False
+        self._lock = Lock()
+
+    @classmethod
+    def collapse(cls, frame: Any) -> str:
+        """
+        Return the stack of ``frame`` in the collapsed format of flame graph
+        tools: ``file:function:line`` entries, outermost first, joined by ';'.
+        """
+        entries = []
+        while frame is not None and len(entries) < cls.MAX_DEPTH:
+            code = frame.f_code
+            entries.append('{}:{}:{}'.format(os.path.basename(code.co_filename),
+                                             code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        return ';'.join(reversed(entries))
+
+    def run(self) -> None:
+        deadline = time.monotonic() + self.duration
+        while not self._stopping and time.monotonic() < deadline:
+            thread_ids = self.thread_ids()
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, frame in frames.items():
+                    if thread_id in thread_ids:
+                        self.stacks[self.collapse(frame)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def thread_ids(self) -> Set[Optional[int]]:
+        """
+        The ids of the threads to sample: those of this interpreter but the
+        sampler's own.
+        """
+        return {t.ident for t in enumerate_threads()} - {self.ident}
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def dump(self, limit: int = 50) -> Dict[str, Any]:
+        with self._lock:
+            samples = self.samples
+            stacks = self.stacks.most_common(limit)
+        return {
+            'running': self.is_alive(),
+            'duration': self.duration,
+            'interval': self.interval,
+            'samples': samples,
+            'stacks': [{'stack': stack, 'count': count} for stack, count in stacks],
+        }
+
+
 def profile_method(skip_attribute: bool = False) -> Callable[[Callable[..., T]], Callable[..., T]]:
     """
     Decorator for methods of the Module class. Logs the name of the given
-    function f with the time it takes to execute it.
+    function f with the time it takes to execute it, and records it in the
+    module's profile (see ``ceph mgr profile dump``).
     """
     def outer(f: Callable[..., T]) -> Callable[..., T]:
         @wraps(f)
@@ -962,6 +1118,9 @@ def profile_method(skip_attribute: bool = False) -> Callable[[Callable[..., T]],
             if not skip_attribute:
                 wrapper._execution_duration = duration  # type: ignore
             self.log.debug('Method {} ran {:.3f} seconds.'.format(f.__name__, duration))
+            profiler = getattr(self, '_profiler', None)
+            if isinstance(profiler, ModuleProfiler):
+                profiler.observe('method', f.__name__, duration)
             return result
         return wrapper
     return outer
@@ -2120,6 +2120,9 @@ Usage:
                 output += f"\nPaused: {'Yes' if result['paused'] else 'No'}"
             if 'workers' in result and detail:
                 output += f"\nHost Parallelism: {result['workers']}"
+            if 'refresh_scheduler' in result and detail:
+                lag = result['refresh_scheduler']['last_pass_max_lag']
+                output += f"\nHost Refresh Lag: {lag}s"
         return HandleCommandResult(stdout=output)
 
     @_cli_write_command('orch tuned-profile apply')
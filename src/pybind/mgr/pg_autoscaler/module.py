@@ -2,13 +2,15 @@
 Automatically scale pg_num based on how much data is stored in each pool.
 """
 
+import datetime
 import json
 import mgr_util
 import threading
-from typing import Any, Dict, List, Optional, Set, Tuple, TYPE_CHECKING, Union
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple, TYPE_CHECKING, Union
 import uuid
 from prettytable import PrettyTable
-from mgr_module import HealthChecksT, CLIReadCommand, CLIWriteCommand, CRUSHMap, MgrModule, Option, OSDMap
+from mgr_module import HealthChecksT, CLIReadCommand, CLIWriteCommand, CRUSHMap, MemoizeByEpoch, MgrModule, Option, OSDMap
 
 """
 Some terminology is made up for the purposes of this module:
@@ -24,6 +26,9 @@ INTERVAL = 5
 
 PG_NUM_MIN = 32  # unless specified on a per-pool basis
 
+# fewer usage samples of a pool don't make a trend
+FORECAST_MIN_SAMPLES = 3
+
 if TYPE_CHECKING:
     import sys
     if sys.version_info >= (3, 8):
@@ -95,6 +100,78 @@ class PgAdjustmentProgress(object):
                       refs=[("pool", self.pool_id)])
 
 
+class PoolUsageHistory:
+    """
+    A time series of the raw bytes used by each pool, sampled at most once
+    per interval, to forecast how the pools grow. It is kept in the mgr DB
+    as compact JSON: a list of [timestamp, bytes_used] pairs per pool.
+    """
+
+    def __init__(self, samples: Optional[Dict[int, List[Tuple[int, int]]]] = None) -> None:
+        self.samples: Dict[int, List[Tuple[int, int]]] = samples or {}
+
+    @classmethod
+    def load(cls, data: Optional[str]) -> 'PoolUsageHistory':
+        if not data:
+            return cls()
+        return cls({int(pool_id): [(t, b) for t, b in samples]
+                    for pool_id, samples in json.loads(data).items()})
+
+    def dump(self) -> str:
+        return json.dumps({str(pool_id): samples
+                           for pool_id, samples in self.samples.items()},
+                          separators=(',', ':'))
+
+    def add(self,
+            now: int,
+            bytes_used: Dict[int, int],
+            interval: int,
+            max_age: int) -> bool:
+        """
+        Add a sample of ``bytes_used`` for the pools whose last sample is
+        older than ``interval``, and forget the pools that are gone and
+        the samples older than ``max_age``. Return whether anything changed.
+        """
+        changed = False
+        for pool_id in list(self.samples):
+            if pool_id not in bytes_used:
+                del self.samples[pool_id]
+                changed = True
+        for pool_id, used in bytes_used.items():
+            samples = self.samples.setdefault(pool_id, [])
+            if samples and now - samples[-1][0] < interval:
+                continue
+            samples.append((now, used))
+            while now - samples[0][0] > max_age:
+                samples.pop(0)
+            changed = True
+        return changed
+
+    def forecast(self, pool_id: int, at: int) -> Optional[float]:
+        """
+        Project the bytes used by the pool at time ``at`` along the least
+        squares line through its samples. None if the pool doesn't grow or
+        there are too few samples to tell.
+
+        >>> h = PoolUsageHistory({1: [(0, 100), (10, 200), (20, 300)]})
+        >>> h.forecast(1, 30)
+        400.0
+        """
+        samples = self.samples.get(pool_id, [])
+        if len(samples) < FORECAST_MIN_SAMPLES:
+            return None
+        n = len(samples)
+        mean_t = sum(t for t, _ in samples) / n
+        mean_b = sum(b for _, b in samples) / n
+        var_t = sum((t - mean_t) ** 2 for t, _ in samples)
+        if var_t == 0:
+            return None
+        slope = sum((t - mean_t) * (b - mean_b) for t, b in samples) / var_t
+        if slope <= 0:
+            return None
+        return mean_b + slope * (at - mean_t)
+
+
 class CrushSubtreeResourceStatus:
     def __init__(self) -> None:
         self.root_ids: List[int] = []
@@ -135,12 +212,50 @@ class PgAutoscaler(MgrModule):
                        '`PG_NUM` before being accepted. Cannot be less than 1.0'),
             default=3.0,
             min=1.0),
+        Option(
+            name='forecast_horizon',
+            type='secs',
+            desc='how far ahead to forecast pool growth',
+            long_desc=('Size pools for the usage projected this far ahead from their '
+                       'recent growth, instead of their current usage only. '
+                       '0 disables forecasting.'),
+            default=0,
+            min=0),
+        Option(
+            name='forecast_sample_interval',
+            type='secs',
+            desc='how often to sample pool usage for forecasting',
+            default=3600,
+            min=60),
+        Option(
+            name='forecast_history',
+            type='secs',
+            desc='how long to keep pool usage samples for forecasting',
+            default=7 * 24 * 3600,
+            min=0),
+        Option(
+            name='growth_begin_time',
+            type='str',
+            default='0000',
+            desc='beginning time of day to grow pools ahead of their usage',
+            long_desc=('This is a time of day in the format HHMM. pg_num changes that '
+                       'only the forecast asks for are made between growth_begin_time '
+                       'and growth_end_time, which should be a time of low client load.'),
+            runtime=True),
+        Option(
+            name='growth_end_time',
+            type='str',
+            default='2359',
+            desc='ending time of day to grow pools ahead of their usage',
+            long_desc='This is a time of day in the format HHMM.',
+            runtime=True),
     ]
 
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super(PgAutoscaler, self).__init__(*args, **kwargs)
         self._shutdown = threading.Event()
         self._event: Dict[int, PgAdjustmentProgress] = {}
+        self._usage_history = PoolUsageHistory()
 
         # So much of what we do peeks at the osdmap that it's easiest
         # to just keep a copy of the pythonized version.
@@ -149,6 +264,11 @@ class PgAutoscaler(MgrModule):
             self.sleep_interval = 60
             self.mon_target_pg_per_osd = 0
             self.threshold = 3.0
+            self.forecast_horizon = 0
+            self.forecast_sample_interval = 3600
+            self.forecast_history = 7 * 24 * 3600
+            self.growth_begin_time = '0000'
+            self.growth_end_time = '2359'
 
     def config_notify(self) -> None:
         for opt in self.NATIVE_OPTIONS:
@@ -170,7 +290,7 @@ class PgAutoscaler(MgrModule):
         """
         osdmap = self.get_osdmap()
         pools = osdmap.get_pools_by_name()
-        ps, root_map = self._get_pool_status(osdmap, pools)
+        ps, root_map = self._get_pool_status(osdmap, pools, self._forecast_usage())
 
         if format in ('json', 'json-pretty'):
             return 0, json.dumps(ps, indent=4, sort_keys=True), ''
@@ -253,19 +373,17 @@ class PgAutoscaler(MgrModule):
             self.remote('progress', 'complete', ev.ev_id)
             del self._event[pool_id]
 
-    def has_noautoscale_flag(self) -> bool:
+    @MemoizeByEpoch('osd_map')
+    def _get_osdmap_flags(self) -> FrozenSet[str]:
+        # every pass checks the flags several times, dump the map once per epoch
         flags = self.get_osdmap().dump().get('flags', '')
-        if 'noautoscale' in flags:
-            return True
-        else:
-            return False
+        return frozenset(flags.split(','))
+
+    def has_noautoscale_flag(self) -> bool:
+        return 'noautoscale' in self._get_osdmap_flags()
 
     def has_norecover_flag(self) -> bool:
-        flags = self.get_osdmap().dump().get('flags', '')
-        if 'norecover' in flags:
-            return True
-        else:
-            return False
+        return 'norecover' in self._get_osdmap_flags()
 
     @CLIWriteCommand("osd pool get noautoscale")
     def get_noautoscale(self) -> Tuple[int, str, str]:
@@ -325,14 +443,66 @@ class PgAutoscaler(MgrModule):
             self.complete_all_progress_events()
             return 0, "", "noautoscale is set, all pools now have autoscale off"
 
+    def _record_usage(self) -> None:
+        """
+        Sample the usage of the pools for forecasting, if it is due.
+        """
+        if not self.forecast_horizon:
+            return
+        now = int(time.time())
+        history = self._usage_history.samples
+        if history and all(now - samples[-1][0] < self.forecast_sample_interval
+                           for samples in history.values()):
+            # no sample is due
+            return
+        bytes_used = {p['id']: p['stats']['bytes_used'] for p in self.get('df')['pools']}
+        if self._usage_history.add(now, bytes_used,
+                                   self.forecast_sample_interval,
+                                   self.forecast_history):
+            self.set_store('usage_history', self._usage_history.dump())
+
+    def _forecast_usage(self) -> Optional[Dict[int, float]]:
+        """
+        The raw bytes each growing pool is projected to use after the
+        forecast horizon, or None if forecasting is off.
+        """
+        if not self.forecast_horizon:
+            return None
+        at = int(time.time()) + self.forecast_horizon
+        forecast = {}
+        for pool_id in self._usage_history.samples:
+            projected = self._usage_history.forecast(pool_id, at)
+            if projected is not None:
+                forecast[pool_id] = projected
+        return forecast
+
+    def _in_growth_window(self) -> bool:
+        time_of_day = time.strftime('%H%M', time.localtime())
+        begin_time = self.growth_begin_time
+        end_time = self.growth_end_time
+        for t, option in ((begin_time, 'growth_begin_time'), (end_time, 'growth_end_time')):
+            try:
+                datetime.time(int(t[:2]), int(t[2:]))
+            except ValueError as err:
+                self.log.error('invalid time for %s - %s', option, err)
+        if begin_time < end_time:
+            return begin_time <= time_of_day < end_time
+        elif begin_time == end_time:
+            return True
+        else:
+            return time_of_day >= begin_time or time_of_day < end_time
+
     def serve(self) -> None:
         self.config_notify()
+        self._usage_history = PoolUsageHistory.load(self.get_store('usage_history'))
         while not self._shutdown.is_set():
             if not self.has_noautoscale_flag() and not self.has_norecover_flag():
-                osdmap = self.get_osdmap()
-                pools = osdmap.get_pools_by_name()
-                self._maybe_adjust(osdmap, pools)
-                self._update_progress_events(osdmap, pools)
+                with self.profiled('serve', 'adjust'):
+                    self._record_usage()
+                    osdmap = self.get_osdmap()
+                    pools = osdmap.get_pools_by_name()
+                    self._maybe_adjust(osdmap, pools)
+                    self._update_progress_events(osdmap, pools)
             self._shutdown.wait(timeout=self.sleep_interval)
 
     def shutdown(self) -> None:
@@ -575,7 +745,11 @@ class PgAutoscaler(MgrModule):
             actual_raw_used = pool_stats[pool_id]['bytes_used']
             actual_capacity_ratio = float(actual_raw_used) / capacity
 
-            pool_raw_used = max(actual_raw_used, target_bytes * raw_used_rate)
+            # and will we be using, if the pool keeps growing like it did?
+            forecast_raw_used = pool_stats[pool_id].get('forecast_raw_used', 0)
+
+            pool_raw_used = max(actual_raw_used, target_bytes * raw_used_rate,
+                                forecast_raw_used)
             capacity_ratio = float(pool_raw_used) / capacity
 
             self.log.info("effective_target_ratio {0} {1} {2} {3}".format(
@@ -624,6 +798,7 @@ class PgAutoscaler(MgrModule):
                 'raw_used_rate': raw_used_rate,
                 'subtree_capacity': capacity,
                 'actual_raw_used': actual_raw_used,
+                'forecast_raw_used': forecast_raw_used,
                 'raw_used': pool_raw_used,
                 'actual_capacity_ratio': actual_capacity_ratio,
                 'capacity_ratio': capacity_ratio,
@@ -642,8 +817,13 @@ class PgAutoscaler(MgrModule):
             self,
             osdmap: OSDMap,
             pools: Dict[str, Dict[str, Any]],
+            forecast: Optional[Dict[int, float]] = None,
     ) -> Tuple[List[Dict[str, Any]],
                Dict[int, CrushSubtreeResourceStatus]]:
+        """
+        ``forecast`` has the raw bytes pools are projected to use, which
+        they are sized for if it's more than they use now.
+        """
         threshold = self.threshold
         assert threshold >= 1.0
 
@@ -651,6 +831,9 @@ class PgAutoscaler(MgrModule):
         root_map, overlapped_roots = self.get_subtree_resource_status(osdmap, pools, crush_map)
         df = self.get('df')
         pool_stats = dict([(p['id'], p['stats']) for p in df['pools']])
+        for pool_id, projected in (forecast or {}).items():
+            if pool_id in pool_stats:
+                pool_stats[pool_id] = dict(pool_stats[pool_id], forecast_raw_used=projected)
 
         ret: List[Dict[str, Any]] = []
 
@@ -708,6 +891,29 @@ class PgAutoscaler(MgrModule):
                 continue
             ev.update(self, (ev.pg_num - pool_data['pg_num']) / (ev.pg_num - ev.pg_num_target))
 
+    def _hold_forecast_changes(
+            self,
+            osdmap: OSDMap,
+            pools: Dict[str, Dict[str, Any]],
+            forecast_ps: List[Dict[str, Any]],
+    ) -> Tuple[List[Dict[str, Any]],
+               Dict[int, CrushSubtreeResourceStatus]]:
+        """
+        Outside of the growth window, size the pools for their current usage
+        only, so that the forecast doesn't make them split at peak load.
+        Pools already grown for the forecast are not shrunk back, though.
+        """
+        ps, root_map = self._get_pool_status(osdmap, pools)
+        forecast_final = {p['pool_id']: p['pg_num_final'] for p in forecast_ps}
+        for p in ps:
+            if p['would_adjust'] and \
+                    p['pg_num_final'] < p['pg_num_target'] <= \
+                    forecast_final.get(p['pool_id'], 0):
+                self.log.debug('holding pool %s at pg_num %d until the growth window',
+                               p['pool_name'], p['pg_num_target'])
+                p['would_adjust'] = False
+        return ps, root_map
+
     def _maybe_adjust(self,
                       osdmap: OSDMap,
                       pools: Dict[str, Dict[str, Any]]) -> None:
@@ -722,7 +928,10 @@ class PgAutoscaler(MgrModule):
         self.log.debug("pool: {0}".format(json.dumps(pools, indent=4,
                                 sort_keys=True)))
 
-        ps, root_map = self._get_pool_status(osdmap, pools)
+        forecast = self._forecast_usage()
+        ps, root_map = self._get_pool_status(osdmap, pools, forecast)
+        if forecast and not self._in_growth_window():
+            ps, root_map = self._hold_forecast_changes(osdmap, pools, ps)
 
         # Anyone in 'warn', set the health message for them and then
         # drop them from consideration.
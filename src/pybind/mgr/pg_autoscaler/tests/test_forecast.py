@@ -0,0 +1,69 @@
+# python unit test
+import json
+from tests import mock
+from pg_autoscaler import module
+
+
+HOUR = 3600
+
+
+def test_add_samples():
+    history = module.PoolUsageHistory()
+    assert history.add(0, {1: 100, 2: 10}, HOUR, 2 * HOUR)
+    # no sample is due yet
+    assert not history.add(HOUR // 2, {1: 150, 2: 10}, HOUR, 2 * HOUR)
+    assert history.add(HOUR, {1: 200, 2: 10}, HOUR, 2 * HOUR)
+    assert history.add(2 * HOUR, {1: 300, 2: 10}, HOUR, 2 * HOUR)
+    # the oldest sample expires, and pool 2 is gone
+    assert history.add(3 * HOUR, {1: 400}, HOUR, 2 * HOUR)
+    assert history.samples == {1: [(HOUR, 200), (2 * HOUR, 300), (3 * HOUR, 400)]}
+
+
+def test_load_dump():
+    history = module.PoolUsageHistory({1: [(0, 100), (HOUR, 200)]})
+    data = history.dump()
+    assert json.loads(data) == {'1': [[0, 100], [HOUR, 200]]}
+    assert module.PoolUsageHistory.load(data).samples == history.samples
+    assert module.PoolUsageHistory.load(None).samples == {}
+
+
+def test_forecast():
+    history = module.PoolUsageHistory({
+        1: [(0, 100), (HOUR, 300), (2 * HOUR, 200), (3 * HOUR, 400)],
+        2: [(0, 300), (HOUR, 200), (2 * HOUR, 100)],
+        3: [(0, 100), (HOUR, 200)],
+    })
+    assert history.forecast(1, 5 * HOUR) == 530.0
+    # shrinking pools and pools with too few samples are not forecast
+    assert history.forecast(2, 5 * HOUR) is None
+    assert history.forecast(3, 5 * HOUR) is None
+
+
+class TestGrowthWindow:
+
+    def setup_method(self):
+        module.PgAutoscaler._ceph_get_option = mock.Mock()
+        module.PgAutoscaler._configure_logging = lambda *args: ...
+        self.autoscaler = module.PgAutoscaler('module_name', 0, 0)
+
+    def test_window(self):
+        self.autoscaler.growth_begin_time = '2200'
+        self.autoscaler.growth_end_time = '0400'
+        with mock.patch('time.strftime', return_value='2300'):
+            assert self.autoscaler._in_growth_window()
+        with mock.patch('time.strftime', return_value='1200'):
+            assert not self.autoscaler._in_growth_window()
+
+    def test_hold_forecast_changes(self):
+        def pool(pool_id, pg_num_target, pg_num_final):
+            return {'pool_id': pool_id, 'pool_name': 'pool%d' % pool_id,
+                    'pg_num_target': pg_num_target, 'pg_num_final': pg_num_final,
+                    'would_adjust': pg_num_target != pg_num_final}
+
+        forecast_ps = [pool(1, 128, 512), pool(2, 128, 128), pool(3, 128, 32)]
+        reactive_ps = [pool(1, 128, 128), pool(2, 128, 32), pool(3, 128, 32)]
+        self.autoscaler._get_pool_status = mock.Mock(return_value=(reactive_ps, {}))
+        ps, _ = self.autoscaler._hold_forecast_changes(None, {}, forecast_ps)
+        # pool 1 isn't grown yet, pool 2 is kept at the size it was grown
+        # to for the forecast, and pool 3 shrinks either way
+        assert [p['would_adjust'] for p in ps] == [False, False, True]
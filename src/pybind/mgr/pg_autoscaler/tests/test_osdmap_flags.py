@@ -0,0 +1,27 @@
+# python unit test
+from tests import mock
+from pg_autoscaler import module
+
+
+class TestOsdmapFlags:
+
+    def setup_method(self):
+        module.PgAutoscaler._ceph_get_option = mock.Mock()
+        module.PgAutoscaler._configure_logging = lambda *args: ...
+        self.autoscaler = module.PgAutoscaler('module_name', 0, 0)
+        self.epochs = {'osd_map': 10, 'fs_map': 1, 'mgr_map': 1, 'mon_map': 1, 'pg_map': 1}
+        self.autoscaler.get_map_epochs = lambda: dict(self.epochs)
+        self.osdmap = mock.Mock()
+        self.osdmap.dump.return_value = {'flags': 'sortbitwise,noautoscale'}
+        self.autoscaler.get_osdmap = mock.Mock(return_value=self.osdmap)
+
+    def test_dumped_once_per_epoch(self):
+        assert self.autoscaler.has_noautoscale_flag()
+        assert not self.autoscaler.has_norecover_flag()
+        assert self.osdmap.dump.call_count == 1
+
+        self.osdmap.dump.return_value = {'flags': 'sortbitwise,norecover'}
+        self.epochs['osd_map'] += 1
+        assert not self.autoscaler.has_noautoscale_flag()
+        assert self.autoscaler.has_norecover_flag()
+        assert self.osdmap.dump.call_count == 2
@@ -1,5 +1,5 @@
 try:
-    from typing import List, Dict, Union, Any, Optional
+    from typing import List, Dict, Union, Any, Optional, Iterable, NamedTuple, Set
     from typing import TYPE_CHECKING
 except ImportError:
     TYPE_CHECKING = False
@@ -16,7 +16,9 @@ import logging
 import json
 
 
-ENCODING_VERSION = 2
+ENCODING_VERSION = 3
+# the completed events were stored as JSON objects before this version
+COMPACT_ENCODING_VERSION = 3
 
 # keep a global reference to the module so we can use it from Event methods
 _module = None  # type: Optional["Module"]
@@ -179,6 +181,24 @@ class GhostEvent(Event):
             d["failure_message"] = self._failure_message
         return d
 
+    def to_compact(self):
+        # type: () -> List[Any]
+        """
+        The persisted form: the fields in a fixed order, with the failure
+        message last if the event failed.
+        """
+        row = [self.id, self.message, self._refs, self.add_to_ceph_s,
+               self.started_at, self.finished_at]  # type: List[Any]
+        if self._failed:
+            row.append(self._failure_message)
+        return row
+
+    @classmethod
+    def from_compact(cls, row):
+        # type: (List[Any]) -> GhostEvent
+        failed = len(row) > 6
+        return cls(*row[:6], failed=failed, failure_message=row[6] if failed else None)
+
 
 class GlobalRecoveryEvent(Event):
     """
@@ -192,28 +212,34 @@ class GlobalRecoveryEvent(Event):
         self._progress = 0.0
         self._start_epoch = start_epoch
         self._active_clean_num = active_clean_num
+        # active+clean PGs that have not been reported since the start
+        self._skipped_pgs = set()  # type: Set[str]
         self._refresh()
 
-    def global_event_update_progress(self, log):
-        # type: (logging.Logger) -> None
-        "Update progress of Global Recovery Event"
-        global _module
-        assert _module
-        skipped_pgs = 0
-        active_clean_pgs = _module.get("active_clean_pgs")
-        total_pg_num = active_clean_pgs["total_num_pgs"]
-        new_active_clean_pgs = active_clean_pgs["pg_stats"]
-        new_active_clean_num = len(new_active_clean_pgs)
-        for pg in new_active_clean_pgs:
+    def global_event_update_progress(self, index, log, changed=None):
+        # type: (PgStateIndex, logging.Logger, Optional[Set[str]]) -> None
+        """
+        Update progress of Global Recovery Event from the PGs in
+        ``changed``, or from all PGs if it is None.
+        """
+        if changed is None:
+            self._skipped_pgs = set()
+            changed = set(index.pgs)
+        for pgid in changed:
             # Disregard PGs that are not being reported
             # if the states are active+clean. Since it is
             # possible that some pgs might not have any movement
             # even before the start of the event.
-            if pg['reported_epoch'] < self._start_epoch:
+            info = index.pgs.get(pgid)
+            if info and info.clean and info.reported_epoch < self._start_epoch:
                 log.debug("Skipping pg {0} since reported_epoch {1} < start_epoch {2}"
-                             .format(pg['pgid'], pg['reported_epoch'], self._start_epoch))
-                skipped_pgs += 1
-                continue
+                          .format(pgid, info.reported_epoch, self._start_epoch))
+                self._skipped_pgs.add(pgid)
+            else:
+                self._skipped_pgs.discard(pgid)
+        total_pg_num = len(index.pgs)
+        new_active_clean_num = index.num_clean
+        skipped_pgs = len(self._skipped_pgs)
 
         if self._active_clean_num != new_active_clean_num:
             # Have this case to know when need to update
@@ -277,6 +303,116 @@ class RemoteEvent(Event):
         return self._failure_message if self._failed else None
 
 
+class PgState(NamedTuple):
+    """
+    What the progress module needs to know about a PG.
+    """
+    clean: bool
+    reported_epoch: int
+    num_bytes: int
+    num_bytes_recovered: int
+
+    @classmethod
+    def from_json(cls, info: Dict[str, Any]) -> 'PgState':
+        states = info['state'].split('+')
+        return cls('active' in states and 'clean' in states,
+                   info['reported_epoch'],
+                   info['num_bytes'],
+                   info['num_bytes_recovered'])
+
+
+class PgStateIndex(object):
+    """
+    The state of all PGs, shared by the events. It is kept up to date with
+    the PGs that changed since the last refresh(), so that events only
+    need to look at those. It also knows which events wait for which PGs,
+    so that the changes can be handed to just those events.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.version = 0
+        self.pgs = {}  # type: Dict[str, PgState]
+        self.num_clean = 0
+        self.pg_ready = False
+        # PGs changed since take_changes(), None if any may have changed
+        self._changed = None  # type: Optional[Set[str]]
+        # ids of the events waiting for a PG
+        self._watchers = {}  # type: Dict[str, Set[str]]
+
+    @classmethod
+    def from_pg_progress(cls, pg_progress):
+        # type: (Dict[str, Any]) -> PgStateIndex
+        """
+        Make an index from the ``pg_progress`` of all PGs.
+        """
+        index = cls()
+        index.apply(dict(pg_progress, full=True, version=0, removed=[]))
+        return index
+
+    def apply(self, delta):
+        # type: (Dict[str, Any]) -> None
+        """
+        Apply the result of MgrModule.get_pg_progress().
+        """
+        pgs = delta['pgs']
+        if delta['full']:
+            self.pgs = {pgid: PgState.from_json(info) for pgid, info in pgs.items()}
+            self.num_clean = sum(1 for state in self.pgs.values() if state.clean)
+            self._changed = None
+        else:
+            for pgid in delta['removed']:
+                state = self.pgs.pop(pgid, None)
+                if state and state.clean:
+                    self.num_clean -= 1
+            for pgid, info in pgs.items():
+                state = PgState.from_json(info)
+                old = self.pgs.get(pgid)
+                self.num_clean += state.clean - bool(old and old.clean)
+                self.pgs[pgid] = state
+            if self._changed is not None:
+                self._changed.update(pgs)
+                self._changed.update(delta['removed'])
+        self.version = delta['version']
+        self.pg_ready = delta['pg_ready']
+
+    def refresh(self, module):
+        # type: (MgrModule) -> None
+        self.apply(module.get_pg_progress(self.version))
+
+    def take_changes(self):
+        # type: () -> Optional[Set[str]]
+        """
+        Return the PGs changed since the last call, or None if any PG may
+        have changed.
+        """
+        changed = self._changed
+        self._changed = set()
+        return changed
+
+    def watch(self, ev_id: str, pgs: Iterable[str]) -> None:
+        for pgid in pgs:
+            self._watchers.setdefault(pgid, set()).add(ev_id)
+
+    def unwatch(self, ev_id: str, pgs: Iterable[str]) -> None:
+        for pgid in pgs:
+            watchers = self._watchers.get(pgid)
+            if watchers is not None:
+                watchers.discard(ev_id)
+                if not watchers:
+                    del self._watchers[pgid]
+
+    def changes_by_event(self, changed: Iterable[str]) -> Dict[str, Set[str]]:
+        """
+        Group the changed PGs by the events waiting for them.
+        """
+        by_event = {}  # type: Dict[str, Set[str]]
+        for pgid in changed:
+            for ev_id in self._watchers.get(pgid, ()):
+                by_event.setdefault(ev_id, set()).add(pgid)
+        return by_event
+
+
 class PgRecoveryEvent(Event):
     """
     An event whose completion is determined by the recovery of a set of
@@ -288,10 +424,12 @@ class PgRecoveryEvent(Event):
     def __init__(self, message, refs, which_pgs, which_osds, start_epoch, add_to_ceph_s):
         # type: (str, List[Any], List[PgId], List[str], int, bool) -> None
         super().__init__(str(uuid.uuid4()), message, refs, add_to_ceph_s)
-        self._pgs = which_pgs
+        # the PGs that are not complete yet, with how far along they are
+        self._pending = {str(pg): 0.0 for pg in which_pgs}  # type: Dict[str, float]
+        self._pending_sum = 0.0
         self._which_osds = which_osds
-        self._original_pg_count = len(self._pgs)
-        self._original_bytes_recovered = None  # type: Optional[Dict[PgId, float]]
+        self._original_pg_count = len(self._pending)
+        self._original_bytes_recovered = None  # type: Optional[Dict[str, float]]
         self._progress = 0.0
 
         self._start_epoch = start_epoch
@@ -301,28 +439,43 @@ class PgRecoveryEvent(Event):
     def which_osds(self):
         return self. _which_osds
 
-    def pg_update(self, pg_progress: Dict, log: Any) -> None:
-        # FIXME: O(pg_num) in python
+    @property
+    def pending_pgs(self):
+        # type: () -> List[str]
+        return list(self._pending)
+
+    def pg_update(self,
+                  pg_progress: Union[Dict[str, Any], PgStateIndex],
+                  log: Any,
+                  changed: Optional[Set[str]] = None) -> None:
+        """
+        Update the progress from the PGs in ``changed``, or from all PGs of
+        the event if it is None. ``pg_progress`` is either the shared
+        PgStateIndex or the ``pg_progress`` of all PGs.
+        """
+        if isinstance(pg_progress, PgStateIndex):
+            index = pg_progress
+        else:
+            index = PgStateIndex.from_pg_progress(pg_progress)
+            changed = None
+        pg_to_state = index.pgs
+
         # Sanity check to see if there are any missing PGs and to assign
         # empty array and dictionary if there hasn't been any recovery
-        pg_to_state: Dict[str, Any] = pg_progress["pgs"]
-        pg_ready: bool = pg_progress["pg_ready"]
-
         if self._original_bytes_recovered is None:
             self._original_bytes_recovered = {}
             missing_pgs = []
-            for pg in self._pgs:
-                pg_str = str(pg)
+            for pg_str in self._pending:
                 if pg_str in pg_to_state:
-                    self._original_bytes_recovered[pg] = \
-                        pg_to_state[pg_str]['num_bytes_recovered']
+                    self._original_bytes_recovered[pg_str] = \
+                        pg_to_state[pg_str].num_bytes_recovered
                 else:
-                    missing_pgs.append(pg)
-            if pg_ready:
-                for pg in missing_pgs:
-                    self._pgs.remove(pg)
-
-        complete_accumulate = 0.0
+                    missing_pgs.append(pg_str)
+            if index.pg_ready:
+                for pg_str in missing_pgs:
+                    del self._pending[pg_str]
+                index.unwatch(self.id, missing_pgs)
+            changed = None
 
         # Calculating progress as the number of PGs recovered divided by the
         # original where partially completed PGs count for something
@@ -332,54 +485,45 @@ class PgRecoveryEvent(Event):
         # few-bytes PGs that still need the housekeeping of their recovery
         # to be done. This is subjective...
 
-        complete = set()
-        for pg in self._pgs:
-            pg_str = str(pg)
-            try:
-                info = pg_to_state[pg_str]
-            except KeyError:
-                # The PG is gone!  Probably a pool was deleted. Drop it.
-                complete.add(pg)
+        if changed is None:
+            pgs = list(self._pending)
+        elif len(changed) < len(self._pending):
+            pgs = [pg_str for pg_str in changed if pg_str in self._pending]
+        else:
+            pgs = [pg_str for pg_str in self._pending if pg_str in changed]
+        for pg_str in pgs:
+            info = pg_to_state.get(pg_str)
+            if info is None or info.clean and info.reported_epoch >= self._start_epoch:
+                # Complete, or gone: probably a pool was deleted. Drop it.
+                self._pending_sum -= self._pending.pop(pg_str)
+                index.unwatch(self.id, [pg_str])
                 continue
             # Only checks the state of each PGs when it's epoch >= the OSDMap's epoch
-            if info['reported_epoch'] < self._start_epoch:
-                continue
-
-            state = info['state']
-
-            states = state.split("+")
-
-            if "active" in states and "clean" in states:
-                complete.add(pg)
+            if info.reported_epoch < self._start_epoch:
+                ratio = 0.0
+            elif info.num_bytes == 0:
+                # Empty PGs are considered 0% done until they are
+                # in the correct state.
+                ratio = 0.0
             else:
-                if info['num_bytes'] == 0:
-                    # Empty PGs are considered 0% done until they are
-                    # in the correct state.
-                    pass
-                else:
-                    recovered = info['num_bytes_recovered']
-                    total_bytes = info['num_bytes']
-                    if total_bytes > 0:
-                        ratio = float(recovered -
-                                      self._original_bytes_recovered[pg]) / \
-                            total_bytes
-                        # Since the recovered bytes (over time) could perhaps
-                        # exceed the contents of the PG (moment in time), we
-                        # must clamp this
-                        ratio = min(ratio, 1.0)
-                        ratio = max(ratio, 0.0)
-
-                    else:
-                        # Dataless PGs (e.g. containing only OMAPs) count
-                        # as half done.
-                        ratio = 0.5
-                    complete_accumulate += ratio
-
-        self._pgs = list(set(self._pgs) ^ complete)
-        completed_pgs = self._original_pg_count - len(self._pgs)
+                recovered = info.num_bytes_recovered
+                ratio = float(recovered -
+                              self._original_bytes_recovered.get(pg_str, recovered)) / \
+                    info.num_bytes
+                # Since the recovered bytes (over time) could perhaps
+                # exceed the contents of the PG (moment in time), we
+                # must clamp this
+                ratio = min(ratio, 1.0)
+                ratio = max(ratio, 0.0)
+            self._pending_sum += ratio - self._pending[pg_str]
+            self._pending[pg_str] = ratio
+        if not self._pending:
+            self._pending_sum = 0.0
+
+        completed_pgs = self._original_pg_count - len(self._pending)
         completed_pgs = max(completed_pgs, 0)
         try:
-            prog = (completed_pgs + complete_accumulate)\
+            prog = (completed_pgs + self._pending_sum)\
                 / self._original_pg_count
         except ZeroDivisionError:
             prog = 0.0
@@ -473,6 +617,9 @@ class Module(MgrModule):
 
         self._latest_osdmap = None  # type: Optional[OSDMap]
 
+        # PG states shared by the PgRecoveryEvents
+        self._pg_index = PgStateIndex()
+
         self._dirty = False
 
         global _module
@@ -566,7 +713,11 @@ class Module(MgrModule):
                     start_epoch=self.get_osdmap().get_epoch(),
                     add_to_ceph_s=False
                     )
-            r_ev.pg_update(self.get("pg_progress"), self.log)
+            # the changes are kept for the other events until the next
+            # _process_pg_summary()
+            self._pg_index.refresh(self)
+            self._pg_index.watch(r_ev.id, r_ev.pending_pgs)
+            r_ev.pg_update(self._pg_index, self.log)
             self._events[r_ev.id] = r_ev
 
     def _osdmap_changed(self, old_osdmap, new_osdmap):
@@ -597,9 +748,8 @@ class Module(MgrModule):
         # This function both constructs and updates
         # the global recovery event if one of the
         # PGs is not at active+clean state
-        active_clean_pgs = self.get("active_clean_pgs")
-        total_pg_num = active_clean_pgs["total_num_pgs"]
-        active_clean_num = len(active_clean_pgs["pg_stats"])
+        total_pg_num = len(self._pg_index.pgs)
+        active_clean_num = self._pg_index.num_clean
         try:
             # There might be a case where there is no pg_num
             progress = float(active_clean_num) / total_pg_num
@@ -614,7 +764,7 @@ class Module(MgrModule):
                     add_to_ceph_s=True,
                     start_epoch=self.get_osdmap().get_epoch(),
                     active_clean_num=active_clean_num)
-            ev.global_event_update_progress(self.log)
+            ev.global_event_update_progress(self._pg_index, self.log)
             self._events[ev.id] = ev
 
     def _process_osdmap(self):
@@ -631,21 +781,34 @@ class Module(MgrModule):
         # if there are no events we will skip this here to avoid
         # expensive get calls
         if len(self._events) == 0:
+            if self._pg_index.pgs:
+                # don't hold on to the states of all PGs between recoveries
+                self._pg_index = PgStateIndex()
             return
 
         global_event = False
-        data = self.get("pg_progress")
+        self._pg_index.refresh(self)
+        changed = self._pg_index.take_changes()
+        # PgRecoveryEvents only get the changes of their own PGs, the
+        # global event gets all of them
+        by_event = None  # type: Optional[Dict[str, Set[str]]]
+        if changed is not None:
+            by_event = self._pg_index.changes_by_event(changed)
         for ev_id in list(self._events):
             try:
                 ev = self._events[ev_id]
                 # Check for types of events
                 # we have to update
                 if isinstance(ev, PgRecoveryEvent):
-                    ev.pg_update(data, self.log)
+                    if by_event is None:
+                        ev.pg_update(self._pg_index, self.log)
+                    elif ev_id in by_event:
+                        ev.pg_update(self._pg_index, self.log, by_event[ev_id])
                     self.maybe_complete(ev)
                 elif isinstance(ev, GlobalRecoveryEvent):
                     global_event = True
-                    ev.global_event_update_progress(self.log)
+                    if changed is None or changed:
+                        ev.global_event_update_progress(self._pg_index, self.log, changed)
                     self.maybe_complete(ev)
             except KeyError:
                 self.log.warning("_process_pg_summary: ev {0} does not exist".format(ev_id))
@@ -667,10 +830,10 @@ class Module(MgrModule):
         ))
         # TODO: bound the number we store.
         encoded = json.dumps({
-            "events": [ev.to_json() for ev in self._completed_events],
+            "events": [ev.to_compact() for ev in self._completed_events],
             "version": ENCODING_VERSION,
-            "compat_version": ENCODING_VERSION
-        })
+            "compat_version": COMPACT_ENCODING_VERSION
+        }, separators=(',', ':'))
         self.set_store("completed", encoded)
 
     def _load(self):
@@ -685,7 +848,13 @@ class Module(MgrModule):
             raise RuntimeError("Cannot decode version {0}".format(
                                decoded['compat_version']))
 
-        if decoded['compat_version'] < ENCODING_VERSION:
+        if decoded['compat_version'] >= COMPACT_ENCODING_VERSION:
+            for row in decoded['events']:
+                self._completed_events.append(GhostEvent.from_compact(row))
+            self._prune_completed_events()
+            return
+
+        if decoded['compat_version'] < 2:
             # we need to add the "started_at" and "finished_at" attributes to the events
             for ev in decoded['events']:
                 ev['started_at'] = None
@@ -693,10 +862,14 @@ class Module(MgrModule):
 
         for ev in decoded['events']:
             self._completed_events.append(GhostEvent(ev['id'], ev['message'],
-                                                     ev['refs'], ev['started_at'],
+                                                     ev['refs'],
+                                                     ev.get('add_to_ceph_s:', False),
+                                                     ev['started_at'],
                                                      ev['finished_at'],
                                                      ev.get('failed', False),
                                                      ev.get('failure_message')))
+        # rewrite them in the compact form
+        self._dirty = True
 
         self._prune_completed_events()
 
@@ -777,6 +950,8 @@ class Module(MgrModule):
                        failed=ev.failed, failure_message=ev.failure_message))
         assert ev.id
         del self._events[ev.id]
+        if isinstance(ev, PgRecoveryEvent):
+            self._pg_index.unwatch(ev.id, ev.pending_pgs)
         self._prune_completed_events()
         self._dirty = True
 
@@ -847,6 +1022,7 @@ class Module(MgrModule):
 
     def clear(self):
         self._events = {}
+        self._pg_index = PgStateIndex()
         self._completed_events = []
         self._dirty = True
         self._save()
@@ -47,6 +47,124 @@ class TestPgRecoveryEvent(object):
         self.test_event.pg_update(pg_progress, mock.Mock())
         assert self.test_event._progress == 1.0
 
+    def test_pg_update_changed(self):
+        # Only the changed PGs are looked at after the first update
+        def pg(state, recovered, epoch=30):
+            return {
+                "state": state,
+                "num_bytes": 10,
+                "num_bytes_recovered": recovered,
+                "reported_epoch": epoch,
+            }
+        index = module.PgStateIndex()
+        index.apply({
+            "version": 1,
+            "full": True,
+            "pgs": {"1.0": pg("active+remapped", 0),
+                    "1.1": pg("active+remapped", 0),
+                    "1.2": pg("active+clean", 0, epoch=20)},
+            "removed": [],
+            "pg_ready": True,
+        })
+        assert index.take_changes() is None
+        self.test_event.pg_update(index, mock.Mock())
+        assert self.test_event._progress == 0.0
+
+        index.apply({
+            "version": 2,
+            "full": False,
+            "pgs": {"1.0": pg("active+clean", 10),
+                    "1.1": pg("active+remapped", 5)},
+            "removed": [],
+            "pg_ready": True,
+        })
+        changed = index.take_changes()
+        assert changed == {"1.0", "1.1"}
+        self.test_event.pg_update(index, mock.Mock(), changed)
+        assert self.test_event._progress == pytest.approx(1.5 / 3)
+
+        # 1.2 was clean before the event started, and is gone now
+        index.apply({
+            "version": 3,
+            "full": False,
+            "pgs": {},
+            "removed": ["1.2"],
+            "pg_ready": True,
+        })
+        self.test_event.pg_update(index, mock.Mock(), index.take_changes())
+        assert self.test_event._progress == pytest.approx(2.5 / 3)
+        assert list(self.test_event._pending) == ["1.1"]
+
+
+def pg_state(state, reported_epoch=30):
+    return {
+        "state": state,
+        "num_bytes": 10,
+        "num_bytes_recovered": 0,
+        "reported_epoch": reported_epoch,
+    }
+
+
+class TestPgStateIndex(object):
+
+    def setup_method(self):
+        module._module = mock.Mock()
+        self.index = module.PgStateIndex()
+        self.index.apply({
+            "version": 1,
+            "full": True,
+            "pgs": {"1.%x" % i: pg_state("active+remapped") for i in range(4)},
+            "removed": [],
+            "pg_ready": True,
+        })
+        self.index.take_changes()
+
+    def update(self, version, pgs, removed=()):
+        self.index.apply({
+            "version": version,
+            "full": False,
+            "pgs": pgs,
+            "removed": list(removed),
+            "pg_ready": True,
+        })
+        return self.index.take_changes()
+
+    def test_changes_by_event(self):
+        # two events share PG 1.1
+        ev_a = module.PgRecoveryEvent(None, None, [module.PgId(1, i) for i in (0, 1)],
+                                      [0], 30, False)
+        ev_b = module.PgRecoveryEvent(None, None, [module.PgId(1, i) for i in (1, 2)],
+                                      [1], 30, False)
+        for ev in (ev_a, ev_b):
+            self.index.watch(ev.id, ev.pending_pgs)
+            ev.pg_update(self.index, mock.Mock())
+
+        changed = self.update(2, {"1.1": pg_state("active+clean"),
+                                  "1.3": pg_state("active+clean")})
+        assert self.index.num_clean == 2
+        by_event = self.index.changes_by_event(changed)
+        assert by_event == {ev_a.id: {"1.1"}, ev_b.id: {"1.1"}}
+        for ev in (ev_a, ev_b):
+            ev.pg_update(self.index, mock.Mock(), by_event[ev.id])
+            assert ev.progress == 0.5
+
+        # the completed PG is no longer watched
+        changed = self.update(3, {"1.1": pg_state("active+remapped")}, removed=["1.2"])
+        assert self.index.num_clean == 1
+        assert self.index.changes_by_event(changed) == {ev_b.id: {"1.2"}}
+
+    def test_global_event(self):
+        ev = module.GlobalRecoveryEvent("Global Recovery Event", [("global", "")], True,
+                                        30, 0)
+        self.update(2, {"1.0": pg_state("active+clean", reported_epoch=20)})
+        ev.global_event_update_progress(self.index, mock.Mock())
+        # 1.0 was not reported since the event started
+        assert ev.progress == pytest.approx(1 / 3)
+        changed = self.update(3, {"1.0": pg_state("active+clean"),
+                                  "1.1": pg_state("active+clean")})
+        ev.global_event_update_progress(self.index, mock.Mock(), changed)
+        assert ev.progress == pytest.approx(2 / 4)
+
 
 class OSDMap: 
     
@@ -99,6 +217,8 @@ class TestModule(object):
         module.Module._configure_logging = lambda *args: ...  # .__init__
         self.test_module = module.Module('module_name', 0, 0)  # so we can see if an event gets created
         self.test_module.get = mock.Mock() # so we can call pg_update
+        self.test_module.get_pg_progress = mock.Mock(return_value={
+            "version": 1, "full": True, "pgs": {}, "removed": [], "pg_ready": True})
         self.test_module._complete = mock.Mock() # we want just to see if this event gets called
         self.test_module.get_osdmap = mock.Mock() # so that self.get_osdmap().get_epoch() works
         module._module = mock.Mock() # so that Event.refresh() works
@@ -172,3 +292,42 @@ class TestModule(object):
         assert self.test_module._complete.call_count == 1
         # check if a PgRecovery Event was created and pg_update gets triggered
         assert module.PgRecoveryEvent.pg_update.call_count == 2
+
+    def test_save_load(self):
+        store = {}
+        self.test_module.set_store = store.__setitem__
+        self.test_module.get_store = store.get
+        self.test_module.max_completed_events = 50
+        self.test_module._completed_events = [
+            module.GhostEvent("a", "done", [["osd", 1]], False, 1.0, 2.0),
+            module.GhostEvent("b", "failed", [], True, 3.0, 4.0,
+                              failed=True, failure_message="oops"),
+        ]
+        self.test_module._save()
+        assert json.loads(store["completed"])["events"][1] == \
+            ["b", "failed", [], True, 3.0, 4.0, "oops"]
+
+        self.test_module._completed_events = []
+        self.test_module._load()
+        assert [ev.to_json() for ev in self.test_module._completed_events] == [
+            {"id": "a", "message": "done", "refs": [["osd", 1]], "started_at": 1.0,
+             "finished_at": 2.0, "add_to_ceph_s:": False},
+            {"id": "b", "message": "failed", "refs": [], "started_at": 3.0,
+             "finished_at": 4.0, "add_to_ceph_s:": True, "failed": True,
+             "failure_message": "oops"},
+        ]
+
+    def test_load_json_events(self):
+        # events stored before the compact encoding
+        store = {"completed": json.dumps({
+            "events": [{"id": "a", "message": "done", "refs": [], "started_at": 1.0,
+                        "finished_at": 2.0, "add_to_ceph_s:": True}],
+            "version": 2,
+            "compat_version": 2,
+        })}
+        self.test_module.get_store = store.get
+        self.test_module.max_completed_events = 50
+        self.test_module._load()
+        ev, = self.test_module._completed_events
+        assert (ev.id, ev.add_to_ceph_s, ev.started_at) == ("a", True, 1.0)
+        assert self.test_module._dirty
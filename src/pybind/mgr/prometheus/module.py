@@ -8,16 +8,25 @@ import re
 import threading
 import time
 import enum
+import concurrent.futures
+from concurrent.futures import Future, ThreadPoolExecutor
 from packaging import version  # type: ignore
 from collections import namedtuple
 import tempfile
+import gzip
+import zlib
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
 
 from mgr_module import CLIReadCommand, MgrModule, MgrStandbyModule, PG_STATES, Option, ServiceInfoT, HandleCommandResult, CLIWriteCommand
 from mgr_util import get_default_addr, profile_method, build_url
 from orchestrator import OrchestratorClientMixin, raise_if_exception, OrchestratorError
 from rbd import RBD
 
-from typing import DefaultDict, Optional, Dict, Any, Set, cast, Tuple, Union, List, Callable, IO
+from typing import DefaultDict, Optional, Dict, Any, Set, cast, Tuple, Union, List, Callable, IO, Iterable
 
 LabelValues = Tuple[str, ...]
 Number = Union[int, float]
@@ -61,6 +70,119 @@ cherrypy.config.update({
 })
 
 
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def parse_accept_header(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parse an Accept or Accept-Encoding header into a mapping of the
+    (lower-cased) media type or coding to its quality value.
+
+    >>> parse_accept_header('gzip;q=0.5, zstd, br;q=0')
+    {'gzip': 0.5, 'zstd': 1.0, 'br': 0.0}
+    >>> parse_accept_header('application/openmetrics-text;version=1.0.0;q=0.9')
+    {'application/openmetrics-text': 0.9}
+    """
+    accepted: Dict[str, float] = {}
+    for item in (header or '').split(','):
+        params = item.strip().split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: Optional[str], compress: bool = True) -> str:
+    """
+    Pick the content coding of the response, preferring zstd over gzip.
+
+    >>> negotiate_encoding('gzip, deflate')
+    'gzip'
+    >>> negotiate_encoding('gzip;q=0, deflate')
+    'identity'
+    >>> negotiate_encoding('gzip', compress=False)
+    'identity'
+    """
+    if not compress:
+        return 'identity'
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in ('zstd', 'gzip'):
+        if encoding == 'zstd' and zstandard is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return 'identity'
+
+
+def negotiate_format(accept: Optional[str], openmetrics: bool = True) -> str:
+    """
+    Pick the exposition format of the response, OpenMetrics is only returned
+    when it is preferred over the text format by the client.
+
+    >>> negotiate_format('application/openmetrics-text;version=1.0.0,text/plain;q=0.5')
+    'openmetrics'
+    >>> negotiate_format('text/plain')
+    'text'
+    """
+    if not openmetrics:
+        return 'text'
+    accepted = parse_accept_header(accept)
+    om = accepted.get('application/openmetrics-text', 0.0)
+    if om > 0 and om >= accepted.get('text/plain', 0.0):
+        return 'openmetrics'
+    return 'text'
+
+
+def to_openmetrics(text: str) -> str:
+    """
+    Convert the Prometheus text exposition format rendered by Metric.str_expfmt()
+    into the OpenMetrics text format.
+
+    OpenMetrics requires counter samples to carry a ``_total`` suffix, which
+    would rename the existing series, so counters and untyped metrics are
+    exposed with the ``unknown`` type.
+
+    >>> print(to_openmetrics('\\n# HELP ceph_x X\\n# TYPE ceph_x untyped\\nceph_x 1.0\\n'))
+    # HELP ceph_x X
+    # TYPE ceph_x unknown
+    ceph_x 1.0
+    # EOF
+    <BLANKLINE>
+    """
+    lines = []
+    for line in text.split('\n'):
+        if not line:
+            continue
+        if line.startswith('# TYPE '):
+            name, _, mtype = line[7:].rpartition(' ')
+            if mtype not in ('gauge', 'summary', 'histogram'):
+                line = '# TYPE {} unknown'.format(name)
+        lines.append(line)
+    lines.append('# EOF\n')
+    return '\n'.join(lines)
+
+
+def encode_metrics(text: str, fmt: str = 'text', encoding: str = 'identity') -> bytes:
+    if fmt == 'openmetrics':
+        text = to_openmetrics(text)
+    data = text.encode('utf-8')
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
 def health_status_to_number(status: str) -> int:
     if status == 'HEALTH_OK':
         return 0
@@ -102,6 +224,12 @@ MGR_MODULE_STATUS = ('name',)
 
 MGR_MODULE_CAN_RUN = ('name',)
 
+MGR_MODULE_CALL = ('name', 'kind', 'call')
+
+# seconds after which all perf counters are fetched again instead of only
+# the ones that changed
+PERF_COUNTER_RESYNC_INTERVAL = 300
+
 OSD_METADATA = ('back_iface', 'ceph_daemon', 'cluster_addr', 'device_class',
                 'front_iface', 'hostname', 'objectstore', 'public_addr',
                 'ceph_version')
@@ -122,6 +250,22 @@ DISK_OCCUPATION = ('ceph_daemon', 'device', 'db_device',
 
 NUM_OBJECTS = ['degraded', 'misplaced', 'unfound']
 
+# Collector methods of Module grouped into stages. Stages are independent of
+# each other and run concurrently on the collection pool, the collectors of
+# a stage run one after another.
+COLLECTOR_STAGES = (
+    ('health', ('get_health', 'get_mgr_status', 'get_all_daemon_health_metrics')),
+    ('capacity', ('get_df', 'get_pool_stats', 'get_osd_stats', 'get_pg_status',
+                  'get_num_objects')),
+    ('pg_dump', ('get_pool_repaired_objects',)),
+    ('blocklist', ('get_osd_blocklisted_entries',)),
+    ('cluster', ('get_fs', 'get_quorum_status')),
+    ('osd_metadata', ('get_metadata_and_osd_status',)),
+    ('perf_counters', ('get_perf_counters',)),
+    ('rbd', ('get_rbd_stats',)),
+    ('mgr_profile', ('get_mgr_profile',)),
+)
+
 alert_metric = namedtuple('alert_metric', 'name description')
 HEALTH_CHECKS = [
     alert_metric('SLOW_OPS', 'OSD or Monitor requests taking a long time to process'),
@@ -318,16 +462,50 @@ class Metric(object):
         self.desc = desc
         self.labelnames = labels  # tuple if present
         self.value: Dict[LabelValues, Number] = {}
+        # (values in order, HELP and TYPE lines, sample line by label
+        # values, exposition block) of the last rendering
+        self._expfmt_cache: Optional[Tuple[Tuple[Tuple[LabelValues, Number], ...],
+                                           str,
+                                           List[Tuple[LabelValues, str]],
+                                           str]] = None
 
     def clear(self) -> None:
         self.value = {}
 
+    def is_render_cached(self) -> bool:
+        """
+        True if str_expfmt() can return the previously rendered block
+        because the values have not changed since.
+        """
+        # compare the items in order, the block lists the samples in the
+        # order they were set
+        return self._expfmt_cache is not None and self._expfmt_cache[0] == tuple(self.value.items())
+
     def set(self, value: Number, labelvalues: Optional[LabelValues] = None) -> None:
         # labelvalues must be a tuple
         labelvalues = labelvalues or ('',)
         self.value[labelvalues] = value
 
     def str_expfmt(self) -> str:
+        return self._render()[3]
+
+    def expfmt_samples(self) -> Tuple[str, List[Tuple[LabelValues, str]]]:
+        """
+        The HELP and TYPE lines and the sample line of every label values of
+        the rendered block.
+        """
+        _, header, samples, _ = self._render()
+        return header, samples
+
+    def _render(self) -> Tuple[Tuple[Tuple[LabelValues, Number], ...],
+                               str,
+                               List[Tuple[LabelValues, str]],
+                               str]:
+        # keep a copy, the values are cleared (or updated in place for
+        # counters) before the next collection
+        items = tuple(self.value.items())
+        if self._expfmt_cache is not None and self._expfmt_cache[0] == items:
+            return self._expfmt_cache
 
         # Must be kept in sync with promethize() in src/exporter/util.cc
         def promethize(path: str) -> str:
@@ -354,7 +532,7 @@ class Metric(object):
             return repr(float(value))
 
         name = promethize(self.name)
-        expfmt = '''
+        header = '''
 # HELP {name} {desc}
 # TYPE {name} {mtype}'''.format(
             name=name,
@@ -362,22 +540,30 @@ class Metric(object):
             mtype=self.mtype,
         )
 
-        for labelvalues, value in self.value.items():
-            if self.labelnames:
-                labels_list = zip(self.labelnames, labelvalues)
-                labels = ','.join('%s="%s"' % (k, v) for k, v in labels_list)
-            else:
-                labels = ''
+        samples: List[Tuple[LabelValues, str]] = []
+        for labelvalues, value in items:
+            sample_name, labels_list = self._sample_labels(name, labelvalues)
+            labels = ','.join('%s="%s"' % (k, v) for k, v in labels_list)
             if labels:
-                fmtstr = '\n{name}{{{labels}}} {value}'
+                fmtstr = '{name}{{{labels}}} {value}'
             else:
-                fmtstr = '\n{name} {value}'
-            expfmt += fmtstr.format(
-                name=name,
+                fmtstr = '{name} {value}'
+            samples.append((labelvalues, fmtstr.format(
+                name=sample_name,
                 labels=labels,
                 value=floatstr(value),
-            )
-        return expfmt
+            )))
+        expfmt = header + ''.join('\n' + line for _, line in samples)
+        self._expfmt_cache = (items, header, samples, expfmt)
+        return self._expfmt_cache
+
+    def _sample_labels(self, name: str, labelvalues: LabelValues) -> Tuple[str, Iterable[Tuple[str, Any]]]:
+        """
+        The name and the label pairs of the sample with ``labelvalues``.
+        """
+        if not self.labelnames:
+            return name, []
+        return name, zip(self.labelnames, labelvalues)
 
     def group_by(
         self,
@@ -497,6 +683,185 @@ class MetricCounter(Metric):
         self.value[labelvalues] += value
 
 
+class MetricHistogram(Metric):
+    """
+    A histogram family: the ``_bucket`` samples of every bucket, and the
+    ``_sum`` and ``_count`` samples, of every set of label values.
+
+    >>> m = MetricHistogram('call_seconds', 'Call latency', ('call',))
+    >>> m.observed({'count': 2, 'sum': 0.3, 'buckets': {'0.1': 1, '+Inf': 2}}, ('get',))
+    >>> print(m.str_expfmt())
+    <BLANKLINE>
+    # HELP ceph_call_seconds Call latency
+    # TYPE ceph_call_seconds histogram
+    ceph_call_seconds_bucket{call="get",le="0.1"} 1.0
+    ceph_call_seconds_bucket{call="get",le="+Inf"} 2.0
+    ceph_call_seconds_sum{call="get"} 0.3
+    ceph_call_seconds_count{call="get"} 2.0
+    """
+
+    def __init__(self, name: str, desc: str, labels: LabelValues) -> None:
+        super(MetricHistogram, self).__init__('histogram', name, desc, labels)
+
+    def observed(self, histogram: Dict[str, Any], labelvalues: LabelValues) -> None:
+        """
+        Set the samples of ``labelvalues`` from the dump() of a
+        mgr_util.LatencyHistogram.
+        """
+        for le, count in histogram['buckets'].items():
+            self.value[('_bucket',) + labelvalues + (le,)] = count
+        self.value[('_sum',) + labelvalues] = histogram['sum']
+        self.value[('_count',) + labelvalues] = histogram['count']
+
+    def _sample_labels(self, name: str, labelvalues: LabelValues) -> Tuple[str, Iterable[Tuple[str, Any]]]:
+        # the label values are prefixed by the sample's suffix, bucket
+        # samples end with their upper bound
+        suffix, labelvalues = labelvalues[0], labelvalues[1:]
+        labelnames = self.labelnames or ()
+        if suffix == '_bucket':
+            labelnames = labelnames + ('le',)
+        return name + suffix, zip(labelnames, labelvalues)
+
+
+# (daemon type or None for all, shard, number of shards)
+PerfCounterSubset = Tuple[Optional[str], int, int]
+
+
+class PerfCounterIndex(object):
+    """
+    The rendered perf counter samples of one collection, grouped by daemon,
+    so that the /metrics/perf endpoints can serve a subset of the daemons
+    without formatting the metrics again.
+
+    >>> m = Metric('gauge', 'osd_numpg', 'Placement groups', ('ceph_daemon',))
+    >>> m.set(10, ('osd.0',))
+    >>> m.set(12, ('osd.1',))
+    >>> index = PerfCounterIndex()
+    >>> index.add(m, {'osd.0': 'osd.0', 'osd.1': 'osd.1'})
+    >>> print(index.render('osd', 1, 2))
+    <BLANKLINE>
+    # HELP ceph_osd_numpg Placement groups
+    # TYPE ceph_osd_numpg gauge
+    ceph_osd_numpg{ceph_daemon="osd.1"} 12.0
+    <BLANKLINE>
+    """
+
+    def __init__(self) -> None:
+        # (HELP and TYPE lines, samples by daemon name) of every family
+        self.families: List[Tuple[str, Dict[str, List[str]]]] = []
+
+    def add(self, metric: Metric, daemons: Dict[str, str]) -> None:
+        """
+        Add a family, ``daemons`` maps the value of its first label to the
+        name of the daemon the sample belongs to.
+        """
+        header, lines = metric.expfmt_samples()
+        samples: Dict[str, List[str]] = defaultdict(list)
+        for labelvalues, line in lines:
+            daemon = daemons.get(str(labelvalues[0]), str(labelvalues[0]))
+            samples[daemon].append(line)
+        self.families.append((header, samples))
+
+    @staticmethod
+    def shard_of(daemon: str, of: int) -> int:
+        daemon_id = daemon.split('.', 1)[-1]
+        if daemon_id.isdigit():
+            return int(daemon_id) % of
+        return zlib.crc32(daemon.encode('utf-8')) % of
+
+    def render(self, daemon_type: Optional[str] = None, shard: int = 0, of: int = 1) -> str:
+        selected: Dict[str, bool] = {}
+
+        def match(daemon: str) -> bool:
+            if daemon not in selected:
+                selected[daemon] = (
+                    (daemon_type is None or daemon.split('.', 1)[0] == daemon_type)
+                    and (of == 1 or self.shard_of(daemon, of) == shard))
+            return selected[daemon]
+
+        out = []
+        for header, samples in self.families:
+            lines = [line
+                     for daemon, daemon_lines in samples.items() if match(daemon)
+                     for line in daemon_lines]
+            if lines:
+                out.append(header)
+                out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+
+class CollectorStage(object):
+    """
+    A group of collector methods run on a worker of the collection pool.
+
+    The collectors of a stage write into the stage's own metric families
+    (see Module.metrics), alternating between two sets of families: one is
+    filled by the run in progress while the other keeps the output of the
+    last successful run. That output is served when a run exceeds its
+    timeout or fails, and the run is not restarted until it has finished.
+    """
+
+    def __init__(self, name: str, collectors: Tuple[str, ...]) -> None:
+        self.name = name
+        self.collectors = collectors
+        self.lock = threading.Lock()
+        self.future: Optional['Future[None]'] = None
+        self._buffers: List[Dict[str, Metric]] = []
+        self.output: Dict[str, Metric] = {}
+        self.duration = 0.0
+        self.timeouts = 0
+        self.failures = 0
+
+    def submit(self, mod: 'Module', pool: ThreadPoolExecutor) -> None:
+        with self.lock:
+            if self.future is not None and not self.future.done():
+                # still busy with a run that timed out earlier
+                return
+            if not self._buffers:
+                self._buffers = [mod._setup_static_metrics(), mod._setup_static_metrics()]
+            # fill the set of families that is not currently served
+            if self._buffers[0] is self.output:
+                buffer = self._buffers[1]
+            else:
+                buffer = self._buffers[0]
+            self.future = pool.submit(self._run, mod, buffer)
+
+    def _run(self, mod: 'Module', buffer: Dict[str, Metric]) -> None:
+        start = time.time()
+        for metric in buffer.values():
+            metric.clear()
+        mod._stage_local.metrics = buffer
+        try:
+            for collector in self.collectors:
+                getattr(mod, collector)()
+        except Exception:
+            mod.log.exception('collector stage {} failed:'.format(self.name))
+            with self.lock:
+                self.failures += 1
+            return
+        finally:
+            del mod._stage_local.metrics
+        with self.lock:
+            self.output = buffer
+            self.duration = time.time() - start
+
+    def wait(self, mod: 'Module', deadline: float) -> None:
+        future = self.future
+        if future is None:
+            return
+        try:
+            future.result(timeout=max(0.0, deadline - time.time()))
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            mod.log.warning('collector stage {} did not finish in time, using the output '
+                            'of its last run'.format(self.name))
+
+    def reset(self) -> None:
+        with self.lock:
+            self.output = {}
+
+
 class MetricCollectionThread(threading.Thread):
     def __init__(self, module: 'Module') -> None:
         self.mod = module
@@ -538,6 +903,7 @@ class MetricCollectionThread(threading.Thread):
 
                 with self.mod.collect_lock:
                     self.mod.collect_cache = data
+                    self.mod.collect_cache_encoded = {}
                     self.mod.collect_time = duration
 
                 self.event.wait(sleep_time)
@@ -602,6 +968,44 @@ class Module(MgrModule, OrchestratorClientMixin):
             max=599,
             runtime=True
         ),
+        Option(
+            name='collect_workers',
+            type='int',
+            default=4,
+            min=1,
+            desc='number of threads running the metric collector stages concurrently',
+        ),
+        Option(
+            name='collect_stage_timeout',
+            type='float',
+            default=0.0,
+            min=0.0,
+            desc='seconds a collector stage may take before the output of its '
+                 'last run is served instead (0 = scrape interval)',
+            runtime=True
+        ),
+        Option(
+            name='compression',
+            type='bool',
+            default=True,
+            desc='compress the metrics with gzip or zstd if the client accepts it',
+            runtime=True
+        ),
+        Option(
+            name='openmetrics',
+            type='bool',
+            default=False,
+            desc='serve the OpenMetrics text format to clients preferring it',
+            runtime=True
+        ),
+        Option(
+            name='split_perf_counters',
+            type='bool',
+            default=False,
+            desc='serve perf counters only from the /metrics/perf and /metrics/<daemon type> endpoints',
+            long_desc='When perf counters are gathered (see exclude_perf_counters), leave them out of /metrics. They can then be scraped separately, optionally split by daemon type (/metrics/perf?daemon_type=rgw or /metrics/rgw) and into shards (/metrics/osd?shard=3&of=16), so slow perf counter scrapes do not delay the cluster metrics.',
+            runtime=True
+        ),
         Option(
             name='exclude_perf_counters',
             type='bool',
@@ -619,7 +1023,11 @@ class Module(MgrModule, OrchestratorClientMixin):
         super(Module, self).__init__(*args, **kwargs)
         self.key_file: IO[bytes]
         self.cert_file: IO[bytes]
+        self._stage_local = threading.local()
         self.metrics = self._setup_static_metrics()
+        self.collector_stages = [CollectorStage(name, collectors)
+                                 for name, collectors in COLLECTOR_STAGES]
+        self.collect_pool: Optional[ThreadPoolExecutor] = None
         self.shutdown_event = threading.Event()
         self.collect_lock = threading.Lock()
         self.collect_time = 0.0
@@ -627,6 +1035,17 @@ class Module(MgrModule, OrchestratorClientMixin):
         self.cache = True
         self.stale_cache_strategy: str = self.STALE_CACHE_FAIL
         self.collect_cache: Optional[str] = None
+        # collect_cache (or a perf counter subset of it) in the negotiated
+        # format and encoding, see encoded_cache()
+        self.collect_cache_encoded: Dict[Tuple[str, str, Optional[PerfCounterSubset]], bytes] = {}
+        self.perf_counter_index: Optional[PerfCounterIndex] = None
+        # latest perf counters of all daemons, updated with the counters that
+        # changed since perf_counter_cursor, see update_perf_counters()
+        self.perf_counters: Dict[str, Dict[str, Any]] = {}
+        self.perf_counter_cursor = 0.0
+        self.perf_counter_resync = 0.0
+        # (hits, misses, seconds) of the last rendering of the metrics
+        self.render_stats: Tuple[int, int, float] = (0, 0, 0.0)
         self.rbd_stats = {
             'pools': {},
             'pools_refresh_time': 0,
@@ -650,6 +1069,15 @@ class Module(MgrModule, OrchestratorClientMixin):
         self.metrics_thread = MetricCollectionThread(_global_instance)
         self.health_history = HealthHistory(self)
 
+    @property
+    def metrics(self) -> Dict[str, Metric]:
+        # collectors running in a stage write into the stage's families
+        return getattr(self._stage_local, 'metrics', self._metrics)
+
+    @metrics.setter
+    def metrics(self, metrics: Dict[str, Metric]) -> None:
+        self._metrics = metrics
+
     def _setup_static_metrics(self) -> Dict[str, Metric]:
         metrics = {}
         metrics['health_status'] = Metric(
@@ -705,6 +1133,19 @@ class Module(MgrModule, OrchestratorClientMixin):
             'MGR module runnable state i.e. can it run (0=no, 1=yes)',
             MGR_MODULE_CAN_RUN
         )
+        metrics['mgr_module_call_seconds'] = MetricHistogram(
+            'mgr_module_call_seconds',
+            'Latency of calls of MGR module notify handlers, commands, remote '
+            'and profiled methods',
+            MGR_MODULE_CALL
+        )
+        metrics['mgr_module_call_max_seconds'] = Metric(
+            'gauge',
+            'mgr_module_call_max_seconds',
+            'Longest call of MGR module notify handlers, commands, remote and '
+            'profiled methods',
+            MGR_MODULE_CALL
+        )
         metrics['osd_metadata'] = Metric(
             'untyped',
             'osd_metadata',
@@ -1094,6 +1535,24 @@ class Module(MgrModule, OrchestratorClientMixin):
             self.metrics['mgr_module_status'].set(_state, (mod_name,))
             self.metrics['mgr_module_can_run'].set(_can_run, (mod_name,))
 
+    @profile_method()
+    def get_mgr_profile(self) -> None:
+        for mod_name in self.get_enabled_modules():
+            if mod_name == self.module_name:
+                stats = self.get_profile_stats()
+            else:
+                try:
+                    stats = self.remote(mod_name, 'get_profile_stats')
+                except (ImportError, RuntimeError):
+                    # not loaded (e.g. failed or can't run) on this mgr
+                    continue
+            for kind, calls in stats.items():
+                for call, histogram in calls.items():
+                    labels = (mod_name, kind, call)
+                    cast(MetricHistogram, self.metrics['mgr_module_call_seconds']).observed(
+                        histogram, labels)
+                    self.metrics['mgr_module_call_max_seconds'].set(histogram['max'], labels)
+
     @profile_method()
     def get_pg_status(self) -> None:
 
@@ -1138,7 +1597,7 @@ class Module(MgrModule, OrchestratorClientMixin):
 
     @profile_method()
     def get_metadata_and_osd_status(self) -> None:
-        osd_map = self.get('osd_map')
+        osd_map = self.get('osd_map', shared=True)
         osd_flags = osd_map['flags'].split(',')
         for flag in OSD_FLAGS:
             self.metrics['osd_flag_{}'.format(flag)].set(
@@ -1358,7 +1817,7 @@ class Module(MgrModule, OrchestratorClientMixin):
         # '*' can be used to indicate all pools or namespaces
         pools_string = cast(str, self.get_localized_module_option('rbd_stats_pools'))
         pool_keys = set()
-        osd_map = self.get('osd_map')
+        osd_map = self.get('osd_map', shared=True)
         rbd_pools = [pool['pool_name'] for pool in osd_map['pools']
                      if 'rbd' in pool.get('application_metadata', {})]
         for x in re.split(r'[\s,]+', pools_string):
@@ -1627,6 +2086,29 @@ class Module(MgrModule, OrchestratorClientMixin):
                 'The amount of metrics gathered for this exporter',
                 ('method',))
             self.metrics['prometheus_collect_duration_seconds_count'] = count_metric
+        last_metric = self.metrics.get('prometheus_collect_last_duration_seconds')
+        if last_metric is None:
+            last_metric = Metric(
+                'gauge',
+                'prometheus_collect_last_duration_seconds',
+                'The seconds the last run of each collector method took',
+                ('method',))
+            self.metrics['prometheus_collect_last_duration_seconds'] = last_metric
+        render_metric = self.metrics.get('prometheus_render_total')
+        if render_metric is None:
+            render_metric = MetricCounter(
+                'prometheus_render_total',
+                'The amount of metric families rendered (miss) or served from '
+                'the previously rendered text (hit)',
+                ('result',))
+            self.metrics['prometheus_render_total'] = render_metric
+        render_time_metric = self.metrics.get('prometheus_render_duration_seconds')
+        if render_time_metric is None:
+            render_time_metric = Metric(
+                'gauge',
+                'prometheus_render_duration_seconds',
+                'The seconds the previous collection took to render all metric families')
+            self.metrics['prometheus_render_duration_seconds'] = render_time_metric
 
         # Collect all timing data and make it available as metric, excluding the
         # `collect` method because it has not finished at this point and hence
@@ -1638,9 +2120,17 @@ class Module(MgrModule, OrchestratorClientMixin):
             if duration is not None:
                 cast(MetricCounter, sum_metric).add(duration, (method_name,))
                 cast(MetricCounter, count_metric).add(1, (method_name,))
+                last_metric.set(duration, (method_name,))
+
+        # Rendering happens after the metrics were gathered, so these figures
+        # are from the previous collection.
+        hits, misses, render_duration = self.render_stats
+        cast(MetricCounter, render_metric).add(hits, ('hit',))
+        cast(MetricCounter, render_metric).add(misses, ('miss',))
+        render_time_metric.set(render_duration)
 
     def get_pool_repaired_objects(self) -> None:
-        dump = self.get('pg_dump')
+        dump = self.get('pg_dump', shared=True)
         for stats in dump['pool_stats']:
             path = 'pool_objects_repaired'
             self.metrics[path].set(stats['stat_sum']['num_objects_repaired'],
@@ -1654,11 +2144,36 @@ class Module(MgrModule, OrchestratorClientMixin):
                 self.metrics[path].set(health_metric['value'], labelvalues=(
                     health_metric['type'], daemon_name,))
 
+    def update_perf_counters(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch the perf counters that changed since the last scrape and merge
+        them into the ones we already know. Every PERF_COUNTER_RESYNC_INTERVAL
+        all counters are fetched, so that counters a daemon no longer has
+        don't linger.
+        """
+        now = time.monotonic()
+        if now - self.perf_counter_resync > PERF_COUNTER_RESYNC_INTERVAL:
+            self.perf_counter_cursor = 0.0
+            self.perf_counter_resync = now
+            self.perf_counters = {}
+        cursor, changed = self.get_unlabeled_perf_counters_delta(self.perf_counter_cursor)
+        perf_counters = {}
+        for daemon, counters in changed.items():
+            known = self.perf_counters.get(daemon, {})
+            known.update(counters)
+            if known:
+                perf_counters[daemon] = known
+        self.perf_counters = perf_counters
+        self.perf_counter_cursor = cursor
+        return perf_counters
+
     def get_perf_counters(self) -> None:
         """
         Get the perf counters for all daemons
         """
-        for daemon, counters in self.get_unlabeled_perf_counters().items():
+        # first label value -> daemon name, for the PerfCounterIndex
+        daemons: Dict[str, str] = {}
+        for daemon, counters in self.update_perf_counters().items():
             for path, counter_info in counters.items():
                 # Skip histograms, they are represented by long running avgs
                 stattype = self._stattype_to_str(counter_info['type'])
@@ -1668,6 +2183,7 @@ class Module(MgrModule, OrchestratorClientMixin):
 
                 path, label_names, labels = self._perfpath_to_path_labels(
                     daemon, path)
+                daemons[labels[0]] = daemon
 
                 # Get the value of the counter
                 value = self._perfvalue_to_value(
@@ -1704,36 +2220,161 @@ class Module(MgrModule, OrchestratorClientMixin):
                     self.metrics[path].set(value, labels)
         self.add_fixed_name_metrics()
 
+        index = PerfCounterIndex()
+        for metric in self.metrics.values():
+            if metric.value and metric.labelnames:
+                index.add(metric, daemons)
+        self.perf_counter_index = index
+
+    def negotiate(self, accept: Optional[str], accept_encoding: Optional[str]) -> Tuple[str, str]:
+        fmt = negotiate_format(
+            accept, cast(bool, self.get_localized_module_option('openmetrics', False)))
+        encoding = negotiate_encoding(
+            accept_encoding, cast(bool, self.get_localized_module_option('compression', True)))
+        return fmt, encoding
+
+    def encoded_cache(self, fmt: str, encoding: str,
+                      subset: Optional[PerfCounterSubset] = None) -> bytes:
+        """
+        Return collect_cache, or the given subset of the perf counters, in
+        the given format and content coding. Each variant is encoded at most
+        once per collection. Must be called with collect_lock held.
+        """
+        assert self.collect_cache is not None
+        key = (fmt, encoding, subset)
+        if key not in self.collect_cache_encoded:
+            self.collect_cache_encoded[key] = encode_metrics(
+                self.render_subset(subset), fmt, encoding)
+        return self.collect_cache_encoded[key]
+
+    def render_subset(self, subset: Optional[PerfCounterSubset]) -> str:
+        if subset is None:
+            assert self.collect_cache is not None
+            return self.collect_cache
+        if self.perf_counter_index is None:
+            raise cherrypy.HTTPError(503, 'No perf counters collected, check the '
+                                          '`exclude_perf_counters` configuration option')
+        return self.perf_counter_index.render(*subset)
+
+    @staticmethod
+    def parse_metrics_subset(path: Tuple[str, ...],
+                             params: Dict[str, str]) -> Optional[PerfCounterSubset]:
+        """
+        Map the path and query of a /metrics request to the perf counter
+        subset to serve, e.g. /metrics/osd?shard=3&of=16 or
+        /metrics/perf?daemon_type=rgw. Plain /metrics serves everything.
+
+        >>> Module.parse_metrics_subset(('osd',), {'shard': '3', 'of': '16'})
+        ('osd', 3, 16)
+        >>> Module.parse_metrics_subset(('perf',), {'daemon_type': 'rgw'})
+        ('rgw', 0, 1)
+        """
+        if not path:
+            return None
+        if len(path) > 1:
+            raise cherrypy.NotFound()
+        daemon_type = params.get('daemon_type') if path[0] == 'perf' else path[0]
+        try:
+            shard = int(params.get('shard', 0))
+            of = int(params.get('of', 1))
+        except ValueError:
+            raise cherrypy.HTTPError(400, '`shard` and `of` must be integers')
+        if of < 1 or not 0 <= shard < of:
+            raise cherrypy.HTTPError(400, '`shard` must be in the range [0, `of`)')
+        return daemon_type, shard, of
+
+    def get_collect_stage_metrics(self) -> None:
+        duration_metric = self.metrics.get('prometheus_collect_stage_duration_seconds')
+        timeout_metric = self.metrics.get('prometheus_collect_stage_timeouts')
+        failure_metric = self.metrics.get('prometheus_collect_stage_failures')
+        if duration_metric is None:
+            duration_metric = Metric(
+                'gauge',
+                'prometheus_collect_stage_duration_seconds',
+                'The seconds the last successful run of a collector stage took',
+                ('stage',))
+            self.metrics['prometheus_collect_stage_duration_seconds'] = duration_metric
+        if timeout_metric is None:
+            timeout_metric = Metric(
+                'counter',
+                'prometheus_collect_stage_timeouts',
+                'The amount of times a collector stage exceeded its timeout',
+                ('stage',))
+            self.metrics['prometheus_collect_stage_timeouts'] = timeout_metric
+        if failure_metric is None:
+            failure_metric = Metric(
+                'counter',
+                'prometheus_collect_stage_failures',
+                'The amount of times a collector stage failed',
+                ('stage',))
+            self.metrics['prometheus_collect_stage_failures'] = failure_metric
+
+        for stage in self.collector_stages:
+            with stage.lock:
+                duration_metric.set(stage.duration, (stage.name,))
+                timeout_metric.set(stage.timeouts, (stage.name,))
+                failure_metric.set(stage.failures, (stage.name,))
+
+    def _get_collect_pool(self) -> ThreadPoolExecutor:
+        if self.collect_pool is None:
+            workers = cast(int, self.get_localized_module_option('collect_workers', 4))
+            self.collect_pool = ThreadPoolExecutor(max_workers=workers,
+                                                   thread_name_prefix='prometheus-collect')
+        return self.collect_pool
+
+    def shutdown_collect_pool(self) -> None:
+        if self.collect_pool is not None:
+            self.collect_pool.shutdown(wait=True)
+            self.collect_pool = None
+
     @profile_method(True)
     def collect(self) -> str:
         # Clear the metrics before scraping
         for k in self.metrics.keys():
             self.metrics[k].clear()
 
-        self.get_health()
-        self.get_df()
-        self.get_osd_blocklisted_entries()
-        self.get_pool_stats()
-        self.get_fs()
-        self.get_osd_stats()
-        self.get_quorum_status()
-        self.get_mgr_status()
-        self.get_metadata_and_osd_status()
-        self.get_pg_status()
-        self.get_pool_repaired_objects()
-        self.get_num_objects()
-        self.get_all_daemon_health_metrics()
-
-        if not self.get_module_option('exclude_perf_counters'):
-            self.get_perf_counters()
-        self.get_rbd_stats()
+        stage_timeout = cast(float, self.get_localized_module_option('collect_stage_timeout', 0.0))
+        deadline = time.time() + (stage_timeout or self.scrape_interval)
+        stages = self.collector_stages
+        if self.get_module_option('exclude_perf_counters'):
+            stages = [stage for stage in stages if stage.name != 'perf_counters']
+            for stage in self.collector_stages:
+                if stage.name == 'perf_counters':
+                    stage.reset()
+            self.perf_counter_index = None
+            self.perf_counters = {}
+            self.perf_counter_resync = 0.0
+
+        pool = self._get_collect_pool()
+        for stage in stages:
+            stage.submit(self, pool)
+        for stage in stages:
+            stage.wait(self, deadline)
 
         self.get_collect_time_metrics()
-
-        # Return formatted metrics and clear no longer used data
-        _metrics = [m.str_expfmt() for m in self.metrics.values()]
-        for k in self.metrics.keys():
-            self.metrics[k].clear()
+        self.get_collect_stage_metrics()
+
+        # Families filled by a stage replace the (empty) ones of the module
+        metrics = dict(self.metrics)
+        if self.get_module_option('split_perf_counters'):
+            stages = [stage for stage in stages if stage.name != 'perf_counters']
+        for stage in stages:
+            with stage.lock:
+                output = stage.output
+            for path, metric in output.items():
+                if metric.value or path not in metrics:
+                    metrics[path] = metric
+
+        # Return formatted metrics. Families whose values did not change since
+        # the last collection reuse their previously rendered text.
+        start = time.time()
+        hits = 0
+        _metrics = []
+        for m in metrics.values():
+            if m.is_render_cached():
+                hits += 1
+            _metrics.append(m.str_expfmt())
+        self.render_stats = (hits, len(_metrics) - hits, time.time() - start)
 
         return ''.join(_metrics) + '\n'
 
@@ -1854,27 +2495,47 @@ class Module(MgrModule, OrchestratorClientMixin):
 </html>'''
 
             @cherrypy.expose
-            def metrics(self) -> Optional[str]:
+            def metrics(self, *path: str, **params: str) -> Optional[bytes]:
                 # Lock the function execution
                 assert isinstance(_global_instance, Module)
+                subset = _global_instance.parse_metrics_subset(path, params)
                 with _global_instance.collect_lock:
-                    return self._metrics(_global_instance)
+                    return self._metrics(_global_instance, subset)
 
             @staticmethod
-            def _metrics(instance: 'Module') -> Optional[str]:
+            def _set_headers(fmt: str, encoding: str) -> None:
+                headers = cherrypy.response.headers
+                if fmt == 'openmetrics':
+                    headers['Content-Type'] = OPENMETRICS_CONTENT_TYPE
+                else:
+                    headers['Content-Type'] = TEXT_CONTENT_TYPE
+                if encoding != 'identity':
+                    headers['Content-Encoding'] = encoding
+                headers['Vary'] = 'Accept, Accept-Encoding'
+
+            @staticmethod
+            def _metrics(instance: 'Module',
+                         subset: Optional[PerfCounterSubset] = None) -> Optional[bytes]:
+                fmt, encoding = instance.negotiate(
+                    cherrypy.request.headers.get('Accept'),
+                    cherrypy.request.headers.get('Accept-Encoding'))
+
                 if not self.cache:
                     self.log.debug('Cache disabled, collecting and returning without cache')
-                    cherrypy.response.headers['Content-Type'] = 'text/plain'
-                    return self.collect()
+                    Root._set_headers(fmt, encoding)
+                    text = self.collect()
+                    if subset is not None:
+                        text = self.render_subset(subset)
+                    return encode_metrics(text, fmt, encoding)
 
                 # Return cached data if available
                 if not instance.collect_cache:
                     raise cherrypy.HTTPError(503, 'No cached data available yet')
 
-                def respond() -> Optional[str]:
+                def respond() -> Optional[bytes]:
                     assert isinstance(instance, Module)
-                    cherrypy.response.headers['Content-Type'] = 'text/plain'
-                    return instance.collect_cache
+                    Root._set_headers(fmt, encoding)
+                    return instance.encoded_cache(fmt, encoding, subset)
 
                 if instance.collect_time < instance.scrape_interval:
                     # Respond if cache isn't stale
@@ -1942,9 +2603,10 @@ class Module(MgrModule, OrchestratorClientMixin):
         cherrypy.engine.stop()
         cherrypy.server.httpserver = None
         self.log.info('Engine stopped.')
-        self.shutdown_rbd_stats()
-        # wait for the metrics collection thread to stop
+        # wait for the metrics collection thread and running stages to stop
         self.metrics_thread.join()
+        self.shutdown_collect_pool()
+        self.shutdown_rbd_stats()
 
     def shutdown(self) -> None:
         self.log.info('Stopping engine...')
@@ -1,7 +1,13 @@
+import gzip
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
 from unittest import TestCase
 
-from prometheus.module import Metric, LabelValues, Number
+from prometheus.module import Module, Metric, MetricCounter, LabelValues, Number, CollectorStage, \
+    PerfCounterIndex, encode_metrics, negotiate_encoding, negotiate_format
 
 
 class MetricGroupTest(TestCase):
@@ -91,3 +97,253 @@ ceph_disk_occupation_display{ceph_daemon="osd.5+osd.6",device="/dev/dm-1",instan
         with self.assertRaises(AssertionError) as cm:
             m.group_by(["foo"], {"bar": "not callable str"})
         self.assertEqual(str(cm.exception), "joins must be callable")
+
+
+class MetricRenderCacheTest(TestCase):
+    def test_unchanged_values_reuse_rendered_text(self):
+        m = Metric("gauge", "osd_up", "OSD status up", ("ceph_daemon",))
+        self.assertFalse(m.is_render_cached())
+        m.set(1, ("osd.0",))
+        first = m.str_expfmt()
+        self.assertTrue(m.is_render_cached())
+
+        # clearing and setting the same values again must not re-render
+        m.clear()
+        m.set(1, ("osd.0",))
+        self.assertTrue(m.is_render_cached())
+        self.assertIs(m.str_expfmt(), first)
+
+    def test_changed_values_are_rendered(self):
+        m = Metric("gauge", "osd_up", "OSD status up", ("ceph_daemon",))
+        m.set(1, ("osd.0",))
+        m.str_expfmt()
+        m.clear()
+        m.set(0, ("osd.0",))
+        self.assertFalse(m.is_render_cached())
+        self.assertTrue(m.str_expfmt().endswith('ceph_osd_up{ceph_daemon="osd.0"} 0.0'))
+
+        m.clear()
+        self.assertFalse(m.is_render_cached())
+        self.assertEqual(m.str_expfmt(), '\n# HELP ceph_osd_up OSD status up\n# TYPE ceph_osd_up gauge')
+
+    def test_reordered_values_are_rendered(self):
+        m = Metric("gauge", "osd_up", "OSD status up", ("ceph_daemon",))
+        m.set(1, ("osd.0",))
+        m.set(0, ("osd.1",))
+        m.str_expfmt()
+        m.clear()
+        m.set(0, ("osd.1",))
+        m.set(1, ("osd.0",))
+        self.assertFalse(m.is_render_cached())
+        self.assertTrue(m.str_expfmt().endswith('ceph_osd_up{ceph_daemon="osd.0"} 1.0'))
+
+    def test_counter_updated_in_place_is_rendered(self):
+        m = MetricCounter("collect_count", "Count", ("method",))
+        m.add(1, ("get_df",))
+        m.str_expfmt()
+        m.add(1, ("get_df",))
+        self.assertFalse(m.is_render_cached())
+        self.assertTrue(m.str_expfmt().endswith('ceph_collect_count{method="get_df"} 2.0'))
+
+
+class FakeCollectorModule:
+    def __init__(self):
+        self.log = logging.getLogger(__name__)
+        self._stage_local = threading.local()
+        self._metrics = self._setup_static_metrics()
+        self.up = 1
+        self.release = threading.Event()
+        self.release.set()
+
+    @property
+    def metrics(self):
+        return getattr(self._stage_local, 'metrics', self._metrics)
+
+    def _setup_static_metrics(self):
+        return {'osd_up': Metric('untyped', 'osd_up', 'OSD status up', ('ceph_daemon',))}
+
+    def get_osd_status(self):
+        self.release.wait()
+        self.metrics['osd_up'].set(self.up, ('osd.0',))
+
+    def get_broken(self):
+        raise RuntimeError('broken')
+
+
+class CollectorStageTest(TestCase):
+    def setUp(self):
+        self.mod = FakeCollectorModule()
+        self.pool = ThreadPoolExecutor(max_workers=2)
+
+    def tearDown(self):
+        self.mod.release.set()
+        self.pool.shutdown(wait=True)
+
+    def run_stage(self, stage, timeout=5.0):
+        stage.submit(self.mod, self.pool)
+        stage.wait(self.mod, time.time() + timeout)
+
+    def test_stage_writes_into_own_families(self):
+        stage = CollectorStage('osd', ('get_osd_status',))
+        self.run_stage(stage)
+        self.assertEqual(stage.output['osd_up'].value, {('osd.0',): 1})
+        self.assertEqual(self.mod.metrics['osd_up'].value, {})
+
+    def test_timed_out_stage_serves_last_output(self):
+        stage = CollectorStage('osd', ('get_osd_status',))
+        self.run_stage(stage)
+        last_output = stage.output
+
+        self.mod.up = 0
+        self.mod.release.clear()
+        self.run_stage(stage, timeout=0.01)
+        self.assertEqual(stage.timeouts, 1)
+        self.assertIs(stage.output, last_output)
+        self.assertEqual(stage.output['osd_up'].value, {('osd.0',): 1})
+
+        # no new run is started while the slow one is in progress
+        future = stage.future
+        stage.submit(self.mod, self.pool)
+        self.assertIs(stage.future, future)
+
+        self.mod.release.set()
+        stage.wait(self.mod, time.time() + 5.0)
+        self.assertEqual(stage.output['osd_up'].value, {('osd.0',): 0})
+
+    def test_failed_stage_keeps_last_output(self):
+        stage = CollectorStage('osd', ('get_osd_status',))
+        self.run_stage(stage)
+        stage.collectors = ('get_osd_status', 'get_broken')
+        self.run_stage(stage)
+        self.assertEqual(stage.failures, 1)
+        self.assertEqual(stage.output['osd_up'].value, {('osd.0',): 1})
+
+
+class MetricEncodingTest(TestCase):
+    def setUp(self):
+        m = Metric('counter', 'pool_wr', 'DF pool wr', ('pool_id',))
+        m.set(3, (1,))
+        self.text = m.str_expfmt() + '\n'
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding(None), 'identity')
+        self.assertEqual(negotiate_encoding('gzip'), 'gzip')
+        self.assertEqual(negotiate_encoding('*'), negotiate_encoding('gzip, zstd'))
+        self.assertEqual(negotiate_encoding('br, gzip;q=0'), 'identity')
+
+    def test_negotiate_format(self):
+        prometheus_accept = ('application/openmetrics-text;version=1.0.0,'
+                             'application/openmetrics-text;version=0.0.1;q=0.75,'
+                             'text/plain;version=0.0.4;q=0.5,*/*;q=0.1')
+        self.assertEqual(negotiate_format(prometheus_accept), 'openmetrics')
+        self.assertEqual(negotiate_format(prometheus_accept, openmetrics=False), 'text')
+        self.assertEqual(negotiate_format(None), 'text')
+
+    def test_encode_gzip(self):
+        self.assertEqual(gzip.decompress(encode_metrics(self.text, encoding='gzip')).decode(),
+                         self.text)
+
+    def test_encode_openmetrics(self):
+        self.assertEqual(
+            encode_metrics(self.text, fmt='openmetrics').decode(),
+            '# HELP ceph_pool_wr DF pool wr\n'
+            '# TYPE ceph_pool_wr unknown\n'
+            'ceph_pool_wr{pool_id="1"} 3.0\n'
+            '# EOF\n')
+
+
+class PerfCounterIndexTest(TestCase):
+    def setUp(self):
+        osd_op = Metric('counter', 'osd_op', 'Client operations', ('ceph_daemon',))
+        for i in range(4):
+            osd_op.set(i, ('osd.{}'.format(i),))
+        rgw_req = Metric('counter', 'rgw_req', 'Requests', ('instance_id',))
+        rgw_req.set(7, ('myrealm.host1.abc',))
+        self.index = PerfCounterIndex()
+        daemons = {'osd.{}'.format(i): 'osd.{}'.format(i) for i in range(4)}
+        daemons['myrealm.host1.abc'] = 'rgw.myrealm.host1.abc'
+        self.index.add(osd_op, daemons)
+        self.index.add(rgw_req, daemons)
+
+    def test_render_all(self):
+        text = self.index.render()
+        self.assertIn('ceph_osd_op{ceph_daemon="osd.3"} 3.0', text)
+        self.assertIn('ceph_rgw_req{instance_id="myrealm.host1.abc"} 7.0', text)
+
+    def test_render_by_daemon_type(self):
+        self.assertEqual(self.index.render('rgw'),
+                         '\n# HELP ceph_rgw_req Requests\n'
+                         '# TYPE ceph_rgw_req counter\n'
+                         'ceph_rgw_req{instance_id="myrealm.host1.abc"} 7.0\n')
+        self.assertEqual(self.index.render('mds'), '\n')
+
+    def test_render_shards(self):
+        shards = [self.index.render('osd', shard, 2) for shard in range(2)]
+        self.assertIn('osd.0', shards[0])
+        self.assertIn('osd.2', shards[0])
+        self.assertNotIn('osd.1', shards[0])
+        self.assertIn('osd.1', shards[1])
+        self.assertIn('osd.3', shards[1])
+        # every daemon ends up in exactly one shard
+        rgw_shards = [self.index.render('rgw', shard, 3) for shard in range(3)]
+        self.assertEqual(sum('ceph_rgw_req{' in text for text in rgw_shards), 1)
+
+    def test_samples_follow_their_daemon(self):
+        m = Metric('gauge', 'osd_numpg', 'Placement groups', ('ceph_daemon',))
+        daemons = {'osd.0': 'osd.0', 'osd.1': 'osd.1'}
+        m.set(10, ('osd.0',))
+        m.set(12, ('osd.1',))
+        PerfCounterIndex().add(m, daemons)
+        # same values, set in the other order
+        m.clear()
+        m.set(12, ('osd.1',))
+        m.set(10, ('osd.0',))
+        index = PerfCounterIndex()
+        index.add(m, daemons)
+        self.assertIn('ceph_daemon="osd.1"', index.render('osd', 1, 2))
+        self.assertNotIn('ceph_daemon="osd.0"', index.render('osd', 1, 2))
+
+
+class FakePerfCounterModule:
+    update_perf_counters = Module.update_perf_counters
+
+    def __init__(self):
+        self.perf_counters = {}
+        self.perf_counter_cursor = 0.0
+        self.perf_counter_resync = time.monotonic()
+        self.deltas = []
+        self.cursors = []
+
+    def get_unlabeled_perf_counters_delta(self, cursor):
+        self.cursors.append(cursor)
+        return self.deltas.pop(0)
+
+
+class UpdatePerfCountersTest(TestCase):
+    def test_changed_counters_are_merged(self):
+        mod = FakePerfCounterModule()
+        mod.deltas = [
+            (10.0, {'osd.0': {'a': {'value': 1}, 'b': {'value': 2}},
+                    'osd.1': {'a': {'value': 3}}}),
+            (20.0, {'osd.0': {'b': {'value': 5}}, 'osd.1': {}}),
+            # osd.1 is gone
+            (30.0, {'osd.0': {}}),
+        ]
+        mod.update_perf_counters()
+        self.assertEqual(mod.update_perf_counters(), {
+            'osd.0': {'a': {'value': 1}, 'b': {'value': 5}},
+            'osd.1': {'a': {'value': 3}},
+        })
+        self.assertEqual(mod.update_perf_counters(), {
+            'osd.0': {'a': {'value': 1}, 'b': {'value': 5}},
+        })
+        self.assertEqual(mod.cursors, [0.0, 10.0, 20.0])
+
+    def test_resync(self):
+        mod = FakePerfCounterModule()
+        mod.perf_counters = {'osd.0': {'stale': {'value': 1}}}
+        mod.perf_counter_cursor = 10.0
+        mod.perf_counter_resync = time.monotonic() - 1000
+        mod.deltas = [(20.0, {'osd.0': {'a': {'value': 1}}})]
+        self.assertEqual(mod.update_perf_counters(), {'osd.0': {'a': {'value': 1}}})
+        self.assertEqual(mod.cursors, [0.0])
@@ -11,7 +11,7 @@ import fnmatch
 import mgr_util
 import json
 
-from mgr_module import CLIReadCommand, MgrModule, HandleCommandResult
+from mgr_module import CLIReadCommand, CLIWriteCommand, MgrModule, HandleCommandResult
 
 
 class Module(MgrModule):
@@ -372,3 +372,94 @@ class Module(MgrModule):
             return 0, json.dumps(json_output, sort_keys=True,indent=4,separators=(',', ': ')) , ""
         else:
             return 0, osd_table.get_string(), ""
+
+    def _call_modules(self,
+                      method: str,
+                      module: Optional[str] = None,
+                      *args: Any) -> Tuple[int, Dict[str, Any], str]:
+        """
+        Call ``method`` on ``module`` or on all enabled modules, returning
+        the results keyed by module name
+        """
+        names = self.get_enabled_modules()
+        if module is not None:
+            if module not in names:
+                return -errno.ENOENT, {}, "Module '{}' is not enabled".format(module)
+            names = [module]
+
+        result = {}
+        for name in names:
+            if name == self.module_name:
+                result[name] = getattr(self, method)(*args)
+                continue
+            try:
+                result[name] = self.remote(name, method, *args)
+            except (ImportError, RuntimeError) as e:
+                # not loaded (e.g. failed or can't run) on this mgr
+                self.log.debug('%s failed for module %s: %s', method, name, e)
+        return 0, result, ""
+
+    @CLIReadCommand("mgr memo dump")
+    def handle_memo_dump(self, module: Optional[str] = None) -> Tuple[int, str, str]:
+        """
+        Show hit, miss and entry counts of the memoized values of mgr modules
+        """
+        r, result, err = self._call_modules('get_memo_stats', module)
+        if r != 0:
+            return r, "", err
+        return 0, json.dumps(result, sort_keys=True, indent=4), ""
+
+    @CLIReadCommand("mgr profile dump")
+    def handle_profile_dump(self, module: Optional[str] = None) -> Tuple[int, str, str]:
+        """
+        Show latency histograms of notify handlers, commands and remote calls
+        of mgr modules
+        """
+        r, result, err = self._call_modules('get_profile_stats', module)
+        if r != 0:
+            return r, "", err
+        return 0, json.dumps(result, sort_keys=True, indent=4), ""
+
+    @CLIWriteCommand("mgr profile reset")
+    def handle_profile_reset(self, module: Optional[str] = None) -> Tuple[int, str, str]:
+        """
+        Clear the latency histograms of mgr modules
+        """
+        r, result, err = self._call_modules('reset_profile_stats', module)
+        if r != 0:
+            return r, "", err
+        return 0, "", ""
+
+    @CLIWriteCommand("mgr profile sample start")
+    def handle_profile_sample_start(self,
+                                    module: str,
+                                    duration: float = 30.0,
+                                    interval: float = 0.01) -> Tuple[int, str, str]:
+        """
+        Start sampling the thread stacks of a mgr module
+        """
+        if duration <= 0 or interval <= 0:
+            return -errno.EINVAL, "", "duration and interval must be positive"
+        r, result, err = self._call_modules('start_stack_sampling', module,
+                                            duration, interval)
+        if r != 0:
+            return r, "", err
+        if module not in result:
+            return -errno.ENOENT, "", "Module '{}' is not loaded".format(module)
+        if not result[module]:
+            return -errno.EBUSY, "", "Stack sampling of '{}' is already running".format(module)
+        return 0, "", "Sampling '{}' for {}s".format(module, duration)
+
+    @CLIReadCommand("mgr profile sample dump")
+    def handle_profile_sample_dump(self,
+                                   module: str,
+                                   limit: int = 50) -> Tuple[int, str, str]:
+        """
+        Show the most frequently sampled thread stacks of a mgr module
+        """
+        r, result, err = self._call_modules('get_stack_samples', module, limit)
+        if r != 0:
+            return r, "", err
+        if result.get(module) is None:
+            return -errno.ENOENT, "", "No stack samples of '{}'".format(module)
+        return 0, json.dumps(result[module], indent=4), ""
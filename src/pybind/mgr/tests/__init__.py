@@ -196,6 +196,8 @@ if 'UNITTEST' in os.environ:
     cm = mock.Mock()
     cm.BaseMgrModule = M
     cm.BaseMgrStandbyModule = M
+    # so that the constants of CRUSHMap are available
+    cm.BasePyCRUSH = object
     sys.modules['ceph_module'] = cm
 
     def mock_ceph_modules():
@@ -0,0 +1,298 @@
+import json
+import threading
+import time
+
+import pytest
+
+from mgr_module import CommandPipeline, CommandTimedOut, CRUSHMap, DecodedMapCache, \
+    EpochMemo, MemoizeByEpoch, MgrModule, NotifyBatcher, NotifyType
+
+
+class TestDecodedMapCache:
+
+    def fetcher(self, value):
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return value
+        return fetch, calls
+
+    def test_fetched_once_per_epoch(self):
+        cache = DecodedMapCache()
+        fetch, calls = self.fetcher({'epoch': 3, 'pools': []})
+        first = cache.get('osd_map', 3, fetch)
+        assert first == {'epoch': 3, 'pools': []}
+        assert cache.get('osd_map', 3, fetch) is first
+        assert len(calls) == 1
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_new_epoch_is_fetched(self):
+        cache = DecodedMapCache()
+        cache.get('osd_map', 3, lambda: {'epoch': 3})
+        assert cache.get('osd_map', 4, lambda: {'epoch': 4}) == {'epoch': 4}
+        assert cache.get('pg_dump', 4, lambda: {'version': 4}) == {'version': 4}
+        assert cache.misses == 3
+        assert cache.dump()['entries'] == {'osd_map': 4, 'pg_dump': 4}
+
+    def test_clear(self):
+        cache = DecodedMapCache()
+        first = cache.get('osd_map', 3, lambda: {'epoch': 3})
+        cache.clear()
+        assert cache.get('osd_map', 3, lambda: {'epoch': 3}) is not first
+
+
+class FakeMapModule:
+    get = MgrModule.get
+
+    def __init__(self):
+        self._map_cache = DecodedMapCache()
+        self.epochs = {'osd_map': 10, 'fs_map': 2, 'mgr_map': 5, 'mon_map': 1, 'pg_map': 100}
+        self.fetched = []
+
+    def get_map_epochs(self):
+        return dict(self.epochs)
+
+    def _ceph_get(self, data_name):
+        self.fetched.append(data_name)
+        # the mgr returns serialized maps only with mgr_ttl_cache_expire_seconds
+        return {'data': data_name}
+
+
+def test_get_shared_by_epoch():
+    m = FakeMapModule()
+    first = m.get('osd_map', shared=True)
+    assert m.get('osd_map', shared=True) is first
+    m.epochs['pg_map'] += 1
+    assert m.get('osd_map', shared=True) is first
+    m.epochs['osd_map'] += 1
+    assert m.get('osd_map', shared=True) is not first
+    # not shared, or without a map epoch
+    m.get('osd_map')
+    m.get('health', shared=True)
+    m.get('health', shared=True)
+    assert m.fetched == ['osd_map', 'osd_map', 'osd_map', 'health', 'health']
+
+
+class FakeModule:
+    def __init__(self):
+        self._epoch_memo = EpochMemo()
+        self.epochs = {'osd_map': 10, 'fs_map': 2, 'mgr_map': 5, 'mon_map': 1, 'pg_map': 100}
+        self.calls = 0
+
+    def get_map_epochs(self):
+        return dict(self.epochs)
+
+    @MemoizeByEpoch('osd_map')
+    def pool_names(self, prefix=''):
+        self.calls += 1
+        return [prefix + 'rbd']
+
+    @MemoizeByEpoch('osd_map', 'pg_map', maxsize=1)
+    def pool_usage(self, pool):
+        self.calls += 1
+        return {pool: self.epochs['pg_map']}
+
+
+class TestMemoizeByEpoch:
+
+    def test_recomputed_only_on_epoch_change(self):
+        m = FakeModule()
+        first = m.pool_names()
+        assert m.pool_names() is first
+        # unrelated maps don't invalidate the value
+        m.epochs['fs_map'] += 1
+        m.epochs['pg_map'] += 1
+        assert m.pool_names() is first
+        assert m.calls == 1
+
+        m.epochs['osd_map'] += 1
+        assert m.pool_names() is not first
+        assert m.calls == 2
+
+    def test_arguments_are_part_of_the_key(self):
+        m = FakeModule()
+        assert m.pool_names() == ['rbd']
+        assert m.pool_names(prefix='x') == ['xrbd']
+        assert m.pool_names(prefix='x') == ['xrbd']
+        assert m.calls == 2
+
+    def test_maxsize(self):
+        m = FakeModule()
+        m.pool_usage(1)
+        m.pool_usage(2)
+        m.pool_usage(1)
+        assert m.calls == 3
+
+    def test_stats(self):
+        m = FakeModule()
+        m.pool_names()
+        m.pool_names()
+        m.pool_usage(1)
+        assert m._epoch_memo.dump() == {
+            'FakeModule.pool_names': {'hits': 1, 'misses': 1, 'entries': 1},
+            'FakeModule.pool_usage': {'hits': 0, 'misses': 1, 'entries': 1},
+        }
+
+    def test_unknown_map(self):
+        with pytest.raises(AssertionError):
+            MemoizeByEpoch('osd_map', 'nope')
+
+
+class TestNotifyBatcher:
+
+    def test_coalesces_window(self):
+        flushed = []
+        done = threading.Event()
+
+        def flush(notifications):
+            flushed.append(notifications)
+            done.set()
+
+        batcher = NotifyBatcher(0.05, flush)
+        batcher.add(NotifyType.osd_map, '')
+        batcher.add(NotifyType.pg_summary, '')
+        batcher.add(NotifyType.osd_map, '')
+        batcher.add(NotifyType.fs_map, 'a')
+        batcher.add(NotifyType.fs_map, 'b')
+        batcher.start()
+        assert done.wait(5)
+        batcher.stop()
+        batcher.join(5)
+
+        assert flushed == [{
+            NotifyType.osd_map: [''],
+            NotifyType.pg_summary: [''],
+            NotifyType.fs_map: ['a', 'b'],
+        }]
+        assert list(flushed[0]) == [NotifyType.osd_map, NotifyType.pg_summary,
+                                    NotifyType.fs_map]
+        assert (batcher.received, batcher.batches) == (5, 1)
+
+    def test_stop_when_idle(self):
+        batcher = NotifyBatcher(10, lambda n: None)
+        batcher.start()
+        batcher.stop()
+        batcher.join(5)
+        assert not batcher.is_alive()
+
+
+class FakeCommandModule:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.max_in_flight = 0
+        self.in_flight = 0
+
+    def send_command(self, result, svc_type, svc_id, command, tag, inbuf=None, one_shot=False):
+        with self.lock:
+            self.sent.append((svc_type, svc_id, json.loads(command)))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if json.loads(command)['prefix'] == 'hang':
+            return
+
+        def complete():
+            with self.lock:
+                self.in_flight -= 1
+            result.complete(0, svc_id, '')
+        threading.Timer(0.01, complete).start()
+
+
+class TestCommandPipeline:
+
+    def test_concurrency_cap(self):
+        mod = FakeCommandModule()
+        with CommandPipeline(mod, max_in_flight=3) as pipeline:
+            futures = [pipeline.submit('osd', str(i), {'prefix': 'smart'})
+                       for i in range(10)]
+        assert [f.result(5).stdout for f in futures] == [str(i) for i in range(10)]
+        assert len(mod.sent) == 10
+        assert mod.max_in_flight <= 3
+
+    def test_timeout(self):
+        mod = FakeCommandModule()
+        with CommandPipeline(mod, max_in_flight=1) as pipeline:
+            hung = pipeline.mon_command({'prefix': 'hang'}, timeout=0.05)
+            ok = pipeline.mon_command({'prefix': 'status'})
+        with pytest.raises(CommandTimedOut):
+            hung.result(5)
+        # the slot of the timed out command was freed
+        assert ok.result(5).retval == 0
+
+    def test_cancel(self):
+        mod = FakeCommandModule()
+        pipeline = CommandPipeline(mod, max_in_flight=1)
+        hung = pipeline.mon_command({'prefix': 'hang'}, timeout=0.2)
+        while not mod.sent:
+            time.sleep(0.001)
+        queued = pipeline.mon_command({'prefix': 'status'})
+        assert pipeline.cancel() == 1
+        assert queued.cancelled()
+        pipeline.close()
+        assert isinstance(hung.exception(5), CommandTimedOut)
+        assert [cmd['prefix'] for _, _, cmd in mod.sent] == ['hang']
+        with pytest.raises(RuntimeError):
+            pipeline.mon_command({'prefix': 'status'})
+
+
+CRUSH_DUMP = {
+    'devices': [{'id': 0, 'class': 'hdd'}, {'id': 1, 'class': 'hdd'}, {'id': 2, 'class': 'ssd'}],
+    'buckets': [
+        {'id': -1, 'name': 'default', 'items': [{'id': -2}, {'id': -3}]},
+        {'id': -2, 'name': 'host-a', 'items': [{'id': 0}, {'id': 2}]},
+        {'id': -3, 'name': 'host-b', 'items': [{'id': 1}, {'id': -42}]},
+        {'id': -4, 'name': 'default~ssd', 'items': [{'id': 2}]},
+    ],
+    'rules': [
+        {'rule_id': 0, 'rule_name': 'replicated_rule',
+         'steps': [{'op': 'take', 'item': -1}, {'op': 'emit'}]},
+        {'rule_id': 1, 'rule_name': 'broken', 'steps': [{'op': 'emit'}]},
+    ],
+}
+
+
+class FakeCRUSHMap(CRUSHMap):
+    dumps = 0
+
+    def __init__(self, checksum=1):
+        self.checksum = checksum
+
+    def _dump(self):
+        FakeCRUSHMap.dumps += 1
+        return CRUSH_DUMP
+
+    def _get_checksum(self):
+        return self.checksum
+
+
+class TestCRUSHTopology:
+
+    def setup_method(self):
+        CRUSHMap._topologies.clear()
+        FakeCRUSHMap.dumps = 0
+
+    def test_lookups(self):
+        crush = FakeCRUSHMap()
+        assert crush.get_rule_by_id(0)['rule_name'] == 'replicated_rule'
+        assert crush.get_rule_by_id(7) is None
+        assert crush.get_rule_root('replicated_rule') == -1
+        assert crush.get_rule_root('broken') is None
+        assert crush.get_rule_root('missing') is None
+        # missing buckets are skipped
+        assert crush.get_osds_under(-1) == [0, 2, 1]
+        # device class shadow trees are buckets of their own
+        assert crush.get_osds_under(-4) == [2]
+        assert crush.device_class_counts() == {'hdd': 2, 'ssd': 1}
+        with pytest.raises(KeyError):
+            crush.get_osds_under(-42)
+        assert FakeCRUSHMap.dumps == 1
+
+    def test_shared_by_checksum(self):
+        assert FakeCRUSHMap().topology() is FakeCRUSHMap().topology()
+        assert FakeCRUSHMap(checksum=2).topology() is not FakeCRUSHMap().topology()
+        assert FakeCRUSHMap.dumps == 2
+        for checksum in range(3, 3 + CRUSHMap.MAX_TOPOLOGIES):
+            FakeCRUSHMap(checksum).topology()
+        # the least recently used topologies were evicted
+        assert list(CRUSHMap._topologies) == list(range(3, 3 + CRUSHMap.MAX_TOPOLOGIES))
@@ -1,4 +1,7 @@
 import datetime
+import sys
+import threading
+import time
 from unittest.mock import MagicMock, patch
 import mgr_util
 
@@ -85,3 +88,77 @@ class TestCephFsEarmarkResolver:
         mock_parse_earmark.side_effect = mgr_util.EarmarkParseError
         result = resolver.check_earmark("error.test", mgr_util.EarmarkTopScope.SMB)
         assert result is False
+
+
+def test_latency_histogram():
+    h = mgr_util.LatencyHistogram()
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 100.0):
+        h.observe(seconds)
+    d = h.dump()
+    assert d['count'] == 5
+    assert d['max'] == 100.0
+    assert d['buckets']['0.001'] == 1
+    assert d['buckets']['0.005'] == 3
+    assert d['buckets']['0.5'] == 4
+    assert d['buckets']['60.0'] == 4
+    assert d['buckets']['+Inf'] == 5
+
+
+class TestModuleProfiler:
+
+    def test_timed(self):
+        profiler = mgr_util.ModuleProfiler()
+        with profiler.timed('notify', 'osd_map'):
+            pass
+        with pytest.raises(ValueError):
+            with profiler.timed('command', 'foo'):
+                raise ValueError()
+        d = profiler.dump()
+        assert d['notify']['osd_map']['count'] == 1
+        assert d['command']['foo']['count'] == 1
+
+        profiler.reset()
+        assert profiler.dump() == {}
+
+    def test_profile_method(self):
+        class Module:
+            log = MagicMock()
+            _profiler = mgr_util.ModuleProfiler()
+
+            @mgr_util.profile_method()
+            def collect(self):
+                return 42
+
+        assert Module().collect() == 42
+        assert Module._profiler.dump()['method']['collect']['count'] == 1
+
+
+def test_stack_sampler():
+    sampler = mgr_util.StackSampler(duration=10, interval=0.001)
+    sampler.start()
+    while sampler.dump()['samples'] < 3:
+        time.sleep(0.001)
+    sampler.stop()
+    sampler.join()
+    d = sampler.dump(limit=1)
+    assert not d['running']
+    assert len(d['stacks']) == 1
+    assert 'test_mgr_util.py:test_stack_sampler:' in d['stacks'][0]['stack']
+
+
+def test_stack_sampler_threads_of_other_interpreters():
+    # sys._current_frames() also has the threads of the other
+    # sub-interpreters, threading.enumerate() only has ours
+    main = threading.main_thread().ident
+    other = max(sys._current_frames()) + 1
+    frames = {main: sys._getframe(), other: sys._getframe()}
+    sampler = mgr_util.StackSampler(duration=10, interval=0.001)
+    with patch('sys._current_frames', return_value=frames):
+        assert main in sampler.thread_ids()
+        assert other not in sampler.thread_ids()
+        sampler.start()
+        while sampler.dump()['samples'] < 1:
+            time.sleep(0.001)
+        sampler.stop()
+        sampler.join()
+    assert sampler.dump()['stacks'][0]['count'] == sampler.dump()['samples']
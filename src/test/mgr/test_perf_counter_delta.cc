@@ -0,0 +1,70 @@
+#include <vector>
+
+#include "mgr/PerfCounterDelta.h"
+#include "gtest/gtest.h"
+
+using namespace std;
+
+// the samples of one counter, changed_since() as in PerfCounterInstance
+struct FakeInstance {
+  vector<pair<utime_t, uint64_t>> samples;
+
+  void push(utime_t t, uint64_t v) {
+    samples.push_back({t, v});
+  }
+  bool changed_since(utime_t since) const {
+    if (samples.empty() || samples.back().first <= since) {
+      return false;
+    }
+    for (auto p = samples.rbegin(); p != samples.rend(); ++p) {
+      if (p->first <= since) {
+        return p->second != samples.back().second;
+      }
+    }
+    return true;
+  }
+};
+
+TEST(PerfCounterDelta, Changed) {
+  FakeInstance a;
+  a.push(utime_t(10, 0), 1);
+  a.push(utime_t(20, 0), 1);
+  EXPECT_TRUE(PerfCounterDelta(utime_t(), utime_t(30, 0)).changed(a));
+  // same value as at the cursor
+  EXPECT_FALSE(PerfCounterDelta(utime_t(15, 0), utime_t(30, 0)).changed(a));
+  a.push(utime_t(25, 0), 2);
+  EXPECT_TRUE(PerfCounterDelta(utime_t(20, 0), utime_t(30, 0)).changed(a));
+}
+
+TEST(PerfCounterDelta, ReportDuringWalk) {
+  FakeInstance a, b;
+  a.push(utime_t(10, 0), 1);
+  b.push(utime_t(10, 0), 1);
+
+  PerfCounterDelta walk(utime_t(), utime_t(11, 0));
+  EXPECT_TRUE(walk.changed(a));
+  // after a was visited, reports land on both daemons, the one on b
+  // with a later timestamp than the one on a
+  a.push(utime_t(12, 0), 2);
+  b.push(utime_t(13, 0), 2);
+  EXPECT_TRUE(walk.changed(b));
+
+  // the next walk still sends the sample of a
+  PerfCounterDelta next(walk.next_cursor(), utime_t(20, 0));
+  EXPECT_TRUE(next.changed(a));
+  EXPECT_TRUE(next.changed(b));
+  EXPECT_EQ(next.next_cursor(), utime_t(20, 0) - utime_t(0, 1000));
+}
+
+TEST(PerfCounterDelta, SampleInTheSameTick) {
+  FakeInstance a;
+  a.push(utime_t(10, 0), 1);
+  PerfCounterDelta walk(utime_t(), utime_t(11, 0));
+  a.push(utime_t(11, 0), 2);
+  EXPECT_TRUE(PerfCounterDelta(walk.next_cursor(), utime_t(12, 0)).changed(a));
+}
+
+TEST(PerfCounterDelta, CursorDoesNotGoBack) {
+  PerfCounterDelta walk(utime_t(20, 0), utime_t(10, 0));
+  EXPECT_EQ(walk.next_cursor(), utime_t(20, 0));
+}